@@ -0,0 +1,167 @@
+"""
+Pre-aggregated summary tables for the Power BI layer.
+
+The pipeline fills new or empty summary tables for every date once and then
+refreshes only the submission dates touched by a load; run this module
+directly to rebuild every date from scratch.
+
+Usage (the same as python cli.py aggregates):
+    python aggregates.py --rebuild [--table TABLE]
+"""
+import sys
+
+from answer_encoding import answer_values, answers_encoded, with_answer_labels
+from cli import script_main
+from config import form_table, schema_name, table10_name, table11_name, table12_name, table6_name, table7_name, table_name
+from loaders import connect
+from multi_select import MULTI_SELECT, bridge_table
+
+# Dimensions every summary table is broken down by
+DIMENSIONS = ["date", "gender_id", "age_group_id", "country_id"]
+
+# Summary table -> multi-select question it counts. Summary and bridge
+# tables belong to a fact table, see config.form_table
+OPTION_SUMMARIES = {
+    table11_name: table6_name,
+    table12_name: table7_name,
+}
+
+
+def ensure_aggregate_tables(cur, table=table_name, backfill=True):
+    """
+    Create the summary tables and the fact table index their refresh relies on.
+    Loads only refresh the dates they touch, so with backfill summary tables
+    that are new or still empty while the fact table has rows (e.g. a database
+    upgraded from before them) are first filled for every date.
+    """
+    answer_summary = form_table(table, table10_name)
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema_name}.{answer_summary} (
+        date DATE,
+        gender_id INT,
+        age_group_id INT,
+        country_id INT,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        respondents INT NOT NULL
+    );
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {answer_summary}_date_idx ON {schema_name}.{answer_summary} (date);")
+
+    for summary, question in OPTION_SUMMARIES.items():
+        summary = form_table(table, summary)
+        _, option_col = MULTI_SELECT[question]
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema_name}.{summary} (
+            date DATE,
+            gender_id INT,
+            age_group_id INT,
+            country_id INT,
+            {option_col} TEXT NOT NULL,
+            selections INT NOT NULL
+        );
+        """)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {summary}_date_idx ON {schema_name}.{summary} (date);")
+
+    # Refreshing a date re-reads that date's submissions only
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_date_idx ON {schema_name}.{table} (date);")
+
+    if backfill and _summaries_empty(cur, table):
+        refreshed = refresh_aggregates(cur, table=table)
+        print(f"[OK] Filled the summary tables of {table} from its existing rows ({refreshed} rows)")
+
+
+def _summaries_empty(cur, table):
+    """True if the fact table has rows but none of its summary tables has any"""
+    summaries = [form_table(table, table10_name)] + [form_table(table, summary) for summary in OPTION_SUMMARIES]
+    cur.execute(f"""
+    SELECT EXISTS (SELECT 1 FROM {schema_name}.{table})
+       {"".join(f"AND NOT EXISTS (SELECT 1 FROM {schema_name}.{summary})" for summary in summaries)};
+    """)
+    return cur.fetchone()[0]
+
+
+def _date_filter(alias):
+    return f"({alias}.date = ANY(%(dates)s::date[]) OR (%(null_date)s AND {alias}.date IS NULL))"
+
+
+def refresh_aggregates(cur, dates=None, table=table_name):
+    """
+    Recompute the summary rows of the given submission dates (None in the set
+    stands for submissions without a date). dates=None rebuilds every date.
+    Runs in the caller's transaction.
+    """
+    answer_summary = form_table(table, table10_name)
+    if dates is None:
+        where = "TRUE"
+        params = {}
+    else:
+        where = _date_filter("b")
+        params = {"dates": [d for d in dates if d is not None], "null_date": None in dates}
+
+    dimensions = ", ".join(f"b.{col}" for col in DIMENSIONS)
+    # Encoded answers are grouped by code and labelled afterwards
+    encoded = answers_encoded(cur, table)
+    counts = with_answer_labels(f"""
+    SELECT {dimensions}, a.question, a.answer, count(*) AS respondents
+    FROM {schema_name}.{table} b
+    CROSS JOIN LATERAL (VALUES {answer_values("b", encoded)}) AS a(question, answer)
+    WHERE {where} AND a.answer IS NOT NULL
+    GROUP BY {dimensions}, a.question, a.answer
+    """, DIMENSIONS + ["question", "answer", "respondents"], encoded)
+
+    cur.execute(f"DELETE FROM {schema_name}.{answer_summary} b WHERE {where};", params)
+    cur.execute(f"""
+    INSERT INTO {schema_name}.{answer_summary} ({", ".join(DIMENSIONS)}, question, answer, respondents)
+    {counts};
+    """, params)
+    refreshed = cur.rowcount
+
+    for summary, question in OPTION_SUMMARIES.items():
+        summary = form_table(table, summary)
+        bridge = bridge_table(table, question)
+        lookup, option_col = MULTI_SELECT[question]
+        cur.execute(f"DELETE FROM {schema_name}.{summary} b WHERE {where};", params)
+        # Grouped by option id, labelled afterwards
+        cur.execute(f"""
+        INSERT INTO {schema_name}.{summary} ({", ".join(DIMENSIONS)}, {option_col}, selections)
+        SELECT {", ".join(f"c.{col}" for col in DIMENSIONS)}, o.label, c.selections
+        FROM (
+            SELECT {dimensions}, m.option_id, count(*) AS selections
+            FROM {schema_name}.{bridge} m
+            JOIN {schema_name}.{table} b ON b.id = m.respondent_id
+            WHERE {where}
+            GROUP BY {dimensions}, m.option_id
+        ) c
+        JOIN {schema_name}.{lookup} o ON o.id = c.option_id;
+        """, params)
+        refreshed += cur.rowcount
+
+    return refreshed
+
+
+def rebuild(table=table_name):
+    """Recompute the summary tables of a fact table for every date. Returns the rows written"""
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        ensure_aggregate_tables(cur, table, backfill=False)
+        refreshed = refresh_aggregates(cur, table=table)
+        conn.commit()
+        print(f"[OK] Rebuilt summary tables of {table} ({refreshed} rows)")
+        return refreshed
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def main():
+    return script_main("aggregates", "--rebuild",
+                       "the pipeline refreshes touched dates itself, pass --rebuild for a full rebuild")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
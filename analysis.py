@@ -0,0 +1,265 @@
+"""
+Chi-square association tests between respondent demographics and survey
+answers, computed from count matrices aggregated inside PostgreSQL, or from
+the Parquet staging store with --from-staging.
+
+Usage (the same as python cli.py analyze):
+    python analysis.py [--workers N] [--force] [--table TABLE]
+    python analysis.py --from-staging [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--table TABLE]
+"""
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from psycopg2.extras import execute_values
+from scipy.stats import chi2_contingency
+
+from answer_encoding import answer_values, answers_encoded, with_answer_labels
+from cli import script_main
+from config import KOBO_STAGING_DIR, form_table, schema_name, table9_name, table_name
+from loaders import connect
+from multi_select import MULTI_SELECT, bridge_table
+from staging import read_staged
+from transform import ANSWER_COLUMNS, ID_MAPPINGS, LOOKUP_ROWS, apply_id_mappings, explode_options
+
+# Demographic dimension -> (id column on blossom_academy, lookup table)
+DEMOGRAPHICS = {
+    "gender": ("gender_id", "gender_lookup"),
+    "age_group": ("age_group_id", "age_group_lookup"),
+    "education": ("education_id", "education_lookup"),
+    "country": ("country_id", "country_lookup"),
+}
+
+def _demographic_values():
+    return ", ".join(f"('{dim}', b.{id_col})" for dim, (id_col, _) in DEMOGRAPHICS.items())
+
+
+def answer_counts_sql(encoded=False, table=table_name):
+    """
+    Counts for every demographic x answer column pair in one scan of the fact
+    table: both sides are unpivoted with LATERAL VALUES and grouped together.
+    """
+    return with_answer_labels(f"""
+    SELECT d.demographic, d.level_id, a.question, a.answer, count(*) AS n
+    FROM {schema_name}.{table} b
+    CROSS JOIN LATERAL (VALUES {_demographic_values()}) AS d(demographic, level_id)
+    CROSS JOIN LATERAL (VALUES {answer_values("b", encoded)}) AS a(question, answer)
+    WHERE d.level_id IS NOT NULL AND a.answer IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    """, ["demographic", "level_id", "question", "answer", "n"], encoded)
+
+
+def option_counts_sql(question, table=table_name):
+    """Counts of multi-select options chosen, per demographic level"""
+    lookup, _ = MULTI_SELECT[question]
+    return f"""
+    SELECT c.demographic, c.level_id, '{question}', o.label, c.n
+    FROM (
+        SELECT d.demographic, d.level_id, m.option_id, count(*) AS n
+        FROM {schema_name}.{bridge_table(table, question)} m
+        JOIN {schema_name}.{table} b ON b.id = m.respondent_id
+        CROSS JOIN LATERAL (VALUES {_demographic_values()}) AS d(demographic, level_id)
+        WHERE d.level_id IS NOT NULL
+        GROUP BY 1, 2, 3
+    ) c
+    JOIN {schema_name}.{lookup} o ON o.id = c.option_id;
+    """
+
+
+def data_watermark(cur, table=table_name):
+    """Highest ids of the fact and bridge tables; changes whenever new submissions are loaded"""
+    bridges = [bridge_table(table, question) for question in MULTI_SELECT]
+    cur.execute(f"""
+    SELECT (SELECT max(id) FROM {schema_name}.{table}),
+           {", ".join(f"(SELECT max(id) FROM {schema_name}.{bridge})" for bridge in bridges)};
+    """)
+    return ":".join(str(value or 0) for value in cur.fetchone())
+
+
+def fetch_contingency_tables(cur, table=table_name):
+    """{(demographic, question): count matrix} with lookup labels as the row index"""
+    rows = []
+    cur.execute(answer_counts_sql(answers_encoded(cur, table), table))
+    rows.extend(cur.fetchall())
+    for question in MULTI_SELECT:
+        cur.execute(option_counts_sql(question, table))
+        rows.extend(cur.fetchall())
+    counts = pd.DataFrame(rows, columns=["demographic", "level_id", "question", "answer", "n"])
+
+    labels = {}
+    for demographic, (_, lookup) in DEMOGRAPHICS.items():
+        cur.execute(f"SELECT id, label FROM {schema_name}.{lookup};")
+        labels[demographic] = dict(cur.fetchall())
+    return contingency_tables(counts, labels)
+
+
+def _level_counts(demographic, levels, question, answers):
+    """(demographic, level_id, question, answer, n) rows for one pair of aligned columns"""
+    pairs = pd.DataFrame({"level_id": levels.to_numpy(dtype=object), "answer": answers.to_numpy(dtype=object)})
+    counts = pairs.dropna().groupby(["level_id", "answer"]).size().reset_index(name="n")
+    counts.insert(0, "demographic", demographic)
+    counts.insert(2, "question", question)
+    return counts
+
+
+def staged_contingency_tables(table=table_name, since=None, until=None):
+    """
+    fetch_contingency_tables from the Parquet staging store: only the
+    demographic, answer and multi-select columns of the date partitions
+    between since and until are read, and demographics are resolved with
+    the transform lookups.
+    """
+    if not KOBO_STAGING_DIR:
+        raise Exception("--from-staging needs KOBO_STAGING_DIR")
+    columns = [source for source, _, _ in ID_MAPPINGS] + ANSWER_COLUMNS + list(MULTI_SELECT)
+    df = read_staged(KOBO_STAGING_DIR, table, columns, since, until)
+    apply_id_mappings(df, verbose=False)
+    print(f"Read {len(df)} staged submissions of {table}")
+
+    # An option selected twice in one submission counts once, as in the bridge tables
+    options = {}
+    for question in MULTI_SELECT:
+        if question in df.columns:
+            exploded = explode_options(df[question])
+            pairs = pd.DataFrame({"row": exploded.index, "option": exploded.to_numpy()})
+            keep = ~pairs.duplicated().to_numpy()
+            options[question] = exploded[keep]
+
+    counts = []
+    for demographic, (id_col, _) in DEMOGRAPHICS.items():
+        if id_col not in df.columns:
+            continue
+        for question in ANSWER_COLUMNS:
+            if question in df.columns:
+                counts.append(_level_counts(demographic, df[id_col], question, df[question]))
+        for question, selected in options.items():
+            counts.append(_level_counts(demographic, df[id_col].reindex(selected.index), question, selected))
+
+    counts = pd.concat(counts, ignore_index=True) if counts else \
+        pd.DataFrame(columns=["demographic", "level_id", "question", "answer", "n"])
+    labels = {demographic: dict(LOOKUP_ROWS[lookup]) for demographic, (_, lookup) in DEMOGRAPHICS.items()}
+    return contingency_tables(counts, labels)
+
+
+def contingency_tables(counts, labels):
+    """Pivot (demographic, level_id, question, answer, n) rows into one labelled count matrix per pair"""
+    tables = {}
+    for (demographic, question), group in counts.groupby(["demographic", "question"]):
+        table = group.pivot_table(index="level_id", columns="answer", values="n", aggfunc="sum", fill_value=0)
+        table.index = [labels[demographic].get(level_id, level_id) for level_id in table.index]
+        tables[(demographic, question)] = table
+    return tables
+
+
+def chi_square(item):
+    """Chi-square test of independence for one ((demographic, question), count matrix) item"""
+    (demographic, question), table = item
+    observed = table.loc[table.sum(axis=1) > 0, table.sum(axis=0) > 0].to_numpy()
+    result = {"demographic": demographic, "question": question, "chi2": None, "p_value": None,
+              "dof": None, "n": int(observed.sum()), "cramers_v": None}
+    if observed.shape[0] < 2 or observed.shape[1] < 2:
+        return result
+
+    chi2, p_value, dof, _ = chi2_contingency(observed)
+    result.update(chi2=float(chi2), p_value=float(p_value), dof=int(dof),
+                  cramers_v=math.sqrt(chi2 / (result["n"] * (min(observed.shape) - 1))))
+    return result
+
+
+def ensure_results_table(cur, results_table=table9_name):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema_name}.{results_table} (
+        watermark TEXT NOT NULL,
+        demographic TEXT NOT NULL,
+        question TEXT NOT NULL,
+        chi2 DOUBLE PRECISION,
+        p_value DOUBLE PRECISION,
+        dof INT,
+        n BIGINT,
+        cramers_v DOUBLE PRECISION,
+        computed_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (watermark, demographic, question)
+    );
+    """)
+
+
+RESULT_COLUMNS = ["demographic", "question", "chi2", "p_value", "dof", "n", "cramers_v"]
+
+
+def run_analysis(conn, workers=None, force=False, table=table_name):
+    """
+    Return chi-square results for every demographic x question pair of a
+    fact table. Results cached for the current data watermark are reused
+    unless force is set.
+    """
+    results_table = form_table(table, table9_name)
+    cur = conn.cursor()
+    try:
+        ensure_results_table(cur, results_table)
+        watermark = data_watermark(cur, table)
+
+        if not force:
+            cur.execute(f"""
+            SELECT {", ".join(RESULT_COLUMNS)} FROM {schema_name}.{results_table}
+            WHERE watermark = %s;
+            """, (watermark,))
+            cached = cur.fetchall()
+            if cached:
+                conn.commit()
+                print(f"[OK] Using cached results for data watermark {watermark}")
+                return pd.DataFrame(cached, columns=RESULT_COLUMNS)
+
+        results = run_tests(fetch_contingency_tables(cur, table), workers)
+
+        # Only the latest watermark is kept
+        cur.execute(f"DELETE FROM {schema_name}.{results_table};")
+        execute_values(
+            cur,
+            f"INSERT INTO {schema_name}.{results_table} (watermark, {', '.join(RESULT_COLUMNS)}) VALUES %s",
+            [(watermark,) + tuple(result[col] for col in RESULT_COLUMNS) for result in results]
+        )
+        conn.commit()
+        print(f"[OK] Stored {len(results)} results for data watermark {watermark}")
+        return pd.DataFrame(results, columns=RESULT_COLUMNS)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def run_tests(tables, workers=None):
+    """chi_square results for every count matrix, computed in a process pool"""
+    print(f"Running {len(tables)} chi-square tests...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(chi_square, tables.items(), chunksize=4))
+
+
+def analyze(workers=None, force=False, table=table_name, from_staging=False, since=None, until=None):
+    """
+    Run the tests on their own connection, or on the staging store between
+    since and until without connecting or storing the results, print them
+    and return them.
+    """
+    if from_staging:
+        results = pd.DataFrame(run_tests(staged_contingency_tables(table, since, until), workers),
+                               columns=RESULT_COLUMNS)
+    else:
+        conn = connect()
+        try:
+            results = run_analysis(conn, workers=workers, force=force, table=table)
+        finally:
+            conn.close()
+
+    with pd.option_context("display.width", 160, "display.max_rows", None):
+        print(results.sort_values("p_value").to_string(index=False))
+    return results
+
+
+def main():
+    return script_main("analyze")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
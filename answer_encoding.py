@@ -0,0 +1,141 @@
+import pandas as pd
+
+from config import schema_name, table13_name, table_name
+from loaders import LabelLookup
+from transform import ANSWER_COLUMNS, RECORD_COLUMNS
+
+# ------------------------------
+# Dictionary-encoded survey answers
+# ------------------------------
+# In encoded mode the answer columns of a fact table (blossom_academy by
+# default) hold SMALLINT codes into answer_lookup (one row per distinct answer
+# label, shared by all questions and forms), and the <table>_labeled view
+# exposes the text labels under the original column names.
+
+
+def answers_encoded(cur, table=table_name):
+    """True if the fact table stores answer codes rather than text"""
+    cur.execute("""
+    SELECT data_type FROM information_schema.columns
+    WHERE table_schema = %s AND table_name = %s AND column_name = %s;
+    """, (schema_name, table, ANSWER_COLUMNS[0]))
+    row = cur.fetchone()
+    return row is not None and row[0] == "smallint"
+
+
+def create_label_view(cur, encoded=True, table=table_name):
+    """(Re)create the view exposing answer labels; over a TEXT table it is a plain projection"""
+    columns = []
+    joins = []
+    for col in ["id"] + RECORD_COLUMNS + ["row_fingerprint"]:
+        if encoded and col in ANSWER_COLUMNS:
+            columns.append(f"{col}_label.label AS {col}")
+            joins.append(f"LEFT JOIN {schema_name}.{table13_name} {col}_label ON {col}_label.id = b.{col}")
+        else:
+            columns.append(f'b."{col}"')
+    cur.execute(f"""
+    CREATE OR REPLACE VIEW {schema_name}.{table}_labeled AS
+    SELECT {", ".join(columns)}
+    FROM {schema_name}.{table} b
+    {" ".join(joins)};
+    """)
+
+
+def migrate_answer_columns(cur, table=table_name):
+    """
+    Create answer_lookup and convert any TEXT answer columns of the fact table
+    to SMALLINT codes in a single table rewrite. Runs in the caller's transaction.
+    """
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema_name}.{table13_name} (
+        id SMALLSERIAL PRIMARY KEY,
+        label TEXT NOT NULL UNIQUE
+    );
+    """)
+
+    cur.execute("""
+    SELECT column_name FROM information_schema.columns
+    WHERE table_schema = %s AND table_name = %s AND column_name = ANY(%s) AND data_type = 'text';
+    """, (schema_name, table, ANSWER_COLUMNS))
+    text_columns = [row[0] for row in cur.fetchall()]
+    if text_columns:
+        print(f"Encoding {len(text_columns)} answer columns of {schema_name}.{table} as SMALLINT codes...")
+        for col in text_columns:
+            cur.execute(f"""
+            INSERT INTO {schema_name}.{table13_name} (label)
+            SELECT DISTINCT {col} FROM {schema_name}.{table} WHERE {col} IS NOT NULL
+            ON CONFLICT (label) DO NOTHING;
+            """)
+
+        # Subqueries aren't allowed in ALTER COLUMN ... USING, a SQL function is
+        cur.execute(f"""
+        CREATE OR REPLACE FUNCTION {schema_name}.answer_code(answer TEXT) RETURNS SMALLINT
+        LANGUAGE sql STABLE AS $$
+            SELECT id FROM {schema_name}.{table13_name} WHERE label = answer
+        $$;
+        """)
+        cur.execute(f"DROP VIEW IF EXISTS {schema_name}.{table}_labeled;")
+        cur.execute(f"""
+        ALTER TABLE {schema_name}.{table}
+        {", ".join(f"ALTER COLUMN {col} TYPE SMALLINT USING {schema_name}.answer_code({col})" for col in text_columns)};
+        """)
+        for col in text_columns:
+            cur.execute(f"""
+            ALTER TABLE {schema_name}.{table}
+            ADD CONSTRAINT fk_{col} FOREIGN KEY ({col}) REFERENCES {schema_name}.{table13_name}(id);
+            """)
+
+    create_label_view(cur, table=table)
+
+
+def answer_values(alias, encoded):
+    """LATERAL VALUES rows unpivoting the answer columns of `alias` into (question, answer)"""
+    cast = "" if encoded else "::text"
+    return ", ".join(f"('{col}', {alias}.{col}{cast})" for col in ANSWER_COLUMNS)
+
+
+def with_answer_labels(counts_sql, columns, encoded):
+    """
+    Wrap a query whose `answer` column holds codes so it returns labels instead.
+    Counting happens on the codes; labels are joined to the small result only.
+    """
+    if not encoded:
+        return counts_sql
+    select = ", ".join("l.label AS answer" if col == "answer" else f"c.{col}" for col in columns)
+    return f"""
+    SELECT {select}
+    FROM ({counts_sql}) c
+    JOIN {schema_name}.{table13_name} l ON l.id = c.answer
+    """
+
+
+def _labels(values):
+    """Distinct labels of an answer column, read from the categories of a category column"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.categories
+    return values.dropna().unique()
+
+
+class AnswerEncoder:
+    """
+    Replaces answer labels in a record frame with answer_lookup codes, adding
+    new labels as they appear. Category columns are mapped once per category.
+    """
+
+    def __init__(self):
+        self.lookup = LabelLookup(f"{schema_name}.{table13_name}")
+
+    def _codes(self, values):
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            return self.lookup.map_series(values, dtype="Int16")
+        # Missing cells have code -1, which picks the trailing None
+        ids = pd.array([self.lookup.ids[label] for label in values.cat.categories] + [None], dtype="Int16")
+        return pd.Series(ids[values.cat.codes.to_numpy()], index=values.index)
+
+    def encode(self, cur, records):
+        columns = [col for col in ANSWER_COLUMNS if col in records.columns]
+        self.lookup.intern(cur, set().union(*(_labels(records[col]) for col in columns)))
+        for col in columns:
+            values = self._codes(records[col]).astype(object)
+            records[col] = values.where(values.notna(), None)
+        return records
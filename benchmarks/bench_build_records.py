@@ -0,0 +1,114 @@
+"""
+Compare the vectorized build_records against the original per-row
+df.iterrows() loop on synthetic, already-mapped survey chunks.
+
+Usage:
+    python benchmarks/bench_build_records.py --rows 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transform import RECORD_COLUMNS, build_records  # noqa: E402
+
+
+def legacy_build_records(df):
+    """The original "Prepare records for insertion" loop from pipeline.py"""
+    records = []
+    skipped = 0
+    for idx, (_, row) in enumerate(df.iterrows()):
+        try:
+            start = None
+            end = None
+            date = None
+
+            try:
+                if "start" in df.columns and pd.notna(row["start"]):
+                    start = pd.to_datetime(row["start"])
+            except:
+                pass
+
+            try:
+                if "end" in df.columns and pd.notna(row["end"]):
+                    end = pd.to_datetime(row["end"])
+            except:
+                pass
+
+            try:
+                if "submission_time" in df.columns and pd.notna(row["submission_time"]):
+                    date = pd.to_datetime(row["submission_time"]).date()
+            except:
+                pass
+
+            def safe_get_col(col_name):
+                try:
+                    if col_name in df.columns:
+                        val = row[col_name]
+                        return val if pd.notna(val) else None
+                except:
+                    pass
+                return None
+
+            records.append((start, end, date) + tuple(safe_get_col(col) for col in RECORD_COLUMNS[3:]))
+        except Exception:
+            skipped += 1
+    return records, skipped
+
+
+def make_frame(rows, seed=0):
+    """Synthetic chunk shaped like the output of apply_id_mappings"""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp("2025-01-01T08:00:00")
+    offsets = pd.to_timedelta(rng.integers(0, 180 * 24 * 3600, rows), unit="s")
+    starts = (base + offsets).strftime("%Y-%m-%dT%H:%M:%S.000+01:00").to_numpy(dtype=object)
+    ends = (base + offsets + pd.Timedelta(minutes=7)).strftime("%Y-%m-%dT%H:%M:%S.000+01:00").to_numpy(dtype=object)
+    submitted = (base + offsets + pd.Timedelta(minutes=9)).strftime("%Y-%m-%dT%H:%M:%S").to_numpy(dtype=object)
+
+    # A sprinkling of missing and malformed timestamps
+    starts[rng.random(rows) < 0.01] = None
+    ends[rng.random(rows) < 0.01] = "not a date"
+
+    df = pd.DataFrame({"start": starts, "end": ends, "submission_time": submitted})
+    for col in ("gender_id", "age_group_id", "education_id", "country_id"):
+        ids = rng.integers(1, 7, rows).astype(float)
+        ids[rng.random(rows) < 0.05] = np.nan
+        df[col] = ids
+    answers = np.array(["Yes", "No", "Not sure", "Strongly agree", "Agree", "Disagree", None], dtype=object)
+    for col in RECORD_COLUMNS[7:]:
+        df[col] = answers[rng.integers(0, len(answers), rows)]
+    return df
+
+
+def timed(fn, df):
+    started = time.perf_counter()
+    result = fn(df)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the vectorized builder")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = make_frame(rows)
+        (records, _), vectorized_time = timed(build_records, df)
+        line = f"{rows:>10,} rows  vectorized {vectorized_time:8.2f}s ({rows / vectorized_time:,.0f} rows/s)"
+
+        if not args.skip_legacy:
+            (legacy_records, _), legacy_time = timed(legacy_build_records, df)
+            if records != legacy_records:
+                raise SystemExit(f"[ERROR] vectorized records differ from the iterrows loop at {rows} rows")
+            line += f"  iterrows {legacy_time:8.2f}s  speedup {legacy_time / vectorized_time:6.1f}x  [identical]"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare load throughput of the execute_values and COPY engines against a
+local PostgreSQL. Connection settings come from the same PG_* variables as
+the pipeline; everything is created in a throwaway schema that is dropped
+at the end.
+
+Usage:
+    python benchmarks/bench_load_engines.py --rows 100000 500000
+"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_build_records import make_frame  # noqa: E402
+from loaders import LOAD_ENGINES, load_rows  # noqa: E402
+from transform import RECORD_COLUMNS, build_record_frame  # noqa: E402
+
+BENCH_SCHEMA = "bench_load_engines"
+
+FACT_DDL = f"""
+CREATE TABLE {BENCH_SCHEMA}.blossom_academy (
+    id SERIAL PRIMARY KEY,
+    start TIMESTAMP,
+    "end" TIMESTAMP,
+    date DATE,
+    gender_id INT,
+    age_group_id INT,
+    education_id INT,
+    country_id INT,
+    {", ".join(f"{col} TEXT" for col in RECORD_COLUMNS[7:])}
+);
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--engines", nargs="+", default=sorted(LOAD_ENGINES), choices=sorted(LOAD_ENGINES))
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'))
+    conn = psycopg2.connect(
+        host=os.getenv("PG_HOST"),
+        database=os.getenv("PG_DATABASE"),
+        user=os.getenv("PG_USER"),
+        password=os.getenv("PG_PASSWORD"),
+        port=os.getenv("PG_PORT"),
+    )
+    cur = conn.cursor()
+    try:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA};")
+        cur.execute(FACT_DDL)
+        conn.commit()
+
+        for rows in args.rows:
+            records = build_record_frame(make_frame(rows))
+            for engine in args.engines:
+                cur.execute(f"TRUNCATE {BENCH_SCHEMA}.blossom_academy;")
+                conn.commit()
+
+                started = time.perf_counter()
+                load_rows(cur, f"{BENCH_SCHEMA}.blossom_academy", RECORD_COLUMNS, records, engine=engine)
+                conn.commit()
+                elapsed = time.perf_counter() - started
+
+                cur.execute(f"SELECT count(*) FROM {BENCH_SCHEMA}.blossom_academy;")
+                loaded = cur.fetchone()[0]
+                print(f"{rows:>10,} rows  {engine:<15} {elapsed:8.2f}s  {rows / elapsed:>12,.0f} rows/s  ({loaded:,} in table)")
+    finally:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare the vectorized multi-select explode against the original per-cell
+split_options + Series.map + explode on synthetic multi-select columns.
+
+Usage:
+    python benchmarks/bench_multi_select.py --rows 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transform import explode_options  # noqa: E402
+
+
+def split_options(cell_value):
+    """The original per-cell splitter from transform.py"""
+    if pd.isna(cell_value):
+        return []
+
+    value_str = str(cell_value).strip()
+
+    if ',' in value_str:
+        sep = ','
+    elif ';' in value_str:
+        sep = ';'
+    else:
+        sep = None
+
+    if sep:
+        parts = [part.strip() for part in value_str.split(sep)]
+    else:
+        parts = value_str.split()  # whitespace split
+
+    return [part for part in parts if part]
+
+
+def legacy_explode(series):
+    options = series.map(split_options).explode()
+    return options[options.notna()]
+
+
+def make_column(rows, seed=0):
+    """Comma separated selections, with some single, semicolon or space separated and missing cells"""
+    rng = np.random.default_rng(seed)
+    choices = np.array(["Government, Schools", "Families, NGOs, Everyone", "Everyone", "Schools",
+                        "Government, Families", "Families NGOs", "Schools;NGOs", None], dtype=object)
+    return pd.Series(choices[rng.integers(0, len(choices), rows)])
+
+
+def timed(fn, series):
+    started = time.perf_counter()
+    result = fn(series)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        series = make_column(rows)
+        options, vectorized_time = timed(explode_options, series)
+        legacy_options, legacy_time = timed(legacy_explode, series)
+        if options.tolist() != legacy_options.tolist() or not options.index.equals(legacy_options.index):
+            raise SystemExit(f"[ERROR] vectorized options differ from split_options at {rows} rows")
+        print(f"{rows:>10,} rows  vectorized {vectorized_time:8.2f}s  per-cell {legacy_time:8.2f}s  "
+              f"speedup {legacy_time / vectorized_time:6.1f}x  [identical]")
+
+
+if __name__ == "__main__":
+    main()
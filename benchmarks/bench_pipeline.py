@@ -0,0 +1,253 @@
+"""
+End-to-end pipeline benchmark. pipeline.py fetches a synthetic Kobo export
+(see synthetic_export.py) from a local stand-in of the export endpoint,
+transforms it and loads it into a disposable PostgreSQL database.
+Throughput and peak memory per stage are taken from the pipeline's run
+report (see metrics.py), as the median of --repeat runs.
+
+The database is created and dropped for every run: by default a throwaway
+database on the server of the PG_* settings, or with --initdb a temporary
+cluster started with initdb/pg_ctl (from PATH or --pg-bin). Exports are
+generated once per size and seed in --data-dir and reused, so runs are
+comparable. --output saves the results, and --baseline compares them with
+an earlier --output, exiting with status 1 when a stage got slower or
+bigger than --tolerance allows.
+
+Usage:
+    python benchmarks/bench_pipeline.py --rows 1000 100000 1000000 --repeat 3 --output before.json
+    python benchmarks/bench_pipeline.py --rows 1000 100000 1000000 --repeat 3 --baseline before.json
+    python benchmarks/bench_pipeline.py --rows 100000 --env PG_LOAD_ENGINE=copy --env KOBO_CHUNK_SIZE=20000
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from dotenv import load_dotenv
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from fake_kobo import FakeKobo  # noqa: E402
+from synthetic_export import ensure_export  # noqa: E402
+
+# Stages shorter than this are too noisy to flag as regressions
+MIN_COMPARED_SECONDS = 0.05
+
+
+# ------------------------------
+# Disposable PostgreSQL
+# ------------------------------
+@contextmanager
+def throwaway_database():
+    """A new database on the PG_* server, dropped afterwards. Yields the PG_* settings to use"""
+    load_dotenv(os.path.join(REPO_DIR, '.env'))
+    settings = {key: os.getenv(key) or "" for key in ("PG_HOST", "PG_PORT", "PG_USER", "PG_PASSWORD", "PG_DATABASE")}
+    name = f"kobo_bench_{os.getpid()}"
+    conn = psycopg2.connect(host=settings["PG_HOST"], port=settings["PG_PORT"], user=settings["PG_USER"],
+                            password=settings["PG_PASSWORD"], database=settings["PG_DATABASE"])
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(f"DROP DATABASE IF EXISTS {name};")
+        cur.execute(f"CREATE DATABASE {name};")
+        yield dict(settings, PG_DATABASE=name)
+    finally:
+        cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE);")
+        cur.close()
+        conn.close()
+
+
+@contextmanager
+def temporary_cluster(pg_bin=None):
+    """A PostgreSQL cluster in a temporary directory, listening on a Unix socket only"""
+    def binary(name):
+        path = os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise SystemExit(f"[ERROR] {name} not found, pass the PostgreSQL bin directory with --pg-bin")
+        return path
+
+    data_dir = tempfile.mkdtemp(prefix="kobo_bench_pg_")
+    try:
+        subprocess.run([binary("initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust"],
+                       check=True, capture_output=True, text=True)
+        subprocess.run([binary("pg_ctl"), "-D", data_dir, "-l", os.path.join(data_dir, "server.log"), "-w",
+                        "-o", f"-c listen_addresses='' -c unix_socket_directories={data_dir}", "start"],
+                       check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        raise SystemExit(f"[ERROR] {os.path.basename(e.cmd[0])} failed: {(e.stderr or e.stdout).strip()}")
+    try:
+        yield {"PG_HOST": data_dir, "PG_PORT": "5432", "PG_USER": "postgres", "PG_PASSWORD": "",
+               "PG_DATABASE": "postgres"}
+    finally:
+        subprocess.run([binary("pg_ctl"), "-D", data_dir, "-m", "fast", "-w", "stop"], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+# ------------------------------
+# One pipeline run
+# ------------------------------
+def run_pipeline(csv_url, database, extra_env, verbose=False):
+    """Run pipeline.py against csv_url and the given database, returning its run report"""
+    with tempfile.TemporaryDirectory(prefix="kobo_bench_run_") as run_dir:
+        env = dict(os.environ, **database,
+                   KOBO_CSV_URL=csv_url, KOBO_EXTRACTOR="csv", KOBO_FORMS_FILE="", KOBO_INCREMENTAL="false",
+                   KOBO_CACHE="false", KOBO_CACHE_DIR=run_dir, PIPELINE_REPORT_DIR=run_dir, PG_SAVE_RUNS="false")
+        env.update(extra_env)
+        completed = subprocess.run([sys.executable, "pipeline.py"], cwd=REPO_DIR, env=env,
+                                   capture_output=not verbose, text=True)
+        reports = glob.glob(os.path.join(run_dir, "run_*.json"))
+        if completed.returncode != 0 or not reports:
+            output = (completed.stdout or "")[-2000:] + (completed.stderr or "")[-2000:]
+            raise SystemExit(f"[ERROR] pipeline.py failed (exit {completed.returncode}):\n{output}")
+        with open(reports[0], encoding="utf-8") as f:
+            report = json.load(f)
+    if report["status"] != "ok":
+        raise SystemExit(f"[ERROR] pipeline run failed: {[form['error'] for form in report['forms']]}")
+    return report
+
+
+def stage_totals(report):
+    """Stage totals of a run report, summed over its forms"""
+    totals = {}
+    for form_stages in report["stages"].values():
+        for name, stage in form_stages.items():
+            total = totals.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "rows": 0,
+                                             "bytes": 0, "peak_rss_mb": 0.0})
+            total["wall_seconds"] += stage["wall_seconds"]
+            total["cpu_seconds"] += stage["cpu_seconds"]
+            total["rows"] += stage["rows_out"] or stage["rows_in"]
+            total["bytes"] += stage["bytes"]
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], stage["peak_rss_mb"])
+    return totals
+
+
+def summarize(rows, meta, reports):
+    """Median timings and highest peaks over the repeated runs of one export size"""
+    runs = [stage_totals(report) for report in reports]
+    stages = {}
+    for name in runs[0]:
+        passes = [run[name] for run in runs if name in run]
+        wall = statistics.median(stage["wall_seconds"] for stage in passes)
+        stages[name] = {
+            "wall_seconds": wall,
+            "cpu_seconds": statistics.median(stage["cpu_seconds"] for stage in passes),
+            "rows": passes[0]["rows"],
+            "rows_per_second": passes[0]["rows"] / wall if wall else None,
+            "bytes": passes[0]["bytes"],
+            "peak_rss_mb": max(stage["peak_rss_mb"] for stage in passes),
+        }
+    wall = statistics.median(report["wall_seconds"] for report in reports)
+    return {
+        "rows": rows,
+        "expected_rows": meta["rows"] - meta["malformed"],
+        "loaded_rows": reports[0]["forms"][0]["records"],
+        "export_bytes": meta["bytes"],
+        "wall_seconds": wall,
+        "rows_per_second": rows / wall,
+        "peak_rss_mb": max(report["peak_rss_mb"] for report in reports),
+        "stages": stages,
+    }
+
+
+def print_result(result):
+    print(f"{result['rows']:>10,} rows  {result['wall_seconds']:8.2f}s  {result['rows_per_second']:>10,.0f} rows/s  "
+          f"peak RSS {result['peak_rss_mb']:,.0f} MB  ({result['loaded_rows']:,} loaded)")
+    for name, stage in sorted(result["stages"].items(), key=lambda item: -item[1]["wall_seconds"]):
+        rate = f"{stage['rows_per_second']:>12,.0f} rows/s" if stage["rows_per_second"] else " " * 19
+        print(f"    {name:<20} {stage['wall_seconds']:8.2f}s wall  {stage['cpu_seconds']:8.2f}s cpu  {rate}  "
+              f"peak RSS {stage['peak_rss_mb']:,.0f} MB")
+
+
+# ------------------------------
+# Regression check
+# ------------------------------
+def compare(results, baseline, tolerance):
+    """Lines describing stages that got slower or bigger than the baseline allows"""
+    regressions = []
+    previous = {result["rows"]: result for result in baseline["results"]}
+    for result in results:
+        before = previous.get(result["rows"])
+        if before is None:
+            continue
+        checks = [("total", before, result)] + [(name, before["stages"][name], stage)
+                                                for name, stage in result["stages"].items() if name in before["stages"]]
+        for name, old, new in checks:
+            if old["wall_seconds"] >= MIN_COMPARED_SECONDS and new["wall_seconds"] > old["wall_seconds"] * (1 + tolerance):
+                regressions.append(f"{result['rows']:,} rows {name}: {old['wall_seconds']:.2f}s -> "
+                                   f"{new['wall_seconds']:.2f}s")
+            if new["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(f"{result['rows']:,} rows {name}: peak RSS {old['peak_rss_mb']:,.0f} MB -> "
+                                   f"{new['peak_rss_mb']:,.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size; timings are the median")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--malformed", type=float, default=0.001, help="share of rows with a stray extra field")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "kobo_bench_exports"),
+                        help="where generated exports are kept between runs")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="pipeline setting for every run, e.g. PG_LOAD_ENGINE=copy")
+    parser.add_argument("--initdb", action="store_true", help="run against a temporary cluster instead of PG_*")
+    parser.add_argument("--pg-bin", help="directory with initdb and pg_ctl for --initdb")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown or memory growth (0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's output")
+    args = parser.parse_args()
+
+    extra_env = dict(setting.split("=", 1) for setting in args.env)
+    results = []
+    for rows in args.rows:
+        started = time.perf_counter()
+        path, meta = ensure_export(args.data_dir, rows, args.seed, args.malformed)
+        print(f"Export of {rows:,} rows: {meta['bytes'] / 2**20:,.1f} MB, {meta['malformed']:,} malformed rows "
+              f"({time.perf_counter() - started:.1f}s)")
+
+        server = FakeKobo(0, export_path=path).start()
+        try:
+            reports = []
+            for _ in range(args.repeat):
+                database = temporary_cluster(args.pg_bin) if args.initdb else throwaway_database()
+                with database as settings:
+                    reports.append(run_pipeline(server.csv_url, settings, extra_env, args.verbose))
+        finally:
+            server.stop()
+
+        result = summarize(rows, meta, reports)
+        results.append(result)
+        print_result(result)
+        if result["loaded_rows"] != result["expected_rows"]:
+            print(f"  WARNING: loaded {result['loaded_rows']:,} rows, expected {result['expected_rows']:,}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": dict(extra_env, seed=args.seed, malformed=args.malformed, repeat=args.repeat),
+                       "results": results}, f, indent=2)
+        print(f"[OK] Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"  REGRESSION: {line}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"[OK] No stage regressed by more than {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
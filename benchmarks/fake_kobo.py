@@ -0,0 +1,264 @@
+"""
+Local stand-in for the KoboToolbox v2 API, for running the pipeline offline.
+
+Serves one synthetic form:
+    /api/v2/assets/<uid>/?format=json     survey definition (labels, choices)
+    /api/v2/assets/<uid>/data.json        submissions, paged with start/limit,
+                                          filtered by a _submission_time $gte query
+    /api/v2/assets/<uid>/export.csv       the same submissions as a ';' CSV export,
+                                          or a file given as export_path
+
+Submissions are generated from their position, so any page of a large form is
+produced on demand without holding the form in memory.
+
+Usage:
+    python benchmarks/fake_kobo.py --rows 100000 --port 8000 [--latency 0.2] [--fail-every 5]
+    KOBO_EXTRACTOR=json KOBO_ASSET_URL=http://127.0.0.1:8000/api/v2/assets/aFakeForm/ python pipeline.py
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transform import column_mappings  # noqa: E402
+
+ASSET_UID = "aFakeForm"
+MAX_PAGE_SIZE = 30000
+
+CHOICES = {
+    "gender": [("female", "Female"), ("male", "Male"), ("prefer_not_to_say", "Prefer not to say")],
+    "age_group": [("under_18", "Under 18"), ("18_24", "18-24"), ("25_34", "25-34"), ("35_44", "35-44"),
+                  ("45_54", "45-54"), ("55_plus", "55+")],
+    "education": [("none", "No formal education"), ("primary", "Primary"), ("secondary", "Secondary"),
+                  ("vocational", "Vocational/Technical"), ("university", "University/College"),
+                  ("postgraduate", "Postgraduate")],
+    "country": [("nigeria", "Nigeria"), ("rwanda", "Rwanda"), ("other", "Other")],
+    "yes_no": [("yes", "Yes"), ("no", "No"), ("not_sure", "Not sure")],
+    "confidence": [("very", "Very confident"), ("somewhat", "Somewhat confident"), ("not", "Not confident")],
+    "agreement": [("strongly_agree", "Strongly agree"), ("agree", "Agree"), ("neutral", "Neutral"),
+                  ("disagree", "Disagree"), ("strongly_disagree", "Strongly disagree")],
+    "importance": [("very", "Very important"), ("important", "Important"), ("not", "Not important")],
+    "responsibility": [("government", "Government"), ("schools", "Schools"), ("families", "Families"),
+                       ("ngos", "NGOs"), ("everyone", "Everyone")],
+    "actions": [("education", "Education"), ("policies", "Policies"), ("awareness", "Awareness"),
+                ("funding", "Funding")],
+}
+
+# Database column -> (choice list, select type) of every question in column_mappings
+QUESTIONS = {
+    "gender": ("gender", "select_one"),
+    "age_group": ("age_group", "select_one"),
+    "education": ("education", "select_one"),
+    "country": ("country", "select_one"),
+    "heard_gender_inclusion": ("yes_no", "select_one"),
+    "confidence_understanding": ("confidence", "select_one"),
+    "definition_equal_rights": ("agreement", "select_one"),
+    "definition_only_women": ("agreement", "select_one"),
+    "practiced_in_country": ("yes_no", "select_one"),
+    "importance_in_society": ("importance", "select_one"),
+    "personal_exclusion": ("yes_no", "select_one"),
+    "witnessed_exclusion": ("yes_no", "select_one"),
+    "barriers_exist": ("yes_no", "select_one"),
+    "responsibility_responses": ("responsibility", "select_multiple"),
+    "prioritized_actions": ("actions", "select_multiple"),
+    "govt_create_policies": ("agreement", "select_one"),
+    "govt_provide_education": ("agreement", "select_one"),
+    "govt_support_groups": ("agreement", "select_one"),
+    "govt_equal_representation": ("agreement", "select_one"),
+}
+
+# Question label (what the CSV export uses as header) per database column
+LABELS = {db_col: kobo_col.replace("_", " ") for kobo_col, db_col in column_mappings.items()
+          if not kobo_col.startswith("_")}
+
+FIRST_SUBMISSION = datetime(2025, 1, 1, 8, 0, 0)
+
+
+def survey_content():
+    """The asset's content: questions in a group, as the v2 asset endpoint returns it"""
+    survey = [{"type": "start", "name": "start"}, {"type": "end", "name": "end"},
+              {"type": "begin_group", "name": "group_survey", "label": ["Survey"]}]
+    for db_col, (list_name, select_type) in QUESTIONS.items():
+        survey.append({"type": select_type, "name": db_col, "label": [LABELS[db_col]],
+                       "select_from_list_name": list_name})
+    survey.append({"type": "end_group"})
+    choices = [{"list_name": list_name, "name": name, "label": [label]}
+               for list_name, options in CHOICES.items() for name, label in options]
+    return {"survey": survey, "choices": choices}
+
+
+def _pick(position, salt, count):
+    """Deterministic pseudo-random index in range(count) for a submission position"""
+    return ((position + 1) * 2654435761 + salt * 40503) % 2**32 % count
+
+
+def submission(position):
+    """The data.json record of the submission at `position` (0-based, in _id order)"""
+    submitted = FIRST_SUBMISSION + timedelta(minutes=7 * position)
+    record = {
+        "_id": 1000 + position,
+        "_uuid": f"fake-{position:09d}",
+        "_submission_time": submitted.strftime("%Y-%m-%dT%H:%M:%S"),
+        "start": (submitted - timedelta(minutes=9)).strftime("%Y-%m-%dT%H:%M:%S.000+01:00"),
+        "end": (submitted - timedelta(minutes=2)).strftime("%Y-%m-%dT%H:%M:%S.000+01:00"),
+    }
+    for salt, (db_col, (list_name, select_type)) in enumerate(QUESTIONS.items()):
+        options = CHOICES[list_name]
+        # About one answer in twenty is skipped
+        if _pick(position, salt + 100, 20) == 0:
+            continue
+        if select_type == "select_one":
+            value = options[_pick(position, salt, len(options))][0]
+        else:
+            picked = {_pick(position, salt, len(options)), _pick(position, salt + 50, len(options))}
+            value = " ".join(options[i][0] for i in sorted(picked))
+        record[f"group_survey/{db_col}"] = value
+    return record
+
+
+def first_position_at(submission_time, rows):
+    """Position of the first submission at or after an ISO timestamp"""
+    wanted = datetime.fromisoformat(submission_time).replace(tzinfo=None)
+    minutes = (wanted - FIRST_SUBMISSION).total_seconds() / 60
+    return min(rows, max(0, -int(-minutes // 7)))
+
+
+def export_csv(rows, start=0):
+    """The submissions as a Kobo CSV export with label headers and values"""
+    labels = {list_name: dict(options) for list_name, options in CHOICES.items()}
+    headers = ["start", "end"] + [LABELS[db_col] for db_col in QUESTIONS] + ["_submission_time", "_uuid", "_id"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\n")
+    writer.writerow(headers)
+    for position in range(start, rows):
+        record = submission(position)
+        values = [record["start"], record["end"]]
+        for db_col, (list_name, select_type) in QUESTIONS.items():
+            value = record.get(f"group_survey/{db_col}")
+            if value is None:
+                values.append("")
+            elif select_type == "select_one":
+                values.append(labels[list_name][value])
+            else:
+                values.append(", ".join(labels[list_name][name] for name in value.split()))
+        values += [record["_submission_time"], record["_uuid"], record["_id"]]
+        writer.writerow(values)
+    return buffer.getvalue().encode("utf-8")
+
+
+class FakeKobo:
+    """Threaded HTTP server for one synthetic form of `rows` submissions"""
+
+    def __init__(self, rows, port=0, latency=0.0, fail_every=0, export_path=None):
+        self.rows = rows
+        self.export_path = export_path
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.asset_url = f"http://127.0.0.1:{self.server.server_port}/api/v2/assets/{ASSET_UID}/"
+        self.csv_url = self.asset_url + "export.csv"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == f"/api/v2/assets/{ASSET_UID}/":
+                    self._send(json.dumps({"uid": ASSET_UID, "content": survey_content()}).encode(), "application/json")
+                elif url.path == f"/api/v2/assets/{ASSET_UID}/data.json":
+                    fake.data_page(self, params)
+                elif url.path == f"/api/v2/assets/{ASSET_UID}/export.csv" and fake.export_path:
+                    self._send_file(fake.export_path, "text/csv")
+                elif url.path == f"/api/v2/assets/{ASSET_UID}/export.csv":
+                    self._send(export_csv(fake.rows), "text/csv")
+                else:
+                    self.send_error(404)
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_file(self, path, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(os.path.getsize(path)))
+                self.end_headers()
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile, length=1024 * 1024)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def data_page(self, handler, params):
+        with self._lock:
+            self.requests += 1
+            fail = self.fail_every and self.requests % self.fail_every == 0
+            if fail:
+                self.failures += 1
+        if fail:
+            handler.send_error(503, "Injected failure")
+            return
+        if self.latency:
+            time.sleep(self.latency)
+
+        first = 0
+        if "query" in params:
+            since = json.loads(params["query"]).get("_submission_time", {}).get("$gte")
+            if since:
+                first = first_position_at(since, self.rows)
+        start = int(params.get("start", 0))
+        limit = min(int(params.get("limit", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        positions = range(first + start, min(self.rows, first + start + limit))
+        body = {"count": self.rows - first, "next": None, "previous": None,
+                "results": [submission(position) for position in positions]}
+        handler._send(json.dumps(body).encode(), "application/json")
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every data.json page")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every Nth data.json request with a 503")
+    args = parser.parse_args()
+
+    fake = FakeKobo(args.rows, args.port, args.latency, args.fail_every)
+    print(f"Serving {args.rows} submissions")
+    print(f"  KOBO_ASSET_URL={fake.asset_url}")
+    print(f"  KOBO_CSV_URL={fake.csv_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Generate a synthetic Kobo CSV export of any size for benchmarks.
+
+The export uses the question labels Kobo puts in its header row, the answer
+spellings the lookups have to cope with (en-dash age groups, education
+synonyms, unknown countries), multi-select cells separated by commas,
+semicolons or spaces, unparseable timestamps and a share of malformed rows
+with too many fields, which the reader skips. Rows are written in blocks, so
+a 10M row export is generated without holding it in memory, and the same
+seed always produces the same file.
+
+Usage:
+    python benchmarks/synthetic_export.py --rows 1000000 --output /tmp/kobo_1m.csv
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transform import column_mappings  # noqa: E402
+
+BLOCK_SIZE = 100_000
+FIRST_SUBMISSION = np.datetime64("2024-01-01T08:00:00")
+
+# Question label as found in a Kobo export header, per database column
+LABELS = {db_col: kobo_col.replace("_", " ").replace("and inclusion", "& inclusion")
+          for kobo_col, db_col in column_mappings.items() if not kobo_col.startswith("_")}
+
+# Kobo metadata columns around the questions
+LEADING_COLUMNS = ["start", "end"]
+TRAILING_COLUMNS = ["_id", "_uuid", "_submission_time", "_validation_status", "_notes", "_status",
+                    "_submitted_by", "__version__", "_tags", "_index"]
+
+YES_NO = ["Yes", "No", "Not sure", ""]
+AGREEMENT = ["Strongly agree", "Agree", "Neutral", "Disagree", "Strongly disagree", ""]
+
+# Answer spellings per database column, including the variants the lookups map
+# and a few values no lookup knows
+ANSWERS = {
+    "gender": ["Female", "Male", "Prefer not to say", "Other", "female", "MALE ", ""],
+    "age_group": ["Under 18", "18-24", "18–24", "25-34", "25–34", "35-44", "35–44", "45-54", "45–54",
+                  "55+", "55 +", "Unknown", ""],
+    "education": ["No formal education", "Primary", "Secondary", "Vocational/Technical", "Vocational",
+                  "University/College", "Tertiary education", "University", "College", "Postgraduate",
+                  "Graduate", "Secondary school", "Masters degree", "PhD", ""],
+    "country": ["Nigeria", "Rwanda", "Other", "nigeria", "Ghana", "Kenya", ""],
+    "heard_gender_inclusion": YES_NO,
+    "confidence_understanding": ["Very confident", "Somewhat confident", "Not confident", ""],
+    "definition_equal_rights": AGREEMENT,
+    "definition_only_women": AGREEMENT,
+    "practiced_in_country": YES_NO,
+    "importance_in_society": ["Very important", "Important", "Not important", ""],
+    "personal_exclusion": YES_NO,
+    "witnessed_exclusion": YES_NO,
+    "barriers_exist": YES_NO,
+    "govt_create_policies": AGREEMENT,
+    "govt_provide_education": AGREEMENT,
+    "govt_support_groups": AGREEMENT,
+    "govt_equal_representation": AGREEMENT,
+}
+
+MULTI_SELECT_OPTIONS = {
+    "responsibility_responses": ["Government", "Schools", "Families", "NGOs", "Everyone"],
+    "prioritized_actions": ["Education", "Policies", "Awareness", "Funding"],
+}
+
+
+def multi_select_cells(options, seed):
+    """Distinct selections of one to three options, joined with ', ', ';' or ' ', plus an empty cell"""
+    rng = np.random.default_rng(seed)
+    cells = [""]
+    for _ in range(200):
+        picked = rng.choice(options, size=rng.integers(1, 4), replace=False)
+        cells.append(rng.choice([", ", ";", " "]).join(picked))
+    return sorted(set(cells))
+
+
+def header():
+    return LEADING_COLUMNS + [LABELS[db_col] for db_col in column_mappings.values()
+                              if db_col in LABELS] + TRAILING_COLUMNS
+
+
+def make_block(first, rows, seed, invalid_timestamps=0.005):
+    """DataFrame of `rows` submissions starting at position `first`"""
+    rng = np.random.default_rng([seed, first])
+    positions = np.arange(first, first + rows)
+    submitted = FIRST_SUBMISSION + positions * np.timedelta64(37, "s")
+    started = submitted - np.timedelta64(9, "m") - rng.integers(0, 600, rows) * np.timedelta64(1, "s")
+
+    start = pd.Series(np.datetime_as_string(started, unit="ms")) + "+01:00"
+    end = pd.Series(np.datetime_as_string(submitted - np.timedelta64(2, "m"), unit="ms")) + "+01:00"
+    start[rng.random(rows) < invalid_timestamps] = "N/A"
+
+    columns = {"start": start, "end": end}
+    for db_col in column_mappings.values():
+        if db_col in ANSWERS:
+            values = np.array(ANSWERS[db_col], dtype=object)
+        elif db_col in MULTI_SELECT_OPTIONS:
+            values = np.array(multi_select_cells(MULTI_SELECT_OPTIONS[db_col], seed), dtype=object)
+        else:
+            continue
+        columns[LABELS[db_col]] = values[rng.integers(0, len(values), rows)]
+
+    columns["_id"] = positions + 1
+    columns["_uuid"] = "bench-" + pd.Series(positions).astype(str)
+    columns["_submission_time"] = np.datetime_as_string(submitted, unit="s")
+    columns["_validation_status"] = ""
+    columns["_notes"] = ""
+    columns["_status"] = "submitted_via_web"
+    columns["_submitted_by"] = ""
+    columns["__version__"] = "vBenchmark"
+    columns["_tags"] = ""
+    columns["_index"] = positions + 1
+    return pd.DataFrame(columns, columns=header())
+
+
+def write_export(path, rows, seed=0, malformed=0.001):
+    """
+    Write a `rows` line export to path and a <path>.json sidecar describing it.
+    Returns the sidecar dict, whose `malformed` count is the rows the reader skips.
+    """
+    rng = np.random.default_rng(seed)
+    skipped = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(";".join(header()) + "\n")
+        for first in range(0, rows, BLOCK_SIZE):
+            block = make_block(first, min(BLOCK_SIZE, rows - first), seed)
+            lines = block.to_csv(sep=";", header=False, index=False, lineterminator="\n").split("\n")[:-1]
+            # A stray field at the end, as left by a broken line in the export
+            for line_number in np.flatnonzero(rng.random(len(lines)) < malformed):
+                # The first row must stay intact, or pandas takes its extra field as an index column
+                if first == 0 and line_number == 0:
+                    continue
+                lines[line_number] += ";unexpected"
+                skipped += 1
+            f.write("\n".join(lines) + "\n")
+
+    meta = {"rows": rows, "seed": seed, "malformed_share": malformed, "malformed": skipped,
+            "bytes": os.path.getsize(path)}
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def ensure_export(data_dir, rows, seed=0, malformed=0.001):
+    """Path and sidecar of a generated export, reusing one generated earlier with the same settings"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"kobo_export_{rows}_{seed}_{malformed}.csv")
+    if os.path.exists(path) and os.path.exists(path + ".json"):
+        with open(path + ".json", encoding="utf-8") as f:
+            return path, json.load(f)
+    return path, write_export(path, rows, seed, malformed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--malformed", type=float, default=0.001, help="share of rows with a stray extra field")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    meta = write_export(args.output, args.rows, args.seed, args.malformed)
+    print(f"[OK] Wrote {meta['rows']:,} rows ({meta['malformed']:,} malformed, {meta['bytes'] / 2**20:.1f} MB) "
+          f"to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Command line entry point for the pipeline and the modules around it.
+
+Each command imports what it needs when it runs, so `--help` and `forms`
+start without loading pandas, psycopg2 or scipy.
+
+Usage:
+    python cli.py run [--from-cache | --from-staging [--since DATE] [--until DATE]]
+    python cli.py fetch
+    python cli.py load [--from-staging [--since DATE] [--until DATE]]
+    python cli.py dry-run [--from-cache | --from-staging [--since DATE] [--until DATE]]
+    python cli.py analyze [--workers N] [--force] [--table TABLE] [--from-staging [--since DATE] [--until DATE]]
+    python cli.py aggregates [--table TABLE]
+    python cli.py partition [--table TABLE] [--batch-rows N]
+    python cli.py forms
+
+pipeline.py, analysis.py, aggregates.py and partitioning.py run the
+matching command through script_main, so every option is defined here.
+"""
+import argparse
+import sys
+
+
+def _staged_dates(args):
+    return (args.since, args.until) if args.from_staging else None
+
+
+def run(args):
+    from pipeline import run
+
+    return run(from_cache=args.from_cache, staged_dates=_staged_dates(args))["status"] == "ok"
+
+
+def fetch(args):
+    from pipeline import fetch
+
+    return not any(result["error"] for result in fetch())
+
+
+def load(args):
+    from pipeline import run
+
+    if args.from_staging:
+        return run(staged_dates=_staged_dates(args))["status"] == "ok"
+    return run(from_cache=True)["status"] == "ok"
+
+
+def dry_run(args):
+    from pipeline import dry_run
+
+    return dry_run(from_cache=args.from_cache, staged_dates=_staged_dates(args))["status"] == "ok"
+
+
+def analyze(args):
+    from analysis import analyze
+    from config import table_name
+
+    analyze(workers=args.workers, force=args.force, table=args.table or table_name,
+            from_staging=args.from_staging, since=args.since, until=args.until)
+    return True
+
+
+def aggregates(args):
+    from aggregates import rebuild
+    from config import table_name
+
+    rebuild(args.table or table_name)
+    return True
+
+
+def partition(args):
+    from config import table_name
+    from partitioning import MIGRATION_BATCH_ROWS, migrate
+
+    migrate(args.table or table_name, args.batch_rows or MIGRATION_BATCH_ROWS)
+    return True
+
+
+def forms(args):
+    from forms import load_forms
+
+    for form in load_forms():
+        print(f"{form['name']:<24} {form['table']:<24} {form['extractor']:<5} {form['url']}")
+    return True
+
+
+def _staging_arguments(command, description, group=None):
+    (group or command).add_argument("--from-staging", action="store_true", help=f"{description} (KOBO_STAGING_DIR)")
+    command.add_argument("--since", help="with --from-staging, first submission date (YYYY-MM-DD)")
+    command.add_argument("--until", help="with --from-staging, last submission date (YYYY-MM-DD)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("run", help="fetch, transform and load every form")
+    source = command.add_mutually_exclusive_group()
+    source.add_argument("--from-cache", action="store_true", help="replay the cached export snapshots")
+    _staging_arguments(command, "load the staging store instead", source)
+    command.set_defaults(handler=run)
+
+    command = commands.add_parser("fetch", help="download the CSV exports into the cache without loading them")
+    command.set_defaults(handler=fetch)
+
+    command = commands.add_parser("load", help="load the cached export snapshots (run --from-cache)")
+    _staging_arguments(command, "load the staging store instead")
+    command.set_defaults(handler=load)
+
+    command = commands.add_parser("dry-run", help="fetch and transform every form without writing anything")
+    source = command.add_mutually_exclusive_group()
+    source.add_argument("--from-cache", action="store_true", help="transform the cached export snapshots")
+    _staging_arguments(command, "transform the staging store", source)
+    command.set_defaults(handler=dry_run)
+
+    command = commands.add_parser("analyze", help="chi-square tests between demographics and answers")
+    command.add_argument("--workers", type=int, default=None, help="processes running the tests")
+    command.add_argument("--force", action="store_true", help="recompute even if results for the data watermark exist")
+    command.add_argument("--table", default=None, help="fact table to analyse")
+    _staging_arguments(command, "test the staging store instead of PostgreSQL")
+    command.set_defaults(handler=analyze)
+
+    command = commands.add_parser("aggregates", help="rebuild the summary tables for every date")
+    command.add_argument("--table", default=None, help="fact table whose summaries are rebuilt")
+    command.set_defaults(handler=aggregates)
+
+    command = commands.add_parser("partition", help="move an unpartitioned fact table onto monthly partitions")
+    command.add_argument("--table", default=None, help="fact table to partition")
+    command.add_argument("--batch-rows", type=int, default=None, help="rows copied per transaction (default 50000)")
+    command.set_defaults(handler=partition)
+
+    command = commands.add_parser("forms", help="list the configured forms")
+    command.set_defaults(handler=forms)
+
+    args = parser.parse_args(argv)
+    return 0 if args.handler(args) else 1
+
+
+def script_main(command, action=None, hint=None):
+    """
+    Entry point of a module run as a script: `python <module>.py [action]
+    ARGS` runs `python cli.py <command> ARGS`. `action` is the flag the
+    module has always required (e.g. --rebuild), and `hint` explains it
+    when it is missing.
+    """
+    argv = sys.argv[1:]
+    if action is not None and "-h" not in argv and "--help" not in argv:
+        if action not in argv:
+            print(f"usage: {sys.argv[0]} {action} [options]\nerror: nothing to do; {hint}", file=sys.stderr)
+            return 2
+        argv.remove(action)
+    return main([command] + argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+
+from dotenv import load_dotenv
+
+# ------------------------------
+# Load environment variables
+# ------------------------------
+env_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(env_path)
+
+KOBO_USERNAME = os.getenv("KOBO_USERNAME")
+KOBO_PASSWORD = os.getenv("KOBO_PASSWORD")
+KOBO_CSV_URL = os.getenv("KOBO_CSV_URL")
+
+PG_HOST = os.getenv("PG_HOST")
+PG_DATABASE = os.getenv("PG_DATABASE")
+PG_USER = os.getenv("PG_USER")
+PG_PASSWORD = os.getenv("PG_PASSWORD")
+PG_PORT = os.getenv("PG_PORT")
+
+# Where submissions come from: "csv" (the KOBO_CSV_URL export) or "json"
+# (pages of <KOBO_ASSET_URL>/data.json, e.g. https://kf.kobotoolbox.org/api/v2/assets/<uid>/)
+KOBO_EXTRACTOR = os.getenv("KOBO_EXTRACTOR", "csv")
+KOBO_ASSET_URL = os.getenv("KOBO_ASSET_URL")
+
+# data.json page size, pages fetched at once and retries of a failed page request
+KOBO_API_PAGE_SIZE = int(os.getenv("KOBO_API_PAGE_SIZE", "1000"))
+KOBO_API_WORKERS = int(os.getenv("KOBO_API_WORKERS", "4"))
+KOBO_API_RETRIES = int(os.getenv("KOBO_API_RETRIES", "5"))
+
+# Number of submissions parsed, mapped and loaded at a time. Peak memory
+# depends on this value rather than on the size of the export.
+KOBO_CHUNK_SIZE = int(os.getenv("KOBO_CHUNK_SIZE", "5000"))
+
+# Only fetch and load submissions newer than the stored sync watermark
+KOBO_INCREMENTAL = os.getenv("KOBO_INCREMENTAL", "false").lower() in ("1", "true", "yes")
+
+# Keep a compressed snapshot of the export and skip runs where Kobo reports no change
+KOBO_CACHE = os.getenv("KOBO_CACHE", "false").lower() in ("1", "true", "yes")
+KOBO_CACHE_DIR = os.getenv("KOBO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".kobo_cache"))
+
+# Resolved export header mappings, keyed by a hash of the header row
+KOBO_SCHEMA_CACHE = os.path.join(KOBO_CACHE_DIR, "schema_mappings.json")
+
+# Append every mapped chunk to date-partitioned Parquet files under this
+# directory (empty for none), for replays and analyses without Kobo
+KOBO_STAGING_DIR = os.getenv("KOBO_STAGING_DIR", "")
+
+# Validation issues that send a row to rejected_submissions instead of the
+# fact table (reason codes are listed in validation.py); other issues are
+# only counted in the run report. Malformed CSV lines are always rejected.
+KOBO_REJECT_REASONS = [reason.strip() for reason in os.getenv(
+    "KOBO_REJECT_REASONS", "missing_uuid,duplicate_uuid,missing_submission_time,invalid_submission_time"
+).split(",") if reason.strip()]
+
+# How rows reach PostgreSQL: "execute_values" (multi-row INSERT) or "copy" (COPY into a staging table)
+PG_LOAD_ENGINE = os.getenv("PG_LOAD_ENGINE", "execute_values")
+
+# Multi-form mode: JSON file listing the forms to load (see forms.example.json).
+# Without it the single KOBO_CSV_URL form is loaded into blossom_academy.
+KOBO_FORMS_FILE = os.getenv("KOBO_FORMS_FILE")
+
+# Forms downloaded at the same time, processes transforming chunks (0 transforms
+# in the loading thread) and the most PostgreSQL connections open at once
+KOBO_FETCH_WORKERS = int(os.getenv("KOBO_FETCH_WORKERS", "4"))
+KOBO_TRANSFORM_WORKERS = int(os.getenv("KOBO_TRANSFORM_WORKERS", "0"))
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "4"))
+
+# Store the Likert answer columns of blossom_academy as SMALLINT codes into
+# answer_lookup (blossom_academy_labeled keeps exposing the text labels)
+PG_ENCODE_ANSWERS = os.getenv("PG_ENCODE_ANSWERS", "false").lower() in ("1", "true", "yes")
+
+# Create new fact tables range-partitioned by month of the submission date
+# (existing tables move with `python partitioning.py --migrate`)
+PG_PARTITION_BY_DATE = os.getenv("PG_PARTITION_BY_DATE", "false").lower() in ("1", "true", "yes")
+
+# Run metrics: directory of the JSON run reports (empty for none), whether a
+# row is added to pipeline_runs, tracemalloc peaks per stage (slows the run
+# down) and the stages to run under cProfile, e.g. "transform,load.insert"
+PIPELINE_REPORT_DIR = os.getenv("PIPELINE_REPORT_DIR",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_reports"))
+PG_SAVE_RUNS = os.getenv("PG_SAVE_RUNS", "false").lower() in ("1", "true", "yes")
+PIPELINE_TRACEMALLOC = os.getenv("PIPELINE_TRACEMALLOC", "false").lower() in ("1", "true", "yes")
+PIPELINE_PROFILE = [stage.strip() for stage in os.getenv("PIPELINE_PROFILE", "").split(",") if stage.strip()]
+
+schema_name = "gender_inclusion_project"
+table_name = "blossom_academy"
+table2_name = "gender_lookup"
+table3_name = "age_group_lookup"
+table4_name = "education_lookup"
+table5_name = "country_lookup"
+table6_name = "responsibility_responses"
+table7_name = "prioritized_actions"
+table8_name = "sync_state"
+table9_name = "chi_square_results"
+table10_name = "answer_summary"
+table11_name = "responsibility_option_summary"
+table12_name = "action_option_summary"
+table13_name = "answer_lookup"
+table14_name = "responsibility_option_lookup"
+table15_name = "action_option_lookup"
+table16_name = "pipeline_runs"
+table17_name = "rejected_submissions"
+
+
+def form_table(table, name):
+    """
+    Name of a table that belongs to a fact table. blossom_academy keeps the
+    original names; other forms' fact tables prefix theirs.
+    """
+    return name if table == table_name else f"{table}_{name}"
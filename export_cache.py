@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+# ------------------------------
+# On-disk cache of raw Kobo exports
+# ------------------------------
+# Each export URL has a gzip-compressed snapshot of the last body received
+# (<key>.csv.gz) and a metadata file (<key>.json) with its ETag,
+# Last-Modified, SHA-256 and whether the snapshot has been loaded.
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def _cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def _paths(cache_dir, url):
+    key = _cache_key(url)
+    return os.path.join(cache_dir, f"{key}.csv.gz"), os.path.join(cache_dir, f"{key}.json")
+
+
+def read_metadata(cache_dir, url):
+    """Metadata stored for url, or None if nothing has been cached yet"""
+    _, meta_path = _paths(cache_dir, url)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_metadata(cache_dir, url, meta):
+    _, meta_path = _paths(cache_dir, url)
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def conditional_headers(meta):
+    """If-None-Match / If-Modified-Since headers for the cached snapshot"""
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def store_snapshot(cache_dir, url, response, params=None):
+    """
+    Stream a 200 response body into a compressed snapshot while hashing it.
+
+    Returns True if the body differs from the cached snapshot (which is then
+    replaced) and False if it is byte-for-byte identical.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    body_path, _ = _paths(cache_dir, url)
+    tmp_path = body_path + ".tmp"
+
+    digest = hashlib.sha256()
+    size = 0
+    with gzip.open(tmp_path, "wb") as out:
+        for block in response.iter_content(chunk_size=READ_BLOCK_SIZE):
+            digest.update(block)
+            size += len(block)
+            out.write(block)
+
+    meta = read_metadata(cache_dir, url) or {}
+    changed = meta.get("sha256") != digest.hexdigest() or not os.path.exists(body_path)
+    if changed:
+        os.replace(tmp_path, body_path)
+        meta = {"url": url, "sha256": digest.hexdigest(), "size": size, "loaded": False}
+    else:
+        os.remove(tmp_path)
+
+    meta.update({
+        "params": params,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+    })
+    _write_metadata(cache_dir, url, meta)
+    return changed
+
+
+def open_snapshot(cache_dir, url):
+    """Binary stream of the cached export body for url"""
+    body_path, _ = _paths(cache_dir, url)
+    if not os.path.exists(body_path):
+        raise Exception(f"No cached export for {url} in {cache_dir}")
+    return gzip.open(body_path, "rb")
+
+
+def mark_loaded(cache_dir, url):
+    """Record that the current snapshot has been transformed and loaded"""
+    meta = read_metadata(cache_dir, url)
+    if meta is not None:
+        meta["loaded"] = True
+        _write_metadata(cache_dir, url, meta)
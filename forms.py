@@ -0,0 +1,56 @@
+import json
+
+from config import (
+    KOBO_ASSET_URL,
+    KOBO_CSV_URL,
+    KOBO_EXTRACTOR,
+    KOBO_FORMS_FILE,
+    KOBO_PASSWORD,
+    KOBO_USERNAME,
+    table_name,
+)
+
+# ------------------------------
+# Forms
+# ------------------------------
+# Only the standard library and config are imported here, so the forms can
+# be listed without loading pandas or psycopg2.
+
+EXTRACTORS = ("csv", "json")
+
+
+def load_forms(path=KOBO_FORMS_FILE):
+    """
+    Forms to load: the entries of a KOBO_FORMS_FILE, or the single form
+    configured with KOBO_CSV_URL (or KOBO_ASSET_URL for the json extractor),
+    loaded into blossom_academy.
+    """
+    if not path:
+        url = KOBO_ASSET_URL if KOBO_EXTRACTOR == "json" else KOBO_CSV_URL
+        forms = [{"name": table_name, "url": url, "table": table_name}]
+    else:
+        with open(path, encoding="utf-8") as f:
+            forms = json.load(f)["forms"]
+
+    for form in forms:
+        if not form.get("url") or not form.get("table"):
+            raise Exception(f"Every form needs a url and a table, got {form}")
+        form.setdefault("name", form["table"])
+        form.setdefault("username", KOBO_USERNAME)
+        form.setdefault("password", KOBO_PASSWORD)
+        form.setdefault("extractor", KOBO_EXTRACTOR)
+        if form["extractor"] not in EXTRACTORS:
+            raise Exception(f"extractor must be one of {list(EXTRACTORS)}, got {form['extractor']!r}")
+        # Messages of forms loading in parallel are prefixed with the form name
+        form["log_prefix"] = f"[{form['name']}] " if len(forms) > 1 else ""
+
+    for key in ("table", "url"):
+        values = [form[key] for form in forms]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise Exception(f"Forms must not share a {key}: {duplicates}")
+    return forms
+
+
+def say(form, message):
+    print(f"{form['log_prefix']}{message}")
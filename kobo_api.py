@@ -0,0 +1,149 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import KOBO_API_PAGE_SIZE, KOBO_API_RETRIES, KOBO_API_WORKERS
+from metrics import add_bytes
+
+# ------------------------------
+# Paginated Kobo v2 data.json extractor
+# ------------------------------
+# Alternative to the CSV export for forms whose export is slow to generate.
+# Submissions are read from <asset url>/data.json with limit/start, several
+# pages at a time, and turned into DataFrames with the same headers and label
+# values as a CSV export ("labels" format), so the rest of the pipeline
+# (clean_column_names, column_mappings, ...) doesn't know the difference.
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_session(auth=None, workers=KOBO_API_WORKERS, retries=KOBO_API_RETRIES):
+    """requests.Session with a connection per worker and exponential backoff on transient errors"""
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(["GET"]), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.auth = auth
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get(session, url, params=None):
+    response = session.get(url, params=params, timeout=120)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch {url}: {response.status_code}")
+    return response
+
+
+def _get_json(session, url, params=None):
+    return _get(session, url, params).json()
+
+
+def _get_page(session, url, params):
+    """A data.json page and the size of its body"""
+    response = _get(session, url, params)
+    return response.json(), len(response.content)
+
+
+def _label(row, default):
+    label = row.get("label")
+    if isinstance(label, list):
+        label = next((value for value in label if value), None)
+    return label or default
+
+
+def _name(row):
+    return row.get("name") or row.get("$autoname")
+
+
+def load_form_fields(session, asset_url):
+    """
+    Field name -> (CSV header, select type, {choice name: label}) from the
+    asset's survey definition. Groups are keyed by their last path segment,
+    the way data.json keys ("group/question") are matched.
+    """
+    content = _get_json(session, asset_url, {"format": "json"})["content"]
+
+    choices = {}
+    for choice in content.get("choices", []):
+        choices.setdefault(choice.get("list_name"), {})[_name(choice)] = _label(choice, _name(choice))
+
+    fields = {}
+    for row in content.get("survey", []):
+        name = _name(row)
+        if not name or row.get("type") in ("begin_group", "end_group", "begin_repeat", "end_repeat"):
+            continue
+        select_type, _, list_name = row.get("type", "").partition(" ")
+        if select_type not in ("select_one", "select_multiple"):
+            select_type = None
+        list_name = row.get("select_from_list_name") or list_name
+        fields[name] = (_label(row, name), select_type, choices.get(list_name, {}))
+    return fields
+
+
+def _label_values(series, select_type, choice_labels):
+    """Replace choice names with labels, once per distinct value"""
+    codes, uniques = pd.factorize(series)
+    if select_type == "select_one":
+        labels = [choice_labels.get(value, value) for value in uniques]
+    else:
+        labels = [", ".join(choice_labels.get(choice, choice) for choice in str(value).split()) for value in uniques]
+    return pd.Series(pd.array(labels + [None], dtype=object)[codes], index=series.index)
+
+
+def results_frame(results, fields):
+    """DataFrame of data.json results with CSV export headers and label values"""
+    df = pd.DataFrame.from_records(results)
+    headers = {}
+    for key in df.columns:
+        header, select_type, choice_labels = fields.get(key.rsplit("/", 1)[-1], (key, None, {}))
+        if select_type:
+            df[key] = _label_values(df[key], select_type, choice_labels)
+        headers[key] = header
+    return df.rename(columns=headers)
+
+
+def iter_data_pages(session, asset_url, params=None, page_size=KOBO_API_PAGE_SIZE, workers=KOBO_API_WORKERS):
+    """
+    Yield the `results` list of every data.json page in submission order.
+    The first page gives the total count; the remaining pages are fetched
+    `workers` at a time.
+    """
+    data_url = asset_url.rstrip("/") + "/data.json"
+    # Paging through a stable order keeps pages disjoint while new submissions arrive
+    params = dict(params or {}, sort=json.dumps({"_id": 1}))
+
+    first, size = _get_page(session, data_url, dict(params, start=0, limit=page_size))
+    # Pages are counted by the thread consuming them, within its read stage
+    add_bytes(size)
+    yield first["results"]
+    starts = range(page_size, first.get("count", 0), page_size)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for start in starts:
+            pending.append(pool.submit(_get_page, session, data_url, dict(params, start=start, limit=page_size)))
+            # Only `workers` pages are held ahead of the one being consumed
+            if len(pending) > workers:
+                page, size = pending.pop(0).result()
+                add_bytes(size)
+                yield page["results"]
+        for future in pending:
+            page, size = future.result()
+            add_bytes(size)
+            yield page["results"]
+
+
+def iter_submission_frames(asset_url, auth=None, params=None, page_size=KOBO_API_PAGE_SIZE,
+                           workers=KOBO_API_WORKERS):
+    """DataFrame chunks of a form's submissions, one per data.json page, shaped like the CSV export"""
+    with make_session(auth, workers) as session:
+        fields = load_form_fields(session, asset_url)
+        for results in iter_data_pages(session, asset_url, params, page_size, workers):
+            if results:
+                yield results_frame(results, fields)
@@ -0,0 +1,241 @@
+import io
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import PG_DATABASE, PG_HOST, PG_PASSWORD, PG_PORT, PG_USER
+
+
+def _connect_params():
+    return {
+        "host": PG_HOST,
+        "database": PG_DATABASE,
+        "user": PG_USER,
+        "password": PG_PASSWORD,
+        "port": PG_PORT,
+    }
+
+
+def connect():
+    """Open a connection to the PostgreSQL database configured in .env"""
+    return psycopg2.connect(**_connect_params())
+
+
+class ConnectionPool:
+    """
+    At most `size` connections shared between threads. connection() waits
+    for a free one instead of raising like ThreadedConnectionPool does when
+    it is exhausted.
+    """
+
+    def __init__(self, size):
+        self._pool = ThreadedConnectionPool(0, size, **_connect_params())
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            conn = self._pool.getconn()
+            try:
+                yield conn
+            finally:
+                # An open transaction is rolled back before the connection is reused
+                self._pool.putconn(conn)
+
+    def close(self):
+        self._pool.closeall()
+
+
+# ------------------------------
+# Load engines
+# ------------------------------
+# Every engine inserts `rows` (a DataFrame holding `columns`, or a list of
+# tuples in `columns` order) into `table` with ON CONFLICT DO NOTHING
+# semantics. A DataFrame's other columns and its column order are ignored. It returns the
+# number of rows sent to the server or, when `returning` names columns, the
+# values of those columns for the rows that were actually inserted.
+
+
+def _column_list(columns):
+    return ", ".join(f'"{col}"' for col in columns)
+
+
+def _as_tuples(rows, columns):
+    if isinstance(rows, pd.DataFrame):
+        return list(rows[columns].itertuples(index=False, name=None))
+    return rows
+
+
+def _as_frame(rows, columns):
+    if isinstance(rows, pd.DataFrame):
+        return rows[columns]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def _returning_clause(returning):
+    return f" RETURNING {_column_list(returning)}" if returning else ""
+
+
+def insert_execute_values(cur, table, columns, rows, returning=None, page_size=1000):
+    """Multi-row INSERT ... VALUES statements built client-side by execute_values"""
+    rows = _as_tuples(rows, columns)
+    insert_sql = (f"INSERT INTO {table} ({_column_list(columns)}) VALUES %s ON CONFLICT DO NOTHING"
+                  f"{_returning_clause(returning)};")
+    result = execute_values(cur, insert_sql, rows, page_size=page_size, fetch=bool(returning))
+    return result if returning else len(rows)
+
+
+def insert_copy(cur, table, columns, rows, returning=None, stage_name="load_stage"):
+    """
+    Stream rows with COPY ... FROM STDIN (CSV format) into a temporary staging
+    table, then merge them into `table` with one INSERT ... SELECT so the
+    target's ON CONFLICT DO NOTHING behavior is kept.
+
+    A DataFrame is written to the COPY buffer directly with to_csv, without
+    building a Python tuple per row.
+    """
+    frame = _as_frame(rows, columns)
+    column_list = _column_list(columns)
+
+    cur.execute(f"DROP TABLE IF EXISTS pg_temp.{stage_name};")
+    cur.execute(f"CREATE TEMP TABLE {stage_name} AS SELECT {column_list} FROM {table} WITH NO DATA;")
+
+    # Stage TIMESTAMP columns as TIMESTAMPTZ so UTC offsets in the source
+    # values are converted exactly as psycopg2 does for execute_values
+    cur.execute(f"""
+    SELECT attname FROM pg_attribute
+    WHERE attrelid = 'pg_temp.{stage_name}'::regclass AND atttypid = 'timestamp'::regtype;
+    """)
+    for (col,) in cur.fetchall():
+        cur.execute(f'ALTER TABLE {stage_name} ALTER COLUMN "{col}" TYPE TIMESTAMPTZ;')
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {stage_name} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    cur.execute(f"""
+    INSERT INTO {table} ({column_list})
+    SELECT {column_list} FROM {stage_name}
+    ON CONFLICT DO NOTHING{_returning_clause(returning)};
+    """)
+    result = cur.fetchall() if returning else len(frame)
+    cur.execute(f"DROP TABLE {stage_name};")
+    return result
+
+
+def select_new_rows(cur, table, rows, key="row_fingerprint"):
+    """
+    Drop rows whose key is already in `table`. Only the key column is compared
+    on the server, so an unchanged chunk costs one index lookup per row and
+    writes nothing.
+    """
+    rows = rows.drop_duplicates(subset=[key])
+    cur.execute(f'SELECT "{key}" FROM {table} WHERE "{key}" = ANY(%s);', (rows[key].tolist(),))
+    existing = [row[0] for row in cur.fetchall()]
+    return rows[~rows[key].isin(existing)]
+
+
+def has_legacy_rows(cur, table, key="row_fingerprint"):
+    """True if `table` holds rows loaded before its key column existed (NULL key)"""
+    cur.execute(f'SELECT 1 FROM {table} WHERE "{key}" IS NULL LIMIT 1;')
+    return cur.fetchone() is not None
+
+
+def link_legacy_rows(cur, table, columns, rows, keys, engine="execute_values", stage_name="legacy_stage"):
+    """
+    Fill in the `keys` columns of legacy rows of `table` (rows whose last key
+    is NULL) from the `rows` holding the same values in every other column.
+
+    `rows` are loaded into a temporary staging table with the same column
+    types, and the legacy rows are updated from it with one set-based UPDATE.
+    Identical rows are paired one for one, so of several copies left by
+    earlier reruns only one is linked. Rows whose first key is already
+    stored are left out. Returns the last key of the rows linked.
+    """
+    payload = [col for col in columns if col not in keys]
+    key = keys[-1]
+
+    def row_text(alias):
+        return f"ROW({', '.join(f'{alias}.{_column_list([col])}' for col in payload)})::text"
+
+    cur.execute(f"DROP TABLE IF EXISTS pg_temp.{stage_name};")
+    cur.execute(f"CREATE TEMP TABLE {stage_name} AS SELECT {_column_list(columns)} FROM {table} WITH NO DATA;")
+    load_rows(cur, f"pg_temp.{stage_name}", columns, rows, engine=engine)
+
+    # Row texts of identical typed values are identical, so the pairing is a hash join
+    cur.execute(f"""
+    UPDATE {table} t SET {", ".join(f'"{col}" = m."{col}"' for col in keys)}
+    FROM (
+        SELECT legacy.id, {", ".join(f'incoming."{col}"' for col in keys)}
+        FROM (
+            SELECT l.id, {row_text("l")} AS payload,
+                   row_number() OVER (PARTITION BY {row_text("l")} ORDER BY l.id) AS copy
+            FROM {table} l WHERE l."{key}" IS NULL
+        ) legacy
+        JOIN (
+            SELECT {", ".join(f's."{col}"' for col in keys)}, {row_text("s")} AS payload,
+                   row_number() OVER (PARTITION BY {row_text("s")} ORDER BY s."{key}") AS copy
+            FROM {stage_name} s
+            WHERE NOT EXISTS (SELECT 1 FROM {table} d WHERE d."{keys[0]}" = s."{keys[0]}")
+        ) incoming USING (payload, copy)
+    ) m
+    WHERE t.id = m.id
+    RETURNING t."{key}";
+    """)
+    linked = [row[0] for row in cur.fetchall()]
+    cur.execute(f"DROP TABLE {stage_name};")
+    return linked
+
+
+class LabelLookup:
+    """
+    Client-side cache of an (id, label UNIQUE) lookup table with a serial id.
+    Labels missing from the table are inserted the first time they are seen.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.ids = {}
+
+    def intern(self, cur, labels):
+        missing = [label for label in labels if label not in self.ids]
+        if not missing:
+            return
+        # Look up first: ON CONFLICT still consumes a sequence value per label
+        cur.execute(f"SELECT label, id FROM {self.table} WHERE label = ANY(%s);", (missing,))
+        self.ids.update(cur.fetchall())
+        missing = [label for label in missing if label not in self.ids]
+        if not missing:
+            return
+        cur.execute(f"""
+        INSERT INTO {self.table} (label)
+        SELECT unnest(%s::text[])
+        ON CONFLICT (label) DO NOTHING;
+        """, (missing,))
+        cur.execute(f"SELECT label, id FROM {self.table} WHERE label = ANY(%s);", (missing,))
+        self.ids.update(cur.fetchall())
+
+    def map_series(self, series, dtype="Int64"):
+        """Ids of interned labels, <NA> for missing values"""
+        codes, uniques = pd.factorize(series)
+        # Missing cells have code -1, which picks the trailing None
+        ids = pd.array([self.ids[label] for label in uniques] + [None], dtype=dtype)
+        return pd.Series(ids[codes], index=series.index)
+
+
+LOAD_ENGINES = {
+    "execute_values": insert_execute_values,
+    "copy": insert_copy,
+}
+
+
+def load_rows(cur, table, columns, rows, engine="execute_values", returning=None):
+    """Insert rows into table with the named load engine"""
+    if engine not in LOAD_ENGINES:
+        raise ValueError(f"Unknown load engine {engine!r}, expected one of {sorted(LOAD_ENGINES)}")
+    return LOAD_ENGINES[engine](cur, table, columns, rows, returning=returning)
@@ -0,0 +1,299 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from config import schema_name, table16_name
+
+# ------------------------------
+# Per-stage run metrics
+# ------------------------------
+# Every pipeline stage runs inside RunMetrics.stage (or measure, in worker
+# processes), which records wall and CPU time, rows in and out, bytes
+# fetched and peak memory. Passes of the same stage are summed per form,
+# and the run ends with a JSON report and optionally a pipeline_runs row.
+
+_local = threading.local()
+
+
+def _active_stages():
+    if not hasattr(_local, "stages"):
+        _local.stages = []
+    return _local.stages
+
+
+def add_bytes(count):
+    """Add bytes received from Kobo to the stages running in this thread"""
+    for stage in _active_stages():
+        stage["bytes"] += count
+
+
+def _rss_mb():
+    """(current, peak) RSS of this process in MB"""
+    # VmHWM belongs to this process image; ru_maxrss also counts the parent's
+    # peak inherited through fork and exec (both are in kilobytes on Linux)
+    sizes = {}
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    sizes[line[:5]] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if len(sizes) < 2:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+    return sizes["VmRSS"], sizes["VmHWM"]
+
+
+# The peak (VmHWM) is restarted once per run, by reset_peak_rss. A stage
+# samples the current and peak RSS when it starts and ends: if the peak rose
+# meanwhile, the stage reports the new peak; otherwise the higher of its two
+# current samples, a lower bound of its own peak.
+
+
+def process_peak_rss_mb():
+    """Peak RSS of this process since reset_peak_rss"""
+    return _rss_mb()[1]
+
+
+def reset_peak_rss():
+    """Start measuring the process peak RSS afresh from the current RSS, e.g. at the start of a run"""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+@contextmanager
+def measure(name, stages, rows_in=None):
+    """
+    Time a block with wall and thread CPU clocks and append its record to
+    `stages`. The yielded dict takes rows_out (and rows_in when it is only
+    known inside the block). Usable in worker processes: records are plain dicts.
+    """
+    stage = {"stage": name, "rows_in": rows_in, "rows_out": None, "bytes": 0, "peak_rss_mb": 0.0}
+    active = _active_stages()
+    if tracemalloc.is_tracing() and not active:
+        tracemalloc.reset_peak()
+    active.append(stage)
+    rss, peak = _rss_mb()
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield stage
+    finally:
+        stage["wall_seconds"] = time.perf_counter() - wall
+        stage["cpu_seconds"] = time.thread_time() - cpu
+        end_rss, end_peak = _rss_mb()
+        stage["peak_rss_mb"] = end_peak if end_peak > peak else max(rss, end_rss)
+        if tracemalloc.is_tracing():
+            stage["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        active.remove(stage)
+        stages.append(stage)
+
+
+class CountingReader(io.RawIOBase):
+    """Binary stream wrapper that reports every byte read through add_bytes"""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.raw.readinto(buffer)
+        if count:
+            add_bytes(count)
+        return count
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class RunMetrics:
+    """Stage totals, counters and cProfile stats of one pipeline run, shared by the form threads"""
+
+    def __init__(self, profile=(), trace_memory=False):
+        self.started_at = datetime.now(timezone.utc)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.stages = {}
+        self.counts = {}
+        self.profile = set(profile)
+        self.profiles = {}
+        self._lock = threading.Lock()
+        reset_peak_rss()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add(self, form, records):
+        """Add measure() records (from this process or a worker) to a form's stage totals"""
+        with self._lock:
+            totals = self.stages.setdefault(form, {})
+            for record in records:
+                stage = totals.setdefault(record["stage"], {
+                    "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                    "rows_in": 0, "rows_out": 0, "bytes": 0, "peak_rss_mb": 0.0,
+                })
+                stage["calls"] += 1
+                for key in ("wall_seconds", "cpu_seconds", "rows_in", "rows_out", "bytes"):
+                    stage[key] += record.get(key) or 0
+                for key in ("peak_rss_mb", "peak_traced_mb"):
+                    if key in record:
+                        stage[key] = max(stage.get(key, 0.0), record[key])
+
+    def count(self, form, name, value=1):
+        """Add to a form's counter (rows skipped, values left unmapped, ...)"""
+        if not value:
+            return
+        with self._lock:
+            counts = self.counts.setdefault(form, {})
+            counts[name] = counts.get(name, 0) + value
+
+    @contextmanager
+    def profiled(self, name):
+        """Run the block under cProfile when `name` is listed in PIPELINE_PROFILE"""
+        if name not in self.profile:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                if name in self.profiles:
+                    self.profiles[name].add(profiler)
+                else:
+                    self.profiles[name] = pstats.Stats(profiler)
+
+    @contextmanager
+    def stage(self, form, name, rows_in=None):
+        """Measure one pass through a stage of a form"""
+        records = []
+        with self.profiled(name), measure(name, records, rows_in) as stage:
+            yield stage
+        self.add(form, records)
+
+    def timed_chunks(self, form, name, chunks):
+        """Yield the chunks of an iterator, measuring each next() as a stage pass"""
+        iterator = iter(chunks)
+        while True:
+            with self.stage(form, name) as stage:
+                chunk = next(iterator, None)
+                stage["rows_out"] = len(chunk) if chunk is not None else 0
+            if chunk is None:
+                return
+            yield chunk
+
+    def report(self, summaries):
+        """The run report as a JSON-serializable dict"""
+        wall = time.perf_counter() - self._wall
+        stages = {}
+        for form, totals in self.stages.items():
+            stages[form] = {}
+            for name, stage in totals.items():
+                rows = stage["rows_out"] or stage["rows_in"]
+                stages[form][name] = dict(stage, rows_per_second=rows / stage["wall_seconds"]
+                                          if stage["wall_seconds"] else None)
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "wall_seconds": wall,
+            "cpu_seconds": time.process_time() - self._cpu,
+            "peak_rss_mb": process_peak_rss_mb(),
+            "status": "failed" if any(summary["error"] for summary in summaries) else "ok",
+            "forms": summaries,
+            "stages": stages,
+            "counts": self.counts,
+        }
+        if tracemalloc.is_tracing():
+            report["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        return report
+
+    def write_report(self, report, report_dir):
+        """Write the report (and any cProfile stats) to report_dir, returning the report path"""
+        os.makedirs(report_dir, exist_ok=True)
+        stamp = self.started_at.strftime("%Y%m%dT%H%M%SZ")
+        path = os.path.join(report_dir, f"run_{stamp}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        for name, stats in self.profiles.items():
+            stats.dump_stats(os.path.join(report_dir, f"run_{stamp}_{name}.prof"))
+        return path
+
+
+def print_stage_report(report):
+    """Stage totals over all forms, slowest first"""
+    totals = {}
+    for form_stages in report["stages"].values():
+        for name, stage in form_stages.items():
+            total = totals.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "rows": 0, "bytes": 0})
+            total["calls"] += stage["calls"]
+            total["wall_seconds"] += stage["wall_seconds"]
+            total["cpu_seconds"] += stage["cpu_seconds"]
+            total["rows"] += stage["rows_out"] or stage["rows_in"]
+            total["bytes"] += stage["bytes"]
+
+    print(f"Stage timings ({report['wall_seconds']:.2f}s wall, peak RSS {report['peak_rss_mb']:.0f} MB):")
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["wall_seconds"]):
+        rate = total["rows"] / total["wall_seconds"] if total["wall_seconds"] else 0
+        fetched = f"  {total['bytes'] / 2**20:8.1f} MB" if total["bytes"] else ""
+        print(f"  {name:<20} {total['calls']:>5} calls  {total['wall_seconds']:8.2f}s wall  "
+              f"{total['cpu_seconds']:8.2f}s cpu  {total['rows']:>10,} rows  {rate:>10,.0f} rows/s{fetched}")
+    for form, counts in report["counts"].items():
+        for name, value in sorted(counts.items()):
+            print(f"  {form}: {value:,} {name.replace('_', ' ')}")
+
+
+# ------------------------------
+# pipeline_runs table
+# ------------------------------
+def ensure_runs_table(cur):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema_name}.{table16_name} (
+        id SERIAL PRIMARY KEY,
+        started_at TIMESTAMPTZ NOT NULL,
+        finished_at TIMESTAMPTZ NOT NULL,
+        status TEXT NOT NULL,
+        forms INT NOT NULL,
+        rows_loaded BIGINT NOT NULL,
+        bytes_fetched BIGINT NOT NULL,
+        wall_seconds DOUBLE PRECISION NOT NULL,
+        cpu_seconds DOUBLE PRECISION NOT NULL,
+        peak_rss_mb DOUBLE PRECISION NOT NULL,
+        report JSONB NOT NULL
+    );
+    """)
+
+
+def save_run(cur, report):
+    """Insert the run report into pipeline_runs"""
+    # Imported here: worker processes use measure() without a database
+    from psycopg2.extras import Json
+
+    ensure_runs_table(cur)
+    bytes_fetched = sum(stage["bytes"] for form_stages in report["stages"].values()
+                        for stage in form_stages.values())
+    cur.execute(f"""
+    INSERT INTO {schema_name}.{table16_name}
+        (started_at, finished_at, status, forms, rows_loaded, bytes_fetched, wall_seconds, cpu_seconds, peak_rss_mb, report)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    """, (report["started_at"], report["finished_at"], report["status"], len(report["forms"]),
+          sum(summary["records"] for summary in report["forms"]), bytes_fetched,
+          report["wall_seconds"], report["cpu_seconds"], report["peak_rss_mb"], Json(report, dumps=_dumps)))
+
+
+def _dumps(value):
+    return json.dumps(value, default=str)
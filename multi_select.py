@@ -0,0 +1,116 @@
+import pandas as pd
+
+from config import form_table, schema_name, table14_name, table15_name, table6_name, table7_name, table_name
+from loaders import LabelLookup
+
+# ------------------------------
+# Multi-select questions
+# ------------------------------
+# Every selected option is interned into an option lookup table (id, label)
+# and the bridge table stores (respondent_id, option_id). A <bridge>_labeled
+# view exposes the option labels under the column name the bridge table
+# used to store them in. Option lookups are shared by all forms; bridge
+# tables belong to a fact table (see config.form_table).
+
+# Export column (also the bridge table name of blossom_academy) -> (option lookup table, label column)
+MULTI_SELECT = {
+    table6_name: (table14_name, "responsibility_option"),
+    table7_name: (table15_name, "action_option"),
+}
+
+
+def _constraint_prefix(table, label_col):
+    # "responsibility_option" -> "responsibility", as in the original constraint names
+    return form_table(table, label_col.rsplit("_option", 1)[0])
+
+
+def bridge_table(table, question):
+    """Bridge table of a multi-select question for the given fact table"""
+    return form_table(table, question)
+
+
+def _migrate_bridge(cur, table, bridge, lookup, label_col):
+    """Move a bridge table that stored option labels as TEXT onto option ids"""
+    cur.execute("""
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = %s AND table_name = %s AND column_name = %s;
+    """, (schema_name, bridge, label_col))
+    if cur.fetchone() is None:
+        return
+
+    print(f"Moving {schema_name}.{bridge}.{label_col} to {schema_name}.{lookup}...")
+    prefix = _constraint_prefix(table, label_col)
+    cur.execute(f"""
+    INSERT INTO {schema_name}.{lookup} (label)
+    SELECT DISTINCT {label_col} FROM {schema_name}.{bridge} WHERE {label_col} IS NOT NULL
+    ON CONFLICT (label) DO NOTHING;
+    """)
+    cur.execute(f"ALTER TABLE {schema_name}.{bridge} ADD COLUMN option_id INT;")
+    cur.execute(f"""
+    UPDATE {schema_name}.{bridge} m SET option_id = o.id
+    FROM {schema_name}.{lookup} o WHERE o.label = m.{label_col};
+    """)
+    cur.execute(f"DELETE FROM {schema_name}.{bridge} WHERE option_id IS NULL;")
+    # Dropping the label column also drops the old (respondent_id, label) unique constraint
+    cur.execute(f"DROP VIEW IF EXISTS {schema_name}.{bridge}_labeled;")
+    cur.execute(f"ALTER TABLE {schema_name}.{bridge} DROP COLUMN {label_col};")
+    cur.execute(f"""
+    ALTER TABLE {schema_name}.{bridge}
+        ALTER COLUMN option_id SET NOT NULL,
+        ADD CONSTRAINT fk_{prefix}_option FOREIGN KEY (option_id) REFERENCES {schema_name}.{lookup}(id),
+        ADD CONSTRAINT unique_{prefix} UNIQUE (respondent_id, option_id);
+    """)
+
+
+def ensure_option_tables(cur, table=table_name, partitioned=False):
+    """
+    Create the option lookup and bridge tables, migrating label-based bridge
+    tables. Foreign keys can't reference the id of a partitioned fact table
+    alone, so the bridge tables of one have no respondent_id foreign key.
+    """
+    for question, (lookup, label_col) in MULTI_SELECT.items():
+        bridge = bridge_table(table, question)
+        prefix = _constraint_prefix(table, label_col)
+        respondent_key = "" if partitioned else f"""
+            CONSTRAINT fk_{prefix}_respondent FOREIGN KEY (respondent_id)
+                REFERENCES {schema_name}.{table}(id) ON DELETE CASCADE,"""
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema_name}.{lookup} (
+            id SERIAL PRIMARY KEY,
+            label TEXT NOT NULL UNIQUE
+        );
+        """)
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema_name}.{bridge} (
+            id SERIAL PRIMARY KEY,
+            respondent_id INT NOT NULL,
+            option_id INT NOT NULL,{respondent_key}
+            CONSTRAINT fk_{prefix}_option FOREIGN KEY (option_id)
+                REFERENCES {schema_name}.{lookup}(id),
+            CONSTRAINT unique_{prefix} UNIQUE (respondent_id, option_id)
+        );
+        """)
+        _migrate_bridge(cur, table, bridge, lookup, label_col)
+        # respondent_id joins use the unique (respondent_id, option_id) index;
+        # option filters and the option foreign key need their own
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {bridge}_option_id_idx ON {schema_name}.{bridge} (option_id);")
+        cur.execute(f"""
+        CREATE OR REPLACE VIEW {schema_name}.{bridge}_labeled AS
+        SELECT m.id, m.respondent_id, o.label AS {label_col}
+        FROM {schema_name}.{bridge} m
+        JOIN {schema_name}.{lookup} o ON o.id = m.option_id;
+        """)
+
+
+def option_lookups():
+    """A LabelLookup per multi-select question"""
+    return {question: LabelLookup(f"{schema_name}.{lookup}") for question, (lookup, _) in MULTI_SELECT.items()}
+
+
+def encode_options(cur, lookup, child):
+    """Turn build_child_frame's (respondent_id, option) rows into (respondent_id, option_id)"""
+    lookup.intern(cur, child["option"].unique())
+    return pd.DataFrame({
+        "respondent_id": child["respondent_id"],
+        "option_id": lookup.map_series(child["option"]).astype("int64"),
+    }).drop_duplicates()
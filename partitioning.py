@@ -0,0 +1,291 @@
+"""
+Fact tables range-partitioned by submission month.
+
+With PG_PARTITION_BY_DATE=true new fact tables are created partitioned by
+`date`, and the pipeline creates the partition of a month before loading its
+first submission. Run this module to move an existing unpartitioned fact
+table onto partitions while loads and dashboards keep using it.
+
+Usage (the same as python cli.py partition):
+    python partitioning.py --migrate [--table TABLE] [--batch-rows N]
+"""
+import re
+import sys
+from datetime import date
+
+from answer_encoding import answers_encoded, create_label_view
+from cli import script_main
+from config import schema_name, table_name
+from loaders import connect
+from transform import ID_COLUMNS
+
+# ------------------------------
+# Monthly partitions
+# ------------------------------
+# Partitions are named <table>_pYYYY_MM and hold [first day, first day of the
+# next month). Rows without a date land in <table>_default. Unique keys of a
+# partitioned table must include `date`; a submission's date never changes,
+# so (submission_uuid, date) and (row_fingerprint, date) are as strict as the
+# single-column keys of an unpartitioned table.
+
+# Columns every fact table is indexed on: the dashboard filters and lookup foreign keys
+INDEX_COLUMNS = ["date"] + ID_COLUMNS
+
+# Rows copied per transaction by migrate
+MIGRATION_BATCH_ROWS = 50_000
+
+PARTITION_BOUND = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\)")
+
+
+def _month(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(cur, table=table_name):
+    """True if the fact table is a partitioned table"""
+    cur.execute("""
+    SELECT 1 FROM pg_partitioned_table p
+    JOIN pg_class c ON c.oid = p.partrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s AND c.relname = %s;
+    """, (schema_name, table))
+    return cur.fetchone() is not None
+
+
+def table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s);", (f"{schema_name}.{table}",))
+    return cur.fetchone()[0] is not None
+
+
+def ensure_fact_indexes(cur, table=table_name):
+    """Index the date and lookup ID columns; on a partitioned table each partition gets its own"""
+    for col in INDEX_COLUMNS:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_{col}_idx ON {schema_name}.{table} ({col});")
+
+
+def _add_partition_keys(cur, table):
+    """Unique keys and the default partition of a partitioned fact table"""
+    for key, columns in (("id", "id, date"), ("submission_uuid", "submission_uuid, date"),
+                         ("row_fingerprint", "row_fingerprint, date")):
+        cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_{key}_key ON {schema_name}.{table} ({columns});")
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {schema_name}.{table}_default PARTITION OF {schema_name}.{table} DEFAULT;")
+    ensure_fact_indexes(cur, table)
+
+
+def create_partitioned_table(cur, table, columns):
+    """
+    Create a fact table partitioned by month of `date`. `columns` holds the
+    column and constraint definitions after the id column.
+    """
+    cur.execute(f"""
+    CREATE TABLE {schema_name}.{table} (
+        id SERIAL,
+        {columns}
+    ) PARTITION BY RANGE (date);
+    """)
+    _add_partition_keys(cur, table)
+
+
+class MonthlyPartitions:
+    """
+    Creates the month partitions of a partitioned fact table as submission
+    dates arrive, remembering the months that already have one.
+    """
+
+    def __init__(self, table, parent=None):
+        self.table = table
+        self.parent = parent or table
+        self.months = None
+
+    def _existing(self, cur):
+        cur.execute("""
+        SELECT pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass;
+        """, (f"{schema_name}.{self.parent}",))
+        return {date.fromisoformat(match.group(1))
+                for (bound,) in cur.fetchall() if (match := PARTITION_BOUND.search(bound))}
+
+    def _create(self, cur, month):
+        partition = partition_name(self.table, month)
+        bounds = (month, _next_month(month))
+        cur.execute(f"""
+        SELECT 1 FROM {schema_name}.{self.parent}_default WHERE date >= %s AND date < %s LIMIT 1;
+        """, bounds)
+        if cur.fetchone() is None:
+            cur.execute(f"""
+            CREATE TABLE {schema_name}.{partition} PARTITION OF {schema_name}.{self.parent}
+            FOR VALUES FROM (%s) TO (%s);
+            """, bounds)
+            return
+        # Rows of the month already sit in the default partition (loaded while
+        # the table was being migrated): move them into the new partition
+        cur.execute(f"CREATE TABLE {schema_name}.{partition} (LIKE {schema_name}.{self.parent} INCLUDING DEFAULTS);")
+        cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {schema_name}.{self.parent}_default WHERE date >= %s AND date < %s RETURNING *
+        )
+        INSERT INTO {schema_name}.{partition} SELECT * FROM moved;
+        """, bounds)
+        cur.execute(f"""
+        ALTER TABLE {schema_name}.{self.parent} ATTACH PARTITION {schema_name}.{partition}
+        FOR VALUES FROM (%s) TO (%s);
+        """, bounds)
+
+    def ensure(self, cur, dates):
+        """Create the partitions missing for `dates` (None is ignored). Returns the months created"""
+        if self.months is None:
+            self.months = self._existing(cur)
+        missing = sorted({_month(day) for day in dates if day is not None} - self.months)
+        for month in missing:
+            self._create(cur, month)
+            self.months.add(month)
+        return missing
+
+
+# ------------------------------
+# Online migration of an unpartitioned fact table
+# ------------------------------
+def _columns(cur, table):
+    cur.execute("""
+    SELECT column_name FROM information_schema.columns
+    WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position;
+    """, (schema_name, table))
+    return ", ".join(f'"{row[0]}"' for row in cur.fetchall())
+
+
+def _create_shadow(cur, table, shadow):
+    """Empty partitioned copy of the fact table, with its columns, defaults and foreign keys"""
+    cur.execute(f"""
+    CREATE TABLE {schema_name}.{shadow} (LIKE {schema_name}.{table} INCLUDING DEFAULTS)
+    PARTITION BY RANGE (date);
+    """)
+    cur.execute("""
+    SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+    WHERE conrelid = %s::regclass AND contype = 'f';
+    """, (f"{schema_name}.{table}",))
+    for name, definition in cur.fetchall():
+        cur.execute(f"ALTER TABLE {schema_name}.{shadow} ADD CONSTRAINT {name} {definition};")
+    _add_partition_keys(cur, shadow)
+
+
+def _copy_rows(cur, table, shadow, partitions, columns, after, until):
+    """Copy the rows with after < id <= until, creating their partitions first"""
+    cur.execute(f"""
+    SELECT DISTINCT date FROM {schema_name}.{table} WHERE id > %s AND id <= %s;
+    """, (after, until))
+    partitions.ensure(cur, [row[0] for row in cur.fetchall()])
+    cur.execute(f"""
+    INSERT INTO {schema_name}.{shadow} ({columns})
+    SELECT {columns} FROM {schema_name}.{table} WHERE id > %s AND id <= %s;
+    """, (after, until))
+    return cur.rowcount
+
+
+def _rename_indexes(cur, relation, old_prefix, new_prefix):
+    cur.execute("""
+    SELECT i.relname FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+    WHERE x.indrelid = %s::regclass;
+    """, (f"{schema_name}.{relation}",))
+    for (index,) in cur.fetchall():
+        if index.startswith(f"{old_prefix}_"):
+            renamed = (new_prefix + index[len(old_prefix):])[:63]
+            cur.execute(f"ALTER INDEX {schema_name}.{index} RENAME TO {renamed};")
+
+
+def migrate(table=table_name, batch_rows=MIGRATION_BATCH_ROWS):
+    """
+    Move an unpartitioned fact table onto a partitioned copy. Rows are copied
+    in batches of `batch_rows` ids, one transaction each, while loads and
+    queries keep using the table. The table is only locked for the final
+    swap, which copies the rows loaded meanwhile and renames the tables. The
+    old table is kept as <table>_unpartitioned. An interrupted migration
+    resumes where it stopped. The pipeline only inserts fact rows; rows
+    deleted or updated by hand during the copy are not carried over.
+    """
+    shadow = f"{table}_partitioned"
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        if is_partitioned(cur, table):
+            print(f"[OK] {schema_name}.{table} is already partitioned")
+            return 0
+        if not table_exists(cur, shadow):
+            print(f"Creating {schema_name}.{shadow}...")
+            _create_shadow(cur, table, shadow)
+        conn.commit()
+
+        columns = _columns(cur, table)
+        partitions = MonthlyPartitions(table, parent=shadow)
+        cur.execute(f"SELECT coalesce(max(id), 0) FROM {schema_name}.{shadow};")
+        copied_until = cur.fetchone()[0]
+        # Waiting for the loads in progress means every id up to last_id is
+        # committed; rows loaded from here on get higher ids
+        cur.execute(f"LOCK TABLE {schema_name}.{table} IN SHARE MODE;")
+        cur.execute(f"SELECT coalesce(max(id), 0) FROM {schema_name}.{table};")
+        last_id = cur.fetchone()[0]
+        conn.commit()
+        copied = 0
+        while copied_until < last_id:
+            until = min(copied_until + batch_rows, last_id)
+            copied += _copy_rows(cur, table, shadow, partitions, columns, copied_until, until)
+            copied_until = until
+            conn.commit()
+            print(f"  Copied {copied:,} rows (ids up to {copied_until:,} of {last_id:,})")
+
+        # ------------------------------
+        # Swap the tables
+        # ------------------------------
+        cur.execute(f"LOCK TABLE {schema_name}.{table} IN ACCESS EXCLUSIVE MODE;")
+        cur.execute(f"SELECT coalesce(max(id), 0) FROM {schema_name}.{table};")
+        copied += _copy_rows(cur, table, shadow, partitions, columns, copied_until, cur.fetchone()[0])
+
+        # Foreign keys can't reference `id` alone on a partitioned table, so the
+        # bridge tables lose their respondent_id foreign key
+        cur.execute("""
+        SELECT conrelid::regclass, conname FROM pg_constraint
+        WHERE confrelid = %s::regclass AND contype = 'f';
+        """, (f"{schema_name}.{table}",))
+        for referencing, name in cur.fetchall():
+            cur.execute(f"ALTER TABLE {referencing} DROP CONSTRAINT {name};")
+        cur.execute(f"DROP VIEW IF EXISTS {schema_name}.{table}_labeled;")
+
+        cur.execute(f"ALTER TABLE {schema_name}.{table} RENAME TO {table}_unpartitioned;")
+        _rename_indexes(cur, f"{table}_unpartitioned", table, f"{table}_unpartitioned")
+        cur.execute(f"ALTER TABLE {schema_name}.{shadow} RENAME TO {table};")
+        _rename_indexes(cur, table, shadow, table)
+        cur.execute(f"ALTER TABLE {schema_name}.{shadow}_default RENAME TO {table}_default;")
+        _rename_indexes(cur, f"{table}_default", f"{shadow}_default", f"{table}_default")
+        # The id sequence would otherwise be dropped with the old table
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id');", (f"{schema_name}.{table}_unpartitioned",))
+        sequence = cur.fetchone()[0]
+        if sequence is not None:
+            cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {schema_name}.{table}.id;")
+        create_label_view(cur, answers_encoded(cur, table), table)
+        conn.commit()
+        print(f"[OK] Moved {copied:,} rows of {schema_name}.{table} onto monthly partitions; "
+              f"the old table is kept as {schema_name}.{table}_unpartitioned")
+        return copied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def main():
+    return script_main("partition", "--migrate", "pass --migrate to partition an existing fact table")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
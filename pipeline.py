@@ -1,233 +1,319 @@
-from http.client import CREATED
+import io
 import pandas as pd
-from scipy.stats import chi2_contingency
 import requests
-import io
-import psycopg2
+import json
+import multiprocessing
+import re
+import shutil
+import tempfile
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from psycopg2.extras import execute_values
 from requests.auth import HTTPBasicAuth
-from dotenv import load_dotenv
-import os
-
-# ------------------------------
-# Load environment variables
-# ------------------------------
-env_path = os.path.join(os.path.dirname(__file__), '.env')
-load_dotenv(env_path)
-
-KOBO_USERNAME = os.getenv("KOBO_USERNAME")
-KOBO_PASSWORD = os.getenv("KOBO_PASSWORD")
-KOBO_CSV_URL = os.getenv("KOBO_CSV_URL")
-
-PG_HOST = os.getenv("PG_HOST")
-PG_DATABASE = os.getenv("PG_DATABASE")
-PG_USER = os.getenv("PG_USER")
-PG_PASSWORD = os.getenv("PG_PASSWORD")
-PG_PORT = os.getenv("PG_PORT")
-
-schema_name = "gender_inclusion_project"
-table_name = "blossom_academy"
-table2_name = "gender_lookup"
-table3_name = "age_group_lookup"
-table4_name = "education_lookup"
-table5_name = "country_lookup"
-table6_name = "responsibility_responses"
-table7_name = "prioritized_actions"
+import export_cache
+import staging
+from cli import script_main
+from kobo_api import iter_submission_frames
+from aggregates import ensure_aggregate_tables, refresh_aggregates
+from answer_encoding import AnswerEncoder, answers_encoded, create_label_view, migrate_answer_columns
+from config import (
+    KOBO_CACHE,
+    KOBO_CACHE_DIR,
+    KOBO_CHUNK_SIZE,
+    KOBO_FETCH_WORKERS,
+    KOBO_INCREMENTAL,
+    KOBO_REJECT_REASONS,
+    KOBO_SCHEMA_CACHE,
+    KOBO_STAGING_DIR,
+    KOBO_TRANSFORM_WORKERS,
+    PG_ENCODE_ANSWERS,
+    PG_LOAD_ENGINE,
+    PG_PARTITION_BY_DATE,
+    PG_POOL_SIZE,
+    PG_SAVE_RUNS,
+    PIPELINE_PROFILE,
+    PIPELINE_REPORT_DIR,
+    PIPELINE_TRACEMALLOC,
+    schema_name,
+    table8_name,
+    table17_name,
+)
+from forms import load_forms, say
+from schema_resolver import print_schema_report, resolve_schema
+from metrics import CountingReader, RunMetrics, print_stage_report, save_run
+from loaders import LOAD_ENGINES, ConnectionPool, has_legacy_rows, link_legacy_rows, load_rows, select_new_rows
+from partitioning import (
+    MonthlyPartitions,
+    create_partitioned_table,
+    ensure_fact_indexes,
+    is_partitioned,
+    partition_name,
+    table_exists,
+)
+from multi_select import MULTI_SELECT, bridge_table, encode_options, ensure_option_tables, option_lookups
+from validation import MALFORMED_LINE, ensure_rejected_table, malformed_frame, save_rejected
+from transform import (
+    LOAD_COLUMNS,
+    LOOKUP_ROWS,
+    build_child_frame,
+    clean_column_names,
+    merge_unmatched,
+    reset_unmatched,
+    transform_chunk,
+    unmatched_report,
+)
 
 # ------------------------------
-# Fetch Kobo CSV
+# Streaming Kobo CSV reader
 # ------------------------------
-print("Fetching data from KoboToolbox...")
-response = requests.get(KOBO_CSV_URL, auth=HTTPBasicAuth(KOBO_USERNAME, KOBO_PASSWORD))
-if response.status_code != 200:
-    raise Exception(f"Failed to fetch Kobo data: {response.status_code}")
+def fetch_export(url, params=None, headers=None, auth=None):
+    """Open a streaming request to a Kobo CSV export without reading the body"""
+    response = requests.get(url, params=params, headers=headers, auth=auth, stream=True)
+    if response.status_code not in (200, 304):
+        response.close()
+        raise Exception(f"Failed to fetch Kobo data: {response.status_code}")
 
-# Ensure proper UTF-8 encoding when fetching
-response.encoding = 'utf-8'
-csv_data = io.StringIO(response.text)
-df = pd.read_csv(csv_data, sep=';', on_bad_lines='skip')
+    # Let urllib3 undo gzip/deflate transfer encoding as the body is read
+    response.raw.decode_content = True
+    # Count the body towards the bytes fetched by the stage reading it
+    response.raw = CountingReader(response.raw)
+    return response
 
-# Clean column names first (replace spaces, special characters)
-df.columns = [col.strip().replace(" ", "_").replace("&", "and").replace("-", "_") for col in df.columns]
 
-# Now we can apply mappings with cleaned column names
+def refresh_snapshot(url, params=None, auth=None):
+    """
+    Download the export into the cache unless Kobo reports it unchanged.
+    Returns (changed, cache metadata from before the download).
+    """
+    meta = export_cache.read_metadata(KOBO_CACHE_DIR, url)
+    response = fetch_export(url, params, headers=export_cache.conditional_headers(meta), auth=auth)
+    try:
+        if response.status_code == 304:
+            print("  Kobo reported the export as not modified (304)")
+            return False, meta
+        changed = export_cache.store_snapshot(KOBO_CACHE_DIR, url, response, params)
+        if not changed:
+            print("  Export is identical to the cached snapshot")
+        return changed, meta
+    finally:
+        response.close()
+
+
+def open_export(url, params=None, auth=None, cache=KOBO_CACHE):
+    """
+    Return a binary stream of the export body to parse, or None when the
+    cached snapshot is unchanged and has already been loaded.
+    """
+    if not cache:
+        return fetch_export(url, params, auth=auth).raw
 
-# ------------------------------
-# Column name mappings (KoboToolbox to database)
-# ------------------------------
-column_mappings = {
-    'How_do_you_describe_your_gender?': 'gender',
-    'What_is_your_age_group?': 'age_group',
-    'What_is_your_highest_level_of_education?': 'education',
-    'Which_country_do_you_currently_live_in?': 'country',
-    "Have_you_heard_the_term_'gender_and_inclusion'_before?": 'heard_gender_inclusion',
-    'How_confident_are_you_in_your_understanding_of_gender_and_inclusion?': 'confidence_understanding',
-    'Gender_and_inclusion_refers_to_equal_rights,_opportunities,_and_respect_for_all_genders.': 'definition_equal_rights',
-    'Gender_and_inclusion_is_only_about_women.': 'definition_only_women',
-    'Do_you_think_gender_and_inclusion_is_practiced_in_your_country?': 'practiced_in_country',
-    'How_important_is_gender_and_inclusion_in_society?': 'importance_in_society',
-    'Have_you_personally_felt_excluded_or_treated_unfairly_because_of_your_gender?': 'personal_exclusion',
-    'Have_you_witnessed_someone_excluded_because_of_gender?': 'witnessed_exclusion',
-    'Are_there_barriers_to_gender_and_inclusion_in_your_country?': 'barriers_exist',
-    'Who_should_be_responsible_for_promoting_gender_and_inclusion?': 'responsibility_responses',
-    'Which_actions_should_be_prioritized?': 'prioritized_actions',
-    'The_government_should_create_and_enforce_policies_promoting_gender_and_inclusion.': 'govt_create_policies',
-    'The_government_should_provide_education_and_awareness_programs.': 'govt_provide_education',
-    'The_government_should_support_marginalized_groups_economically.': 'govt_support_groups',
-    'The_government_should_ensure_equal_gender_representation_in_leadership.': 'govt_equal_representation',
-    '_submission_time': 'submission_time',  # Add date column mapping
-}
-
-# Value mappings for categorical columns
-gender_mapping = {
-    'Female': 1,
-    'Male': 2,
-    'Prefer not to say': 3,
-    'Other': 3,
-}
-
-age_group_mapping = {
-    'Under 18': 1,
-    '18-24': 2,
-    '18–24': 2,  # en-dash variant
-    '25-34': 3,
-    '25–34': 3,  # en-dash variant
-    '35-44': 4,
-    '35–44': 4,  # en-dash variant
-    '45-54': 5,
-    '45–54': 5,  # en-dash variant
-    '55+': 6,
-    '55 +': 6,
-}
-
-education_mapping = {
-    'No formal education': 1,
-    'Primary': 2,
-    'Secondary': 3,
-    'Vocational/Technical': 4,
-    'Vocational': 4,
-    'University/College': 5,
-    'Tertiary education': 5,
-    'University': 5,
-    'College': 5,
-    'Postgraduate': 6,
-    'Graduate': 6,
-}
-
-country_mapping = {
-    'Nigeria': 1,
-    'Rwanda': 2,
-    'Other': 3,
-}
-
-# Function to find actual column name from mapping
-def find_column(df, search_key):
-    """Find a column in df that matches the mapping key"""
-    if search_key in df.columns:
-        return search_key
-    
-    # Try exact match first (case-insensitive)
-    search_lower = search_key.lower()
-    for col in df.columns:
-        if col.lower() == search_lower:
-            return col
-    
-    # Try partial match - check if key words are in the column
-    # Remove special chars and extra spaces for comparison
-    search_normalized = search_key.lower().replace("'", "").replace('"', '')
-    for col in df.columns:
-        col_normalized = col.lower().replace("'", "").replace('"', '')
-        if search_normalized in col_normalized or col_normalized in search_normalized:
-            return col
-    
-    # Try simple substring match
-    for col in df.columns:
-        if search_key.lower() in col.lower():
-            return col
-    
+    changed, meta = refresh_snapshot(url, params, auth)
+    if not changed and meta and meta.get("loaded"):
+        return None
+    return export_cache.open_snapshot(KOBO_CACHE_DIR, url)
+
+
+def spool_export(stream):
+    """Read a whole export stream into a temporary file, so the download doesn't wait on the database"""
+    spooled = tempfile.TemporaryFile()
+    with stream:
+        shutil.copyfileobj(stream, spooled, length=1024 * 1024)
+    spooled.seek(0)
+    return spooled
+
+
+# Fields of an export line are counted after its quoted fields, which may
+# hold separators, doubled quotes and line breaks, are removed (a quote opens
+# a field only after a separator or line break; the patterns start with the
+# quote so the regex engine can skip ahead to it)
+QUOTED_FIELD = re.compile(rb'"(?<![^;\n]")[^"]*(?:""[^"]*)*"')
+FIELD_START_QUOTE = re.compile(rb'"(?<![^;\n]")')
+
+
+def _open_quote(data):
+    """Offset of the quoted field still open at the end of data, or None"""
+    end = 0
+    for match in FIELD_START_QUOTE.finditer(data):
+        if match.start() < end:
+            continue
+        quoted = QUOTED_FIELD.match(data, match.start())
+        if quoted is None:
+            return match.start()
+        end = quoted.end()
     return None
 
-# Rename columns based on mappings
-print("Mapping KoboToolbox columns to database schema...")
-rename_dict = {}
-for kobo_col, db_col in column_mappings.items():
-    actual_col = find_column(df, kobo_col)
-    if actual_col:
-        rename_dict[actual_col] = db_col
-        print(f"  Mapped: {kobo_col} -> {db_col}")
 
-print(f"\nRename dictionary keys: {list(rename_dict.keys())[:5]}...")
+def _line_ends(data):
+    """Offsets just past the line breaks of data that aren't inside a quoted field"""
+    quoted = [match.span() for match in QUOTED_FIELD.finditer(data)]
+    ends = []
+    field = 0
+    for match in re.finditer(b"\n", data):
+        while field < len(quoted) and quoted[field][1] <= match.start():
+            field += 1
+        if field == len(quoted) or match.start() < quoted[field][0]:
+            ends.append(match.end())
+    if not data.endswith(b"\n"):
+        ends.append(len(data))
+    return ends
+
 
-df.rename(columns=rename_dict, inplace=True)
+class MalformedLineFilter(io.RawIOBase):
+    """
+    Binary stream wrapper for read_csv(sep=';') that leaves out the lines
+    with more fields than the header and lists them. pandas' own bad-line
+    check is not used: it misses such lines at the start of a chunk and
+    truncates them instead, and it can only report them through warnings,
+    which are process-wide. Lines are numbered as pandas numbers them (the
+    header is line 1; a quoted line break doesn't start a line).
+    """
 
-print(f"Renamed {len(rename_dict)} columns")
-print(f"\nVerifying data in DataFrame:")
-if len(df) > 0:
-    first_row = df.iloc[0]
-    print(f"  gender: {first_row['gender'] if 'gender' in df.columns else 'NOT FOUND'}")
-    print(f"  heard_gender_inclusion: {first_row['heard_gender_inclusion'] if 'heard_gender_inclusion' in df.columns else 'NOT FOUND'}")
-    print(f"  confidence_understanding: {first_row['confidence_understanding'] if 'confidence_understanding' in df.columns else 'NOT FOUND'}")
+    def __init__(self, raw, read_size=1 << 16):
+        self.raw = raw
+        self.read_size = read_size
+        self.pending = b""
+        self.out = b""
+        self.done = False
+        self.fields = None
+        self.lines = 0
+        self.rows = 0
+        # (line number, message, data rows before the line)
+        self.malformed = deque()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.out and not self.done:
+            data = self.raw.read(max(len(buffer), self.read_size))
+            self.pending += data or b""
+            self.done = not data
+            self.out = self._scan(final=self.done)
+        count = min(len(buffer), len(self.out))
+        buffer[:count] = self.out[:count]
+        self.out = self.out[count:]
+        return count
+
+    def _scan(self, final):
+        """Count the fields of the complete lines read so far, returning the lines to parse"""
+        data = self.pending if final else self.pending[:self.pending.rfind(b"\n") + 1]
+        text = QUOTED_FIELD.sub(b"", data)
+        if not final and FIELD_START_QUOTE.search(text):
+            # A quoted line break: only the lines before its field are complete
+            start = _open_quote(data)
+            if start is not None:
+                data = data[:data.rfind(b"\n", 0, start) + 1]
+                text = QUOTED_FIELD.sub(b"", data)
+        self.pending = self.pending[len(data):]
+
+        lines = text.split(b"\n") if text else []
+        if lines and not lines[-1]:
+            lines.pop()
+        skipped = []
+        for index, line in enumerate(lines):
+            self.lines += 1
+            fields = line.count(b";") + 1
+            if not line.strip():
+                continue
+            if self.fields is None:
+                self.fields = fields
+            elif fields > self.fields:
+                skipped.append(index)
+                self.malformed.append((self.lines, f"expected {self.fields} fields, saw {fields}", self.rows))
+            else:
+                self.rows += 1
+        if not skipped:
+            return data
+        ends = _line_ends(data)
+        starts = [0] + ends[:-1]
+        skipped = set(skipped)
+        return b"".join(data[start:end] for index, (start, end) in enumerate(zip(starts, ends))
+                        if index not in skipped)
+
+    def take(self, rows=None):
+        """(line number, message) of the malformed lines found before data row `rows` (all of them by default)"""
+        taken = []
+        while self.malformed and (rows is None or self.malformed[0][2] < rows):
+            number, message, _ = self.malformed.popleft()
+            taken.append((number, message))
+        return taken
+
+
+def iter_export_chunks(stream, chunksize=KOBO_CHUNK_SIZE):
+    """
+    Parse the export body incrementally and yield DataFrames of at most
+    `chunksize` rows. Only the current chunk is ever held in memory. Lines
+    with the wrong number of fields are skipped and listed as (line number,
+    parser message) in the attrs["malformed_lines"] of the chunk read with them.
+    """
+    lines = MalformedLineFilter(stream)
+    columns = None
+    rows = 0
+    # Lines with too many fields are left out by the filter, so pandas only
+    # warns about a line if the filter has missed one
+    with pd.read_csv(lines, sep=';', on_bad_lines='warn', encoding='utf-8', chunksize=chunksize) as reader:
+        for chunk in reader:
+            columns = chunk.columns
+            rows += len(chunk)
+            malformed = lines.take(rows)
+            if malformed:
+                chunk.attrs["malformed_lines"] = malformed
+            yield chunk
+    malformed = lines.take()
+    if malformed and columns is not None:
+        # Skipped lines at the very end come with an empty chunk
+        chunk = pd.DataFrame(columns=columns)
+        chunk.attrs["malformed_lines"] = malformed
+        yield chunk
 
-# Convert date column
-if "Date" in df.columns:
-    df.rename(columns={"Date": "date"}, inplace=True)
 
 # ------------------------------
-# Dynamic multi-select splitter
+# Incremental sync watermark
 # ------------------------------
-def split_options(cell_value):
+def read_watermark(cur, source_url, target_table):
+    """Return (last_submission_time, last_kobo_id) stored for a source, or (None, None)"""
+    cur.execute(f"""
+    SELECT last_submission_time, last_kobo_id
+    FROM {schema_name}.{table8_name}
+    WHERE source_url = %s AND table_name = %s;
+    """, (source_url, target_table))
+    row = cur.fetchone()
+    if row is None:
+        return None, None
+    return (pd.Timestamp(row[0]) if row[0] is not None else None), row[1]
+
+
+def save_watermark(cur, source_url, target_table, last_submission_time, last_kobo_id):
+    """Move the stored watermark forward (never backwards) in the current transaction"""
+    cur.execute(f"""
+    INSERT INTO {schema_name}.{table8_name} (source_url, table_name, last_submission_time, last_kobo_id, updated_at)
+    VALUES (%s, %s, %s, %s, now())
+    ON CONFLICT (source_url, table_name) DO UPDATE SET
+        last_submission_time = GREATEST({table8_name}.last_submission_time, EXCLUDED.last_submission_time),
+        last_kobo_id = GREATEST({table8_name}.last_kobo_id, EXCLUDED.last_kobo_id),
+        updated_at = now();
+    """, (source_url, target_table, last_submission_time, last_kobo_id))
+
+
+def watermark_query(last_submission_time):
     """
-    Dynamically splits multi-select values from Kobo exports.
-    Handles commas, semicolons, spaces, or mixed separators.
+    Kobo data API filter for submissions at or after the watermark. Exports that
+    ignore the filter are handled by filter_new_submissions on the client side.
     """
-    if pd.isna(cell_value):
-        return []
-    
-    value_str = str(cell_value).strip()
-    
-    if ',' in value_str:
-        sep = ','
-    elif ';' in value_str:
-        sep = ';'
-    else:
-        sep = None
-    
-    if sep:
-        parts = [part.strip() for part in value_str.split(sep)]
-    else:
-        parts = value_str.split()  # whitespace split
-    
-    return [part for part in parts if part]
+    if last_submission_time is None:
+        return None
+    return {"query": json.dumps({"_submission_time": {"$gte": last_submission_time.isoformat()}})}
+
 
 # ------------------------------
-# Upload to PostgreSQL
+# Database tables
 # ------------------------------
-print("Uploading data to PostgreSQL...")
-try:
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        database=PG_DATABASE,
-        user=PG_USER,
-        password=PG_PASSWORD,
-        port=PG_PORT
-    )
-    cur = conn.cursor()
-
-    # Create schema
+def ensure_shared_tables(cur):
+    """Schema, lookup tables and sync state shared by every form"""
     cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name};")
 
-    # ------------------------------
-    # Lookup tables
-    # ------------------------------
-    lookup_tables = {
-        "gender_lookup": [(1, 'Female'), (2, 'Male'), (3, 'Prefer not to say')],
-        "age_group_lookup": [(1, 'Under 18'), (2, '18-24'), (3, '25-34'), (4, '35-44'), (5, '45-54'), (6, '55+')],
-        "education_lookup": [(1, 'No formal education'), (2, 'Primary'), (3, 'Secondary'), (4, 'Vocational/Technical'),
-                             (5, 'University/College'), (6, 'Postgraduate')],
-        "country_lookup": [(1, 'Nigeria'), (2, 'Rwanda'), (3, 'Other')]
-    }
-
-    for table, rows in lookup_tables.items():
+    for table, rows in LOOKUP_ROWS.items():
         cur.execute(f"""
         CREATE TABLE IF NOT EXISTS {schema_name}.{table} (
             id INT PRIMARY KEY,
@@ -241,11 +327,27 @@ try:
         )
 
     # ------------------------------
-    # Main survey table
+    # Incremental sync state
     # ------------------------------
     cur.execute(f"""
-    CREATE TABLE IF NOT EXISTS {schema_name}.{table_name} (
-        id SERIAL PRIMARY KEY,
+    CREATE TABLE IF NOT EXISTS {schema_name}.{table8_name} (
+        source_url TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        last_submission_time TIMESTAMP,
+        last_kobo_id BIGINT,
+        updated_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (source_url, table_name)
+    );
+    """)
+
+    # ------------------------------
+    # Rows kept out of the fact tables by validation
+    # ------------------------------
+    ensure_rejected_table(cur)
+
+
+# Columns of a fact table after its id
+FACT_COLUMNS = f"""
         start TIMESTAMP,
         "end" TIMESTAMP,
         date DATE,
@@ -266,283 +368,620 @@ try:
         govt_provide_education TEXT,
         govt_support_groups TEXT,
         govt_equal_representation TEXT,
+        submission_uuid TEXT,
+        row_fingerprint BIGINT,
         CONSTRAINT fk_gender FOREIGN KEY (gender_id) REFERENCES {schema_name}.gender_lookup(id),
         CONSTRAINT fk_age_group FOREIGN KEY (age_group_id) REFERENCES {schema_name}.age_group_lookup(id),
         CONSTRAINT fk_education FOREIGN KEY (education_id) REFERENCES {schema_name}.education_lookup(id),
-        CONSTRAINT fk_country FOREIGN KEY (country_id) REFERENCES {schema_name}.country_lookup(id)
-    );
-    """)
+        CONSTRAINT fk_country FOREIGN KEY (country_id) REFERENCES {schema_name}.country_lookup(id)"""
 
-    # ------------------------------
-    # Responsibility and Prioritized Actions tables
-    # ------------------------------
-    cur.execute(f"""
-    CREATE TABLE IF NOT EXISTS {schema_name}.{table6_name} (
-        id SERIAL PRIMARY KEY,
-        respondent_id INT NOT NULL,
-        responsibility_option TEXT,
-        CONSTRAINT fk_responsibility_respondent FOREIGN KEY (respondent_id)
-            REFERENCES {schema_name}.{table_name}(id) ON DELETE CASCADE,
-        CONSTRAINT unique_responsibility UNIQUE (respondent_id, responsibility_option)
-    );
-    """)
 
+def ensure_form_tables(cur, table):
+    """Fact, bridge and summary tables of one form. Returns True if its answers are SMALLINT-encoded"""
+    # New fact tables can be partitioned by month; existing ones stay as they
+    # are until `python partitioning.py --migrate` moves them
+    if PG_PARTITION_BY_DATE and not table_exists(cur, table):
+        create_partitioned_table(cur, table, FACT_COLUMNS)
     cur.execute(f"""
-    CREATE TABLE IF NOT EXISTS {schema_name}.{table7_name} (
-        id SERIAL PRIMARY KEY,
-        respondent_id INT NOT NULL,
-        action_option TEXT,
-        CONSTRAINT fk_action_respondent FOREIGN KEY (respondent_id)
-            REFERENCES {schema_name}.{table_name}(id) ON DELETE CASCADE,
-        CONSTRAINT unique_action UNIQUE (respondent_id, action_option)
+    CREATE TABLE IF NOT EXISTS {schema_name}.{table} (
+        id SERIAL PRIMARY KEY,{FACT_COLUMNS}
     );
     """)
 
+    partitioned = is_partitioned(cur, table)
+    if not partitioned:
+        # Kobo's _uuid identifies a submission across runs; rows loaded before
+        # this column existed keep NULL until load_records links them
+        cur.execute(f"ALTER TABLE {schema_name}.{table} ADD COLUMN IF NOT EXISTS submission_uuid TEXT;")
+        cur.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {table}_submission_uuid_key
+        ON {schema_name}.{table} (submission_uuid);
+        """)
+
+        # Content fingerprint of the loaded row, so an unchanged submission is never inserted twice
+        cur.execute(f"ALTER TABLE {schema_name}.{table} ADD COLUMN IF NOT EXISTS row_fingerprint BIGINT;")
+        cur.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {table}_row_fingerprint_key
+        ON {schema_name}.{table} (row_fingerprint);
+        """)
+
+    # Dashboard filters on date and the demographics, and the lookup foreign keys
+    ensure_fact_indexes(cur, table)
+
+    # Likert answers as SMALLINT codes into answer_lookup. Once converted the
+    # table stays encoded, so loads follow the column type rather than the setting
+    if PG_ENCODE_ANSWERS:
+        migrate_answer_columns(cur, table)
+    encoded = answers_encoded(cur, table)
+    if not encoded:
+        create_label_view(cur, encoded=False, table=table)
+
     # ------------------------------
-    # Insert blossom_academy
+    # Responsibility and Prioritized Actions option lookups and bridge tables
     # ------------------------------
-    insert_sql = f"""
-    INSERT INTO {schema_name}.{table_name} (
-        start, "end", date, gender_id, age_group_id, education_id, country_id,
-        heard_gender_inclusion, confidence_understanding, definition_equal_rights, definition_only_women,
-        practiced_in_country, importance_in_society, personal_exclusion, witnessed_exclusion, barriers_exist,
-        govt_create_policies, govt_provide_education, govt_support_groups, govt_equal_representation
-    ) VALUES %s
-    ON CONFLICT DO NOTHING;
-    """
+    ensure_option_tables(cur, table, partitioned)
 
-    # Function to map survey responses to lookup IDs
-    def map_gender_id(value):
-        if pd.isna(value):
-            return None
-        return gender_mapping.get(str(value).strip(), None)
-    
-    def map_age_group_id(value):
-        if pd.isna(value):
-            return None
-        val_str = str(value).strip()
-        
-        # First try direct match
-        if val_str in age_group_mapping:
-            return age_group_mapping[val_str]
-        
-        # Normalize dashes and try again (handle en-dash vs hyphen)
-        normalized = val_str.replace('–', '-').replace('—', '-')
-        if normalized in age_group_mapping:
-            return age_group_mapping[normalized]
-        
-        # Try removing extra spaces
-        normalized_spaces = ' '.join(normalized.split())
-        if normalized_spaces in age_group_mapping:
-            return age_group_mapping[normalized_spaces]
-        
-        # Fallback - try to find any matching key
-        for key, val in age_group_mapping.items():
-            if key.replace('–', '-').replace('—', '-') == normalized:
-                return val
-        
-        return None
-    
-    def map_education_id(value):
-        if pd.isna(value):
-            return None
-        val_str = str(value).strip()
-        
-        # Direct match
-        if val_str in education_mapping:
-            return education_mapping[val_str]
-        
-        # Case-insensitive match
-        val_lower = val_str.lower()
-        for key, id_val in education_mapping.items():
-            if key.lower() == val_lower:
-                return id_val
-        
-        # Partial match for education levels
-        if 'tertiary' in val_lower or 'university' in val_lower or 'college' in val_lower:
-            return education_mapping.get('Tertiary education', education_mapping.get('University/College'))
-        if 'vocational' in val_lower or 'technical' in val_lower:
-            return education_mapping.get('Vocational/Technical')
-        if 'secondary' in val_lower:
-            return education_mapping.get('Secondary')
-        if 'primary' in val_lower:
-            return education_mapping.get('Primary')
-        if 'postgraduate' in val_lower or 'graduate' in val_lower:
-            return education_mapping.get('Postgraduate')
-        if 'no formal' in val_lower or 'none' in val_lower:
-            return education_mapping.get('No formal education')
-        
-        return None
-    
-    def map_country_id(value):
-        if pd.isna(value):
-            return None
-        return country_mapping.get(str(value).strip(), None)
-
-    # Apply mappings to create ID columns
-    print("Mapping survey responses to lookup IDs...")
-    print(f"Columns before ID mapping: {df.columns.tolist()[:10]}...")
-    if 'gender' in df.columns:
-        print("  Mapping gender...")
-        df['gender_id'] = df['gender'].apply(map_gender_id)
-    else:
-        print("  WARNING: gender column not found")
-        
-    if 'age_group' in df.columns:
-        print("  Mapping age_group...")
-        df['age_group_id'] = df['age_group'].apply(map_age_group_id)
-        print(f"    Sample age groups: {df['age_group'].unique()[:3]}")
-    else:
-        print("  WARNING: age_group column not found")
-        
-    if 'education' in df.columns:
-        print("  Mapping education...")
-        df['education_id'] = df['education'].apply(map_education_id)
-    else:
-        print("  WARNING: education column not found")
-        
-    if 'country' in df.columns:
-        print("  Mapping country...")
-        df['country_id'] = df['country'].apply(map_country_id)
+    # ------------------------------
+    # Power BI summary tables
+    # ------------------------------
+    ensure_aggregate_tables(cur, table)
+    return encoded
+
+
+# ------------------------------
+# Pipeline stages
+# ------------------------------
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def open_form_export(form, last_submission_time, auth=None, from_cache=False, spool=False, cache=KOBO_CACHE):
+    """Stream of the form's export body, or None when it is unchanged and already loaded"""
+    if from_cache:
+        say(form, "Replaying the cached export snapshot...")
+        return export_cache.open_snapshot(KOBO_CACHE_DIR, form["url"])
+
+    say(form, "Fetching data from KoboToolbox...")
+    export_stream = open_export(form["url"], watermark_query(last_submission_time) if KOBO_INCREMENTAL else None,
+                                auth=auth, cache=cache)
+    if export_stream is None:
+        say(form, "[OK] Export unchanged since the last load, skipping transform and load")
+    elif spool:
+        export_stream = spool_export(export_stream)
+    return export_stream
+
+
+def extract(form, run_metrics, last_submission_time=None, from_cache=False, spool=False, cache=KOBO_CACHE,
+            staged_dates=None):
+    """
+    Chunks of a form's submissions as DataFrames, and the export stream to
+    close once they are consumed (None for the json extractor and the
+    staging store). Chunks are None when the export is unchanged and already
+    loaded. staged_dates=(since, until) reads the staging store instead of
+    Kobo; its chunks are already mapped.
+    """
+    auth = HTTPBasicAuth(form["username"], form["password"])
+    if staged_dates is not None:
+        if not KOBO_STAGING_DIR:
+            raise Exception("--from-staging needs KOBO_STAGING_DIR")
+        say(form, f"Reading staged submissions from {KOBO_STAGING_DIR}...")
+        chunks = staging.iter_staged_chunks(KOBO_STAGING_DIR, form["table"], since=staged_dates[0],
+                                            until=staged_dates[1], chunksize=KOBO_CHUNK_SIZE)
+        export_stream = None
+    elif form["extractor"] == "json":
+        if from_cache:
+            raise Exception("--from-cache replays CSV export snapshots, the json extractor has none")
+        say(form, "Fetching submissions from the KoboToolbox data API...")
+        chunks = iter_submission_frames(form["url"], auth=auth,
+                                        params=watermark_query(last_submission_time) if KOBO_INCREMENTAL else None)
+        export_stream = None
     else:
-        print("  WARNING: country column not found")
+        with run_metrics.stage(form["name"], "fetch"):
+            export_stream = open_form_export(form, last_submission_time, auth, from_cache, spool, cache)
+        if export_stream is None:
+            return None, None
+        chunks = iter_export_chunks(export_stream)
 
-    # Prepare records for insertion
-    print(f"Preparing {len(df)} records for insertion...")
-    records = []
-    skipped = 0
-    for idx, (_, row) in enumerate(df.iterrows()):
-        try:
-            # Handle timestamp columns safely - convert to None if invalid
-            # For pandas Series, use bracket notation and try/except
-            start = None
-            end = None
-            date = None
-            
-            try:
-                if "start" in df.columns and pd.notna(row["start"]):
-                    start = pd.to_datetime(row["start"])
-            except:
-                pass
-                    
-            try:
-                if "end" in df.columns and pd.notna(row["end"]):
-                    end = pd.to_datetime(row["end"])
-            except:
-                pass
-            
-            # Extract date from submission_time
-            try:
-                if "submission_time" in df.columns and pd.notna(row["submission_time"]):
-                    date = pd.to_datetime(row["submission_time"]).date()
-            except:
-                pass
-            
-            # Helper function to safely get value from Series
-            def safe_get_col(col_name):
-                try:
-                    if col_name in df.columns:
-                        val = row[col_name]
-                        return val if pd.notna(val) else None
-                except:
-                    pass
-                return None
-            
-            record = (
-                start, end, date,
-                safe_get_col("gender_id"), 
-                safe_get_col("age_group_id"), 
-                safe_get_col("education_id"), 
-                safe_get_col("country_id"),
-                safe_get_col("heard_gender_inclusion"), safe_get_col("confidence_understanding"),
-                safe_get_col("definition_equal_rights"), safe_get_col("definition_only_women"),
-                safe_get_col("practiced_in_country"), safe_get_col("importance_in_society"),
-                safe_get_col("personal_exclusion"), safe_get_col("witnessed_exclusion"), safe_get_col("barriers_exist"),
-                safe_get_col("govt_create_policies"), safe_get_col("govt_provide_education"),
-                safe_get_col("govt_support_groups"), safe_get_col("govt_equal_representation")
-            )
-            records.append(record)
-        except Exception as e:
-            skipped += 1
-            if skipped <= 3:  # Only print first 3 warnings
-                print(f"  Warning: Row {idx} skipped - {e}")
-    
-    if skipped > 3:
-        print(f"  ... and {skipped - 3} more rows skipped")
-    print(f"Total valid records: {len(records)}")
+    # Each chunk read (download and CSV parse, or data.json page) is a stage pass
+    return run_metrics.timed_chunks(form["name"], "read", chunks), export_stream
+
+
+def map_columns(form, df, schema=None):
+    """
+    Rename an export chunk's columns to database columns in place. Headers
+    are identical in every chunk, so the mapping resolved for the first one
+    is returned and passed back in for the next ones.
+    """
+    clean_column_names(df)
+
+    if schema is None:
+        say(form, "Mapping KoboToolbox columns to database schema...")
+        schema, cached = resolve_schema(df.columns, cache_path=KOBO_SCHEMA_CACHE)
+        print_schema_report(schema)
+        say(form, f"Renamed {len(schema['rename'])} columns{' (cached for this header row)' if cached else ''}")
+
+    df.rename(columns=schema["rename"], inplace=True)
+
+    # Convert date column
+    if "Date" in df.columns:
+        df.rename(columns={"Date": "date"}, inplace=True)
+    return schema
+
+
+def _check_first_chunk(form, df):
+    if "submission_uuid" not in df.columns:
+        say(form, "  WARNING: _uuid column not found, responsibilities and actions can't be linked to respondents")
+
+    if len(df) > 0:
+        say(form, "\nVerifying data in DataFrame:")
+        first_row = df.iloc[0]
+        say(form, f"  gender: {first_row['gender'] if 'gender' in df.columns else 'NOT FOUND'}")
+        say(form, f"  heard_gender_inclusion: {first_row['heard_gender_inclusion'] if 'heard_gender_inclusion' in df.columns else 'NOT FOUND'}")
+        say(form, f"  confidence_understanding: {first_row['confidence_understanding'] if 'confidence_understanding' in df.columns else 'NOT FOUND'}")
 
+
+def _collect(form, result, run_metrics, malformed=()):
+    """
+    Record a transform_chunk result's unmatched values, validation issues and
+    stage timings, adding the lines skipped while reading its chunk to its
+    rejected rows
+    """
+    name = form["name"]
+    merge_unmatched(result["unmatched"])
+    run_metrics.add(name, result["stages"])
+    for stage in result["stages"]:
+        if stage["stage"] == "transform.filter":
+            run_metrics.count(name, "skipped_before_watermark", stage["rows_in"] - stage["rows_out"])
+    if malformed:
+        result["issues"][MALFORMED_LINE] = len(malformed)
+        result["rejected"] = pd.concat([frame for frame in (malformed_frame(malformed), result["rejected"])
+                                        if frame is not None], ignore_index=True)
+    # unmapped_<column> issues are counted from the unmatched values below
+    for reason, count in result["issues"].items():
+        if not reason.startswith("unmapped_"):
+            run_metrics.count(name, reason, count)
+    for column, values in result["unmatched"].items():
+        run_metrics.count(name, f"unmapped_{column}", sum(values.values()))
+    if result["rejected"] is not None:
+        run_metrics.count(name, "rejected", len(result["rejected"]))
+    return result
+
+
+def transform_chunks(form, chunks, run_metrics, transform_pool=None, last_submission_time=None,
+                     last_kobo_id=None, encode_answers=False, staging_writer=None, mapped=False):
+    """
+    Map and transform export chunks, yielding transform_chunk results in
+    export order. With a transform_pool, up to KOBO_TRANSFORM_WORKERS chunks
+    are transformed while the caller loads the current one. Mapped chunks
+    are also appended to staging_writer when there is one; it is closed
+    when the generator is, even if the load stopped early.
+    """
     try:
-        execute_values(cur, insert_sql, records, page_size=1000)
-        conn.commit()
-        print(f"[OK] Inserted {len(records)} rows into {schema_name}.{table_name}")
+        yield from _transform_chunks(form, chunks, run_metrics, transform_pool, last_submission_time,
+                                     last_kobo_id, encode_answers, staging_writer, mapped)
+    finally:
+        if staging_writer is not None:
+            # Buffered rows are written even when loading them failed
+            with run_metrics.stage(form["name"], "staging"):
+                staging_writer.close()
+
+
+def _transform_chunks(form, chunks, run_metrics, transform_pool, last_submission_time, last_kobo_id,
+                      encode_answers, staging_writer, mapped):
+    schema = None
+    pending = deque()
+    for chunk_number, df in enumerate(chunks, start=1):
+        # Handled here rather than shipped to a worker with the chunk
+        malformed = df.attrs.pop("malformed_lines", [])
+        if not mapped:
+            with run_metrics.stage(form["name"], "map_columns", rows_in=len(df)) as stage:
+                schema = map_columns(form, df, schema)
+                stage["rows_out"] = len(df)
+        if chunk_number == 1:
+            _check_first_chunk(form, df)
+        if staging_writer is not None:
+            with run_metrics.stage(form["name"], "staging", rows_in=len(df)) as stage:
+                stage["rows_out"] = staging_writer.append(df)
+
+        say(form, f"Chunk {chunk_number}: preparing {len(df)} records for insertion...")
+        args = (df, list(MULTI_SELECT), last_submission_time, last_kobo_id, encode_answers,
+                chunk_number == 1 and not form["log_prefix"], KOBO_REJECT_REASONS)
+        if transform_pool is None:
+            # Worker processes time their own stages but can't be profiled from here
+            with run_metrics.profiled("transform"):
+                pending.append((_completed(transform_chunk(*args)), malformed))
+        else:
+            pending.append((transform_pool.submit(transform_chunk, *args), malformed))
+
+        # Release the chunk before the next one is parsed
+        del df
+
+        # Keep the worker processes busy while holding only a few chunks in memory
+        while len(pending) > KOBO_TRANSFORM_WORKERS:
+            future, malformed = pending.popleft()
+            yield _collect(form, future.result(), run_metrics, malformed)
+
+    while pending:
+        future, malformed = pending.popleft()
+        yield _collect(form, future.result(), run_metrics, malformed)
+
+
+def load_records(cur, form, encoder, records, rows, run_metrics, link_legacy=False):
+    """
+    Insert a chunk's fact rows, skipping rows that are already loaded. With
+    link_legacy, rows loaded before submission_uuid and row_fingerprint
+    existed are first given those of the identical rows of the chunk, which
+    are then not inserted again. Returns the (id, submission_uuid, date) of
+    the inserted rows and the dates of the legacy rows linked.
+    """
+    table = form["table"]
+    name = form["name"]
+
+    # Rows whose fingerprint is already loaded are dropped before anything is sent
+    with run_metrics.stage(name, "load.dedupe", rows_in=len(records)) as stage:
+        records = select_new_rows(cur, f"{schema_name}.{table}", records)
+        stage["rows_out"] = len(records)
+    run_metrics.count(name, "skipped_already_loaded", stage["rows_in"] - stage["rows_out"])
+    if encoder is not None and len(records):
+        with run_metrics.stage(name, "load.encode", rows_in=len(records)) as stage:
+            encoder.encode(cur, records)
+            stage["rows_out"] = len(records)
+    linked_dates = set()
+    if link_legacy and len(records):
+        # Compared after encoding, in the representation the table stores
+        with run_metrics.stage(name, "load.link_legacy", rows_in=len(records)) as stage:
+            linked = link_legacy_rows(cur, f"{schema_name}.{table}", LOAD_COLUMNS, records,
+                                      ["submission_uuid", "row_fingerprint"], engine=PG_LOAD_ENGINE)
+            is_linked = records["row_fingerprint"].isin(linked)
+            linked_dates = set(records.loc[is_linked, "date"])
+            records = records[~is_linked]
+            stage["rows_out"] = len(linked)
+        run_metrics.count(name, "linked_legacy_rows", len(linked))
+
+    try:
+        inserted = []
+        if len(records):
+            with run_metrics.stage(name, "load.insert", rows_in=len(records)) as stage:
+                inserted = load_rows(cur, f"{schema_name}.{table}", LOAD_COLUMNS, records,
+                                     engine=PG_LOAD_ENGINE, returning=["id", "submission_uuid", "date"])
+                stage["rows_out"] = len(inserted)
+            # Conflicts on submission_uuid: the submission was loaded with different content
+            run_metrics.count(name, "skipped_on_conflict", len(records) - len(inserted))
+        say(form, f"[OK] Inserted {len(inserted)} of {rows} rows into {schema_name}.{table}")
     except Exception as insert_err:
-        print(f"[ERROR] Failed to insert records: {insert_err}")
+        say(form, f"[ERROR] Failed to insert records: {insert_err}")
         # Print first record for debugging
-        if records:
-            print(f"Sample record: {records[0]}")
-        conn.rollback()
+        if len(records):
+            say(form, f"Sample record: {tuple(records.iloc[0])}")
         raise
+    return inserted, linked_dates
 
-    # ------------------------------
-    # Build respondent lookup for multi-select tables
-    # ------------------------------
-    cur.execute(f"""
-    SELECT id, start, "end", gender_id, age_group_id, education_id, country_id
-    FROM {schema_name}.{table_name};
-    """)
-    respondent_lookup = {
-        (r[1], r[2], r[3], r[4], r[5], r[6]): r[0] for r in cur.fetchall()
-    }
 
-    # ------------------------------
-    # Insert responsibility_responses
-    # ------------------------------
-    responsibility_sql = f"""
-    INSERT INTO {schema_name}.{table6_name} (respondent_id, responsibility_option)
-    VALUES %s ON CONFLICT DO NOTHING;
+def load_children(cur, form, lookups, options, inserted, run_metrics):
     """
-    responsibility_records = []
-    for _, row in df.iterrows():
-        key = (row.get("start"), row.get("end"), row.get("gender_id"),
-               row.get("age_group_id"), row.get("education_id"), row.get("country_id"))
-        respondent_id = respondent_lookup.get(key)
-        if respondent_id:
-            for option in split_options(row.get("responsibility_responses")):
-                responsibility_records.append((respondent_id, option))
-
-    if responsibility_records:
-        execute_values(cur, responsibility_sql, responsibility_records, page_size=1000)
-        conn.commit()
-        print(f"[OK] Inserted {len(responsibility_records)} responsibility responses")
+    Insert the multi-select options of the inserted fact rows into the bridge
+    tables. Returns the number of child rows per question.
+    """
+    table = form["table"]
+
+    # Submissions that were already loaded conflict on submission_uuid and
+    # return nothing, so their child rows are not inserted twice
+    respondent_ids = {submission_uuid: respondent_id for respondent_id, submission_uuid, _ in inserted
+                      if submission_uuid is not None}
+
+    children = {}
+    for question, question_options in options.items():
+        with run_metrics.stage(form["name"], "load.options", rows_in=len(question_options)) as stage:
+            child = build_child_frame(question_options, respondent_ids)
+            if len(child):
+                child = encode_options(cur, lookups[question], child)
+                load_rows(cur, f"{schema_name}.{bridge_table(table, question)}", ["respondent_id", "option_id"],
+                          child, engine=PG_LOAD_ENGINE)
+            stage["rows_out"] = len(child)
+        children[question] = len(child)
+    return children
+
+
+def load_rejected(cur, form, rejected, run_metrics):
+    """Quarantine a chunk's rejected rows in rejected_submissions. Returns the number of rows rejected"""
+    with run_metrics.stage(form["name"], "load.rejected", rows_in=len(rejected)) as stage:
+        stage["rows_out"] = save_rejected(cur, form["url"], form["table"], rejected)
+    say(form, f"[OK] Quarantined {stage['rows_out']} of {len(rejected)} rejected rows in {schema_name}.{table17_name}"
+              f"{' (the others were already there)' if stage['rows_out'] < len(rejected) else ''}")
+    return len(rejected)
+
+
+def load_chunk(cur, form, encoder, lookups, result, run_metrics, link_legacy=False):
+    """Insert one transformed chunk into the form's tables. Returns (fact rows, child rows per question, dates)"""
+    inserted, linked_dates = load_records(cur, form, encoder, result["records"], result["rows"], run_metrics,
+                                          link_legacy)
+    children = load_children(cur, form, lookups, result["options"], inserted, run_metrics)
+    # Linked legacy rows count in the summaries of their dates too
+    return len(inserted), children, {date for _, _, date in inserted} | linked_dates
 
-    # ------------------------------
-    # Insert prioritized_actions
-    # ------------------------------
-    action_sql = f"""
-    INSERT INTO {schema_name}.{table7_name} (respondent_id, action_option)
-    VALUES %s ON CONFLICT DO NOTHING;
+
+# ------------------------------
+# Load one form
+# ------------------------------
+def load_form(form, pool, run_metrics, transform_pool=None, from_cache=False, spool=False, staged_dates=None):
+    """
+    Fetch, transform and load one form. Chunks commit one at a time; a
+    failure rolls back the current chunk of this form only and is returned
+    rather than raised, so the other forms carry on. staged_dates=(since,
+    until) loads the staging store instead, ignoring the watermark.
+    """
+    table = form["table"]
+    name = form["name"]
+    summary = {"form": name, "table": table, "records": 0, "rejected": 0, "error": None,
+               **{question: 0 for question in MULTI_SELECT}}
+    export_stream = None
+    try:
+        last_submission_time, last_kobo_id = None, None
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            encoder = AnswerEncoder() if answers_encoded(cur, table) else None
+            partitions = MonthlyPartitions(table) if is_partitioned(cur, table) else None
+            link_legacy = has_legacy_rows(cur, f"{schema_name}.{table}")
+            if link_legacy:
+                say(form, "Linking rows loaded before submission_uuid and row_fingerprint existed to the export...")
+            if KOBO_INCREMENTAL and staged_dates is None:
+                last_submission_time, last_kobo_id = read_watermark(cur, form["url"], table)
+                if last_submission_time is not None:
+                    say(form, f"Incremental sync: loading submissions after {last_submission_time} (_id > {last_kobo_id})")
+                else:
+                    say(form, "Incremental sync: no watermark stored yet, loading the full export")
+            cur.close()
+            conn.commit()
+
+        # The download happens without holding a database connection
+        chunks, export_stream = extract(form, run_metrics, last_submission_time, from_cache, spool,
+                                        staged_dates=staged_dates)
+        if chunks is None:
+            return summary
+        staging_writer = None
+        if KOBO_STAGING_DIR and staged_dates is None:
+            staging_writer = staging.StagingWriter(KOBO_STAGING_DIR, table, staging.run_id(),
+                                                   last_submission_time, last_kobo_id)
+
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            results = None
+            try:
+                lookups = option_lookups()
+                touched_dates = set()
+
+                # ------------------------------
+                # Stream the export chunk by chunk
+                # ------------------------------
+                results = transform_chunks(form, chunks, run_metrics, transform_pool,
+                                           last_submission_time, last_kobo_id, encoder is not None,
+                                           staging_writer, mapped=staged_dates is not None)
+                for result in results:
+                    if result["records"] is not None and partitions is not None:
+                        # Committed on their own: creating a partition locks the whole table
+                        with run_metrics.stage(name, "load.partitions") as stage:
+                            created = partitions.ensure(cur, result["records"]["date"])
+                            conn.commit()
+                            stage["rows_out"] = len(created)
+                        for month in created:
+                            say(form, f"[OK] Created partition {partition_name(table, month)}")
+                    if result["records"] is not None:
+                        records, children, dates = load_chunk(cur, form, encoder, lookups, result, run_metrics,
+                                                              link_legacy)
+                        summary["records"] += records
+                        for question, count in children.items():
+                            summary[question] += count
+                        touched_dates.update(dates)
+                    if result["rejected"] is not None:
+                        summary["rejected"] += load_rejected(cur, form, result["rejected"], run_metrics)
+                    if KOBO_INCREMENTAL and staged_dates is None and result["rows"]:
+                        save_watermark(cur, form["url"], table, *result["watermark"])
+
+                    # The fact rows, their child rows, the rejected rows and the watermark commit together
+                    with run_metrics.stage(name, "commit"):
+                        conn.commit()
+
+                # ------------------------------
+                # Refresh the summary tables for the dates this load touched
+                # ------------------------------
+                if touched_dates:
+                    with run_metrics.stage(name, "aggregates", rows_in=len(touched_dates)) as stage:
+                        refreshed = refresh_aggregates(cur, touched_dates, table)
+                        conn.commit()
+                        stage["rows_out"] = refreshed
+                    say(form, f"[OK] Refreshed summary tables for {len(touched_dates)} dates ({refreshed} rows)")
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                if results is not None:
+                    # Stops the transform and writes what the staging writer buffered
+                    results.close()
+                cur.close()
+
+        if (KOBO_CACHE or from_cache) and export_stream is not None:
+            export_cache.mark_loaded(KOBO_CACHE_DIR, form["url"])
+    except Exception as e:
+        say(form, f"[ERROR] {e}")
+        summary["error"] = str(e)
+    finally:
+        if export_stream is not None:
+            export_stream.close()
+    return summary
+
+
+def dry_run_form(form, run_metrics, from_cache=False, staged_dates=None):
     """
-    action_records = []
-    for _, row in df.iterrows():
-        key = (row.get("start"), row.get("end"), row.get("gender_id"),
-               row.get("age_group_id"), row.get("education_id"), row.get("country_id"))
-        respondent_id = respondent_lookup.get(key)
-        if respondent_id:
-            for action in split_options(row.get("prioritized_actions")):
-                action_records.append((respondent_id, action))
-
-    if action_records:
-        execute_values(cur, action_sql, action_records, page_size=1000)
-        conn.commit()
-        print(f"[OK] Inserted {len(action_records)} prioritized actions")
-
-except Exception as e:
-    print("[ERROR]", e)
-    if conn:
-        conn.rollback()
-finally:
-    if cur:
-        cur.close()
-    if conn:
-        conn.close()
-    print("[OK] Data successfully loaded into PostgreSQL!")
+    Fetch, map and transform one form without connecting to PostgreSQL or
+    touching the export cache or staging store, to check an export's
+    headers and values.
+    """
+    summary = {"form": form["name"], "table": form["table"], "rows": 0, "records": 0, "rejected": 0, "error": None,
+               **{question: 0 for question in MULTI_SELECT}}
+    export_stream = None
+    try:
+        chunks, export_stream = extract(form, run_metrics, from_cache=from_cache, cache=False,
+                                        staged_dates=staged_dates)
+        for result in transform_chunks(form, chunks, run_metrics, mapped=staged_dates is not None):
+            summary["rows"] += result["rows"]
+            if result["records"] is not None:
+                summary["records"] += len(result["records"])
+            if result["rejected"] is not None:
+                summary["rejected"] += len(result["rejected"])
+            for question, options in result["options"].items():
+                summary[question] += len(options)
+    except Exception as e:
+        say(form, f"[ERROR] {e}")
+        summary["error"] = str(e)
+    finally:
+        if export_stream is not None:
+            export_stream.close()
+    return summary
+
+
+def fetch_form(form):
+    """Download a form's CSV export into the cache without loading it. Returns whether it changed"""
+    if form["extractor"] == "json":
+        say(form, "  WARNING: json extractor forms are read page by page while loading, nothing to fetch")
+        return False
+    say(form, "Fetching data from KoboToolbox...")
+    changed, _ = refresh_snapshot(form["url"], auth=HTTPBasicAuth(form["username"], form["password"]))
+    say(form, f"[OK] {'Stored a new' if changed else 'Kept the cached'} export snapshot")
+    return changed
+
+
+# ------------------------------
+# Runs
+# ------------------------------
+def _finish_run(run_metrics, report):
+    """Print the unmatched values and stage timings, and write the run report"""
+    for column, values in unmatched_report().items():
+        print(f"  WARNING: {sum(values.values())} {column} values did not match a lookup ID: {list(values)[:10]}")
+
+    print_stage_report(report)
+    if PIPELINE_REPORT_DIR:
+        print(f"Run report written to {run_metrics.write_report(report, PIPELINE_REPORT_DIR)}")
+
+
+def _in_threads(function, forms):
+    with ThreadPoolExecutor(max_workers=max(1, min(KOBO_FETCH_WORKERS, len(forms)))) as threads:
+        return list(threads.map(function, forms))
+
+
+def run(forms=None, from_cache=False, staged_dates=None):
+    """
+    Fetch, transform and load every form into PostgreSQL and return the run
+    report. staged_dates=(since, until) loads the staging store instead of
+    Kobo, either bound being None for open. Holds no state between calls, so
+    a long-running process can call it repeatedly.
+    """
+    if PG_LOAD_ENGINE not in LOAD_ENGINES:
+        raise Exception(f"PG_LOAD_ENGINE must be one of {sorted(LOAD_ENGINES)}, got {PG_LOAD_ENGINE!r}")
+
+    forms = forms or load_forms()
+    reset_unmatched()
+    run_metrics = RunMetrics(profile=PIPELINE_PROFILE, trace_memory=PIPELINE_TRACEMALLOC)
+    print(f"Uploading data to PostgreSQL ({len(forms)} form{'s' if len(forms) > 1 else ''})...")
+    pool = ConnectionPool(PG_POOL_SIZE)
+    transform_pool = None
+    summaries = []
+    try:
+        # Tables are created up front, one form after the other, so parallel
+        # loads never race on CREATE TABLE IF NOT EXISTS
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            ensure_shared_tables(cur)
+            for form in forms:
+                ensure_form_tables(cur, form["table"])
+            cur.close()
+            conn.commit()
+
+        if KOBO_TRANSFORM_WORKERS > 0:
+            # forkserver workers don't inherit the locks of the fetching threads
+            transform_pool = ProcessPoolExecutor(max_workers=KOBO_TRANSFORM_WORKERS,
+                                                 mp_context=multiprocessing.get_context("forkserver"))
+
+        spool = len(forms) > 1
+        summaries = _in_threads(lambda form: load_form(form, pool, run_metrics, transform_pool, from_cache, spool,
+                                                       staged_dates),
+                                forms)
+        report = run_metrics.report(summaries)
+        if PG_SAVE_RUNS:
+            with pool.connection() as conn:
+                cur = conn.cursor()
+                save_run(cur, report)
+                cur.close()
+                conn.commit()
+    except Exception as e:
+        print("[ERROR]", e)
+        report = run_metrics.report(summaries)
+        report["status"] = "failed"
+    finally:
+        if transform_pool is not None:
+            transform_pool.shutdown()
+        pool.close()
+
+    for summary in summaries:
+        prefix = f"[{summary['form']}] " if len(forms) > 1 else ""
+        if summary["error"]:
+            print(f"{prefix}[ERROR] Load failed, committed chunks were kept: {summary['error']}")
+            continue
+        print(f"{prefix}Total valid records: {summary['records']}")
+        if summary["rejected"]:
+            print(f"{prefix}  WARNING: {summary['rejected']} rows were rejected, see {schema_name}.{table17_name}")
+        print(f"{prefix}[OK] Inserted {summary['responsibility_responses']} responsibility responses")
+        print(f"{prefix}[OK] Inserted {summary['prioritized_actions']} prioritized actions")
+
+    _finish_run(run_metrics, report)
+    if report["status"] == "ok":
+        print("[OK] Data successfully loaded into PostgreSQL!")
+    return report
+
+
+def dry_run(forms=None, from_cache=False, staged_dates=None):
+    """Fetch and transform every form without writing anything, returning the run report"""
+    forms = forms or load_forms()
+    reset_unmatched()
+    run_metrics = RunMetrics(profile=PIPELINE_PROFILE, trace_memory=PIPELINE_TRACEMALLOC)
+    print(f"Dry run: fetching and transforming {len(forms)} form{'s' if len(forms) > 1 else ''}, nothing is written")
+    summaries = _in_threads(lambda form: dry_run_form(form, run_metrics, from_cache, staged_dates), forms)
+
+    for summary in summaries:
+        prefix = f"[{summary['form']}] " if len(forms) > 1 else ""
+        if summary["error"]:
+            print(f"{prefix}[ERROR] Dry run failed: {summary['error']}")
+            continue
+        print(f"{prefix}[OK] {summary['rows']} rows would be loaded into {summary['table']} "
+              f"({summary['records']} records, {summary['responsibility_responses']} responsibility responses, "
+              f"{summary['prioritized_actions']} prioritized actions before deduplication)")
+        if summary["rejected"]:
+            print(f"{prefix}  WARNING: {summary['rejected']} rows would be rejected")
+
+    report = run_metrics.report(summaries)
+    _finish_run(run_metrics, report)
+    return report
+
+
+def fetch(forms=None):
+    """Download every CSV form's export into the cache for a later run(from_cache=True)"""
+    forms = forms or load_forms()
+
+    def fetch_one(form):
+        try:
+            return {"form": form["name"], "changed": fetch_form(form), "error": None}
+        except Exception as e:
+            say(form, f"[ERROR] {e}")
+            return {"form": form["name"], "changed": False, "error": str(e)}
+
+    return _in_threads(fetch_one, forms)
+
+
+def main():
+    """python pipeline.py [--from-cache | --from-staging ...] is python cli.py run"""
+    return script_main("run")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
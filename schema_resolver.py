@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from transform import column_mappings
+
+# ------------------------------
+# Schema resolution (Kobo headers to database columns)
+# ------------------------------
+# A resolution is a plain dict:
+#   rename     {export header: database column}
+#   unmapped   mapping keys with no matching header
+#   ambiguous  {mapping key: [candidate headers]} - left unmapped on purpose
+#   unused     export headers no mapping key resolved to (kept as they are)
+# Resolutions are cached in memory and in a JSON file keyed by a hash of the
+# header row, so later chunks and runs against the same form version skip it.
+
+_resolved = {}
+_lock = threading.Lock()
+
+
+def normalize_header(name):
+    """Canonical header spelling: case-folded, no quotes, '&' as 'and', one '_' between words"""
+    name = str(name).casefold().replace("&", "and")
+    name = re.sub(r"['\"]", "", name)
+    name = re.sub(r"[\s_\-]+", "_", name)
+    return name.strip("_")
+
+
+def header_hash(columns, mappings=column_mappings):
+    """Hash of the header row and the mapping it is resolved against"""
+    digest = hashlib.sha256()
+    digest.update("\x1f".join(columns).encode("utf-8"))
+    digest.update(json.dumps(mappings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _index(columns):
+    """Normalized header (and last group path segment) -> headers"""
+    by_name = {}
+    by_segment = {}
+    for col in columns:
+        by_name.setdefault(normalize_header(col), []).append(col)
+        # Kobo prefixes questions inside groups with "group_name/"
+        by_segment.setdefault(normalize_header(col.rsplit("/", 1)[-1]), []).append(col)
+    return by_name, by_segment
+
+
+def _resolve(columns, mappings):
+    by_name, by_segment = _index(columns)
+    normalized_columns = [(col, normalize_header(col)) for col in columns]
+
+    candidates = {}
+    for kobo_col in mappings:
+        if kobo_col in columns:
+            candidates[kobo_col] = [kobo_col]
+            continue
+        key = normalize_header(kobo_col)
+        found = by_name.get(key) or by_segment.get(key)
+        if not found:
+            # Only a header that contains the whole key counts; the reverse
+            # (a short header inside a long key) is how "end" matched "gender"
+            found = [col for col, normalized in normalized_columns if key in normalized]
+        candidates[kobo_col] = found
+
+    # A header claimed by more than one mapping key is ambiguous for all of them
+    claims = {}
+    for kobo_col, found in candidates.items():
+        if len(found) == 1:
+            claims.setdefault(found[0], []).append(kobo_col)
+
+    rename = {}
+    unmapped = []
+    ambiguous = {}
+    for kobo_col, found in candidates.items():
+        if not found:
+            unmapped.append(kobo_col)
+        elif len(found) > 1 or len(claims[found[0]]) > 1:
+            ambiguous[kobo_col] = found
+        else:
+            rename[found[0]] = mappings[kobo_col]
+
+    unused = [col for col in columns if col not in rename]
+    return {"rename": rename, "unmapped": unmapped, "ambiguous": ambiguous, "unused": unused}
+
+
+def _load_cache_file(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _store_cache_file(cache_path, key, resolution):
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    cached = _load_cache_file(cache_path)
+    cached[key] = resolution
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cached, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+
+def resolve_schema(columns, mappings=column_mappings, cache_path=None):
+    """
+    Resolve export headers against mappings in one pass over a normalized
+    header index. Returns (resolution, cached) where cached tells whether the
+    resolution came from the in-memory or on-disk cache.
+    """
+    columns = list(columns)
+    key = header_hash(columns, mappings)
+    # Forms loading in parallel threads share the cache file
+    with _lock:
+        if key in _resolved:
+            return _resolved[key], True
+
+        resolution = _load_cache_file(cache_path).get(key)
+        cached = resolution is not None
+        if resolution is None:
+            resolution = _resolve(columns, mappings)
+            if cache_path:
+                _store_cache_file(cache_path, key, resolution)
+
+        _resolved[key] = resolution
+        return resolution, cached
+
+
+def print_schema_report(resolution, mappings=column_mappings):
+    """Print mapped, unmapped and ambiguous columns of a resolution"""
+    for actual_col, db_col in resolution["rename"].items():
+        print(f"  Mapped: {actual_col} -> {db_col}")
+    for kobo_col in resolution["unmapped"]:
+        print(f"  WARNING: no export column for {kobo_col} ({mappings.get(kobo_col)})")
+    for kobo_col, found in resolution["ambiguous"].items():
+        print(f"  WARNING: {kobo_col} ({mappings.get(kobo_col)}) is ambiguous between {found}, left unmapped")
+    if resolution["unused"]:
+        print(f"  Export columns kept under their own name: {resolution['unused'][:10]}{'...' if len(resolution['unused']) > 10 else ''}")
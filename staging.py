@@ -0,0 +1,251 @@
+import os
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from transform import ANSWER_COLUMNS, ID_MAPPINGS, filter_new_submissions, parse_timestamps
+
+# ------------------------------
+# Parquet staging store
+# ------------------------------
+# Mapped export chunks (database column names, answers as exported, before
+# any lookup) are appended to <staging dir>/<table>/submission_date=<date>/
+# as Parquet files, one set per run. Rows an earlier run already staged with
+# the same content are skipped, so the store grows with new and edited
+# submissions rather than with every run. A submission staged by several
+# runs (edited in Kobo in between) is read back as its latest copy, so the
+# store can be replayed into PostgreSQL or analysed without fetching from
+# Kobo and parsing CSV again.
+
+PARTITION_COLUMN = "submission_date"
+RUN_COLUMN = "staged_run"
+# 64-bit hash of a staged row's columns, to recognize rows staged before
+ROW_HASH_COLUMN = "staged_row_hash"
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.date32())]), flavor="hive")
+
+# Rows buffered per form before a write, so a run leaves a few files per date
+# rather than one per chunk and date
+FLUSH_ROWS = 100_000
+
+# Low-cardinality text columns, read back as pandas categories
+CATEGORY_COLUMNS = ([source for source, _, _ in ID_MAPPINGS] + ANSWER_COLUMNS
+                    + ["responsibility_responses", "prioritized_actions"])
+
+
+def run_id():
+    """Identifier of this run's staged rows; later runs sort after earlier ones"""
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def _table_dir(staging_dir, table):
+    return os.path.join(staging_dir, table)
+
+
+def _as_text(column):
+    """Values as strings, missing values kept missing (pandas 2 casts NaN to "nan")"""
+    return column.astype("str").where(column.notna(), None)
+
+
+def stage_frame(df, run):
+    """
+    Staged form of a mapped chunk: every column as text (Parquet stores
+    repeated values dictionary-encoded) plus the row hash, run and submission date.
+    """
+    staged = pd.DataFrame({col: df[col] if pd.api.types.is_string_dtype(df[col]) else _as_text(df[col])
+                           for col in df.columns if col != PARTITION_COLUMN}, index=df.index)
+    # Over the columns in name order, stored as a signed int64
+    hashed = pd.util.hash_pandas_object(staged[sorted(staged.columns)], index=False).to_numpy()
+    staged[ROW_HASH_COLUMN] = hashed.view("int64")
+    if "submission_time" in df.columns:
+        submitted = parse_timestamps(df["submission_time"])
+        staged[PARTITION_COLUMN] = [ts.date() if ts is not None else None for ts in submitted]
+    else:
+        staged[PARTITION_COLUMN] = None
+    staged[RUN_COLUMN] = run
+    return staged
+
+
+def staged_row_hashes(staging_dir, table):
+    """Sorted row hashes of everything staged for a fact table (files staged before row hashes have none)"""
+    dataset = open_dataset(staging_dir, table)
+    if dataset is None or ROW_HASH_COLUMN not in dataset.schema.names:
+        return np.array([], dtype=np.int64)
+    hashes = pc.drop_null(dataset.to_table(columns=[ROW_HASH_COLUMN])[ROW_HASH_COLUMN])
+    return np.unique(hashes.to_numpy())
+
+
+class StagingWriter:
+    """Buffers one form's mapped chunks and appends the rows not staged before to the store"""
+
+    def __init__(self, staging_dir, table, run, last_submission_time=None, last_kobo_id=None):
+        self.staging_dir = staging_dir
+        self.table = table
+        self.path = _table_dir(staging_dir, table)
+        self.run = run
+        self.last_submission_time = last_submission_time
+        self.last_kobo_id = last_kobo_id
+        self.staged = None
+        self.frames = []
+        self.rows = 0
+        self.files = 0
+
+    def _new_rows(self, hashes):
+        """Rows whose hash no earlier run has staged; the store's hashes are read once, on the first chunk"""
+        if self.staged is None:
+            self.staged = staged_row_hashes(self.staging_dir, self.table)
+        if not len(self.staged):
+            return np.ones(len(hashes), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.staged, hashes), len(self.staged) - 1)
+        return self.staged[positions] != hashes
+
+    def append(self, df):
+        """
+        Buffer a mapped chunk, dropping rows already covered by the incremental
+        watermark or already staged. Returns the number of rows buffered.
+        """
+        df = filter_new_submissions(df, self.last_submission_time, self.last_kobo_id)
+        staged = stage_frame(df, self.run)
+        staged = staged[self._new_rows(staged[ROW_HASH_COLUMN].to_numpy())]
+        if len(staged):
+            self.frames.append(staged)
+            self.rows += len(staged)
+        if self.rows >= FLUSH_ROWS:
+            self.flush()
+        return len(staged)
+
+    def flush(self):
+        if not self.frames:
+            return
+        frame = pd.concat(self.frames, ignore_index=True)
+        self.frames, self.rows = [], 0
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        # Columns that were empty in every buffered chunk have no type yet
+        fields = []
+        for field in table.schema:
+            if pa.types.is_null(field.type):
+                field = field.with_type(pa.date32() if field.name == PARTITION_COLUMN else pa.large_string())
+            fields.append(field)
+        table = table.cast(pa.schema(fields))
+        ds.write_dataset(
+            table, self.path, format="parquet", partitioning=PARTITIONING,
+            basename_template=f"part-{self.run}-{self.files:04d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        )
+        self.files += 1
+
+    def close(self):
+        self.flush()
+
+
+# ------------------------------
+# Reading the store
+# ------------------------------
+def open_dataset(staging_dir, table):
+    """The staged rows of a fact table as a pyarrow dataset, or None if nothing is staged"""
+    path = _table_dir(staging_dir, table)
+    if not os.path.isdir(path):
+        return None
+    files = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    if not files.files:
+        return None
+    # Runs may have staged different columns (form versions, empty columns)
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in files.get_fragments()]
+                              + [PARTITIONING.schema], promote_options="permissive")
+    return ds.dataset(path, schema=schema, format="parquet", partitioning=PARTITIONING)
+
+
+def date_filter(since=None, until=None):
+    """Partition filter for submission dates from since to until, both inclusive"""
+    expression = None
+    for bound, keep in ((since, lambda field, day: field >= day), (until, lambda field, day: field <= day)):
+        if bound is None:
+            continue
+        condition = keep(ds.field(PARTITION_COLUMN), date.fromisoformat(str(bound)))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _scan(dataset, columns, expression, rows):
+    """
+    Tables of about `rows` rows from a scan. The store holds many small files
+    (one per date and run), so their batches are combined before they are
+    converted to pandas.
+    """
+    batches, count = [], 0
+    for batch in dataset.to_batches(columns=columns, filter=expression):
+        batches.append(batch)
+        count += batch.num_rows
+        if count >= rows:
+            yield pa.Table.from_batches(batches)
+            batches, count = [], 0
+    if count:
+        yield pa.Table.from_batches(batches)
+
+
+def _latest_runs(dataset, expression):
+    """Latest run that staged each submission, keyed by a 64-bit hash of its uuid"""
+    if "submission_uuid" not in dataset.schema.names:
+        return None
+    hashes, runs = [], []
+    for table in _scan(dataset, ["submission_uuid", RUN_COLUMN], expression, 1 << 20):
+        keys = table.to_pandas()
+        keys = keys[keys["submission_uuid"].notna()]
+        hashes.append(pd.util.hash_array(keys["submission_uuid"].to_numpy(dtype=object)))
+        runs.append(keys[RUN_COLUMN].to_numpy(dtype=object))
+    if not hashes:
+        return pd.Series(dtype=object)
+    # Run ids sort in run order, so the latest run has the highest code
+    codes, run_ids = pd.factorize(np.concatenate(runs), sort=True)
+    latest = pd.Series(codes, index=np.concatenate(hashes)).groupby(level=0).max()
+    return pd.Series(np.asarray(run_ids, dtype=object)[latest.to_numpy()], index=latest.index, dtype=object)
+
+
+def _to_pandas(table):
+    """DataFrame of a scanned table, low-cardinality text columns as categories"""
+    for col in CATEGORY_COLUMNS:
+        if col in table.column_names:
+            table = table.set_column(table.schema.get_field_index(col), col, pc.dictionary_encode(table[col]))
+    return table.to_pandas()
+
+
+def iter_staged_chunks(staging_dir, table, columns=None, since=None, until=None, chunksize=None):
+    """
+    Yield the latest copy of every staged submission in DataFrames of about
+    `chunksize` rows, reading only `columns` (all by default) from the
+    partitions between since and until.
+    """
+    dataset = open_dataset(staging_dir, table)
+    if dataset is None:
+        raise Exception(f"Nothing staged for {table} in {staging_dir}")
+    expression = date_filter(since, until)
+    # Copies only need resolving once a second run has staged something
+    runs = {os.path.basename(path).split("-")[1] for path in dataset.files}
+    latest = _latest_runs(dataset, expression) if len(runs) > 1 else None
+    if columns is not None:
+        columns = [col for col in dict.fromkeys(list(columns) + ["submission_uuid", RUN_COLUMN])
+                   if col in dataset.schema.names]
+
+    for scanned in _scan(dataset, columns, expression, chunksize or 1 << 20):
+        if latest is not None:
+            # Older copies of a submission staged again by a later run are dropped
+            uuids = scanned["submission_uuid"].to_numpy(zero_copy_only=False)
+            newest = pd.Series(pd.util.hash_array(uuids)).map(latest).to_numpy(dtype=object)
+            keep = pd.isna(uuids) | (scanned[RUN_COLUMN].to_numpy(zero_copy_only=False) == newest)
+            scanned = scanned.filter(pa.array(keep))
+        if scanned.num_rows:
+            yield _to_pandas(scanned.drop_columns([col for col in (RUN_COLUMN, ROW_HASH_COLUMN)
+                                                   if col in scanned.column_names]))
+
+
+def read_staged(staging_dir, table, columns=None, since=None, until=None):
+    """The latest copy of every staged submission as one DataFrame"""
+    chunks = list(iter_staged_chunks(staging_dir, table, columns, since, until))
+    if not chunks:
+        return pd.DataFrame(columns=columns or [])
+    # Categories differ between chunks; concat falls back to text for those
+    return pd.concat(chunks, ignore_index=True)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_kobo import FakeKobo  # noqa: E402
+
+
+@pytest.fixture
+def fake_kobo():
+    """Start a local FakeKobo; call the fixture with the FakeKobo arguments"""
+    servers = []
+
+    def start(rows, **kwargs):
+        servers.append(FakeKobo(rows, **kwargs).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
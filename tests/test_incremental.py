@@ -0,0 +1,72 @@
+import json
+from datetime import datetime
+
+import pandas as pd
+
+from pipeline import watermark_query
+from transform import chunk_watermark, filter_new_submissions
+
+
+def loaded_chunk():
+    return pd.DataFrame({"_id": ["101", "102", "103"],
+                         "submission_time": ["2025-03-01T08:00:00", "2025-03-01T08:05:00", "2025-03-01T08:05:00"]})
+
+
+def test_watermark_of_a_loaded_chunk_filters_out_the_whole_chunk():
+    df = loaded_chunk()
+    last_submission_time, last_kobo_id = chunk_watermark(df)
+
+    assert (last_submission_time, last_kobo_id) == (datetime(2025, 3, 1, 8, 5), 103)
+    assert filter_new_submissions(df, last_submission_time, last_kobo_id).empty
+
+
+def test_next_export_keeps_only_submissions_after_the_watermark():
+    last_submission_time, last_kobo_id = chunk_watermark(loaded_chunk())
+    # $gte sends the watermark's second again, with submissions loaded before and after it
+    df = pd.DataFrame({"_id": ["99", "103", "104", "105"],
+                       "submission_time": ["2025-03-01T08:05:00", "2025-03-01T08:05:00", "2025-03-01T08:05:00",
+                                           "2025-03-01T09:00:00"]})
+    new = filter_new_submissions(df, last_submission_time, last_kobo_id)
+
+    assert new["_id"].tolist() == ["104", "105"]
+    assert chunk_watermark(new) == (datetime(2025, 3, 1, 9, 0), 105)
+
+
+def test_watermark_query_asks_for_the_watermark_second_onwards():
+    query = json.loads(watermark_query(datetime(2025, 3, 1, 8, 5))["query"])
+
+    assert query == {"_submission_time": {"$gte": "2025-03-01T08:05:00"}}
+
+
+def test_without_a_watermark_every_row_is_kept():
+    df = loaded_chunk()
+
+    assert watermark_query(None) is None
+    assert filter_new_submissions(df, None, None) is df
+    assert chunk_watermark(df.drop(columns=["_id", "submission_time"])) == (None, None)
+
+
+def test_watermark_compares_submission_times_in_utc():
+    df = pd.DataFrame({
+        "_id": [1, 2, 3, 4, 5],
+        "submission_time": ["2025-03-01T09:00:00+01:00", "2025-03-01T08:00:00", "2025-03-01T08:00:00",
+                            "2025-03-01T08:00:01", "2025-03-01T07:00:00"],
+    })
+    new = filter_new_submissions(df, datetime(2025, 3, 1, 8, 0, 0), 2)
+
+    # Row 1 is 08:00 UTC with a lower _id; row 3 shares the watermark's second with a higher _id
+    assert new["_id"].tolist() == [3, 4]
+
+
+def test_chunk_watermark_converts_offsets_and_ignores_invalid_times():
+    df = pd.DataFrame({"_id": ["7", "12", None],
+                       "submission_time": ["2025-03-01T10:00:00+02:00", "bad", "2025-03-01T07:30:00"]})
+
+    assert chunk_watermark(df) == (datetime(2025, 3, 1, 8, 0, 0), 12)
+
+
+def test_rows_without_a_valid_submission_time_are_left_to_validation():
+    df = pd.DataFrame({"_id": [1, 2, 3], "submission_time": [None, "yesterday", "2025-03-01T07:00:00"]})
+    new = filter_new_submissions(df, datetime(2025, 3, 1, 8, 0, 0), 10)
+
+    assert new["_id"].tolist() == [1, 2]
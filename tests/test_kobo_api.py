@@ -0,0 +1,57 @@
+import pandas as pd
+
+from fake_kobo import submission
+from kobo_api import iter_submission_frames
+from pipeline import watermark_query
+from transform import chunk_watermark, filter_new_submissions
+
+
+def read_all(fake, **kwargs):
+    return list(iter_submission_frames(fake.asset_url, **kwargs))
+
+
+def test_pages_cover_every_submission_in_id_order(fake_kobo):
+    fake = fake_kobo(250)
+    frames = read_all(fake, page_size=40, workers=3)
+
+    assert [len(frame) for frame in frames] == [40] * 6 + [10]
+    df = pd.concat(frames, ignore_index=True)
+    assert df["_id"].tolist() == list(range(1000, 1250))
+    assert df["_uuid"].is_unique
+
+
+def test_pages_have_csv_export_headers_and_labels(fake_kobo):
+    fake = fake_kobo(30)
+    df = pd.concat(read_all(fake, page_size=10, workers=2), ignore_index=True)
+
+    gender = "How do you describe your gender?"
+    assert gender in df.columns
+    assert set(df[gender].dropna()) <= {"Female", "Male", "Prefer not to say"}
+    # select_multiple choice names become comma separated labels
+    actions = df["Which actions should be prioritized?"].dropna()
+    assert actions.str.split(", ").explode().isin(["Education", "Policies", "Awareness", "Funding"]).all()
+
+
+def test_failed_pages_are_retried(fake_kobo):
+    fake = fake_kobo(120, fail_every=3)
+    df = pd.concat(read_all(fake, page_size=20, workers=2), ignore_index=True)
+
+    assert fake.failures > 0
+    assert df["_id"].tolist() == list(range(1000, 1120))
+
+
+def test_watermark_query_and_client_side_filter(fake_kobo):
+    fake = fake_kobo(200)
+    watermark = submission(100)
+    last_submission_time = pd.Timestamp(watermark["_submission_time"])
+
+    df = pd.concat(read_all(fake, params=watermark_query(last_submission_time), page_size=30, workers=2),
+                   ignore_index=True)
+    # $gte: the server starts at the watermark's own submission
+    assert df["_id"].iloc[0] == watermark["_id"]
+    assert len(df) == 100
+
+    df = df.rename(columns={"_submission_time": "submission_time"})
+    new = filter_new_submissions(df, last_submission_time, watermark["_id"])
+    assert new["_id"].tolist() == list(range(watermark["_id"] + 1, 1200))
+    assert chunk_watermark(new) == (pd.Timestamp(submission(199)["_submission_time"]).to_pydatetime(), 1199)
@@ -0,0 +1,52 @@
+from schema_resolver import resolve_schema
+
+
+def test_headers_resolve_by_exact_name_normalized_name_and_group_path():
+    columns = ["_uuid", "How do you describe your gender?", "demographics/What_is_your_age_group?", "extra"]
+    mappings = {"_uuid": "submission_uuid", "How_do_you_describe_your_gender?": "gender",
+                "What_is_your_age_group?": "age_group", "Which_country_do_you_currently_live_in?": "country"}
+    resolution, cached = resolve_schema(columns, mappings)
+
+    assert not cached
+    assert resolution["rename"] == {"_uuid": "submission_uuid", "How do you describe your gender?": "gender",
+                                    "demographics/What_is_your_age_group?": "age_group"}
+    assert resolution["unmapped"] == ["Which_country_do_you_currently_live_in?"]
+    assert resolution["ambiguous"] == {}
+    assert resolution["unused"] == ["extra"]
+    assert resolve_schema(columns, mappings) == (resolution, True)
+
+
+def test_key_matching_several_headers_is_ambiguous():
+    columns = ["mother/Age", "father/Age", "country"]
+    resolution, _ = resolve_schema(columns, {"age": "age_group", "country": "country"})
+
+    assert resolution["ambiguous"] == {"age": ["mother/Age", "father/Age"]}
+    assert resolution["rename"] == {"country": "country"}
+    assert "mother/Age" in resolution["unused"]
+
+
+def test_header_claimed_by_several_keys_is_ambiguous_for_all_of_them():
+    columns = ["What is your gender identity?", "_uuid"]
+    resolution, _ = resolve_schema(columns, {"gender": "gender", "gender_identity": "gender_identity"})
+
+    assert resolution["ambiguous"] == {"gender": ["What is your gender identity?"],
+                                       "gender_identity": ["What is your gender identity?"]}
+    assert resolution["rename"] == {}
+
+
+def test_short_header_inside_a_long_key_does_not_match():
+    resolution, _ = resolve_schema(["end", "gender"], {"end": "end", "What_is_your_gender": "gender"})
+
+    assert resolution["rename"] == {"end": "end"}
+    assert resolution["unmapped"] == ["What_is_your_gender"]
+
+
+def test_resolution_is_stored_in_the_cache_file(tmp_path):
+    cache_path = str(tmp_path / "schema_cache.json")
+    columns = ["cache_test_header"]
+    mappings = {"cache_test_header": "cached_column"}
+    resolution, cached = resolve_schema(columns, mappings, cache_path)
+
+    assert not cached
+    assert (tmp_path / "schema_cache.json").exists()
+    assert resolution["rename"] == {"cache_test_header": "cached_column"}
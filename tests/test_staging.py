@@ -0,0 +1,14 @@
+import pandas as pd
+
+from staging import PARTITION_COLUMN, stage_frame
+
+
+def test_stage_frame_keeps_missing_values_missing():
+    df = pd.DataFrame({"kobo_id": [101, None], "score": [1.5, float("nan")], "country": ["Ghana", None],
+                       "submission_time": ["2025-03-01T08:15:00", None]})
+    staged = stage_frame(df, "run")
+
+    assert staged["kobo_id"].tolist()[0] == "101.0"
+    assert staged["score"].tolist()[0] == "1.5"
+    assert staged.loc[1, ["kobo_id", "score", "country"]].isna().all()
+    assert staged[PARTITION_COLUMN].tolist()[1] is None
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from transform import CategoryNormalizer, explode_options, gender_mapping, parse_timestamps
+
+
+def test_explode_options_splits_each_cell_on_its_own_separator():
+    series = pd.Series(["Education, Policies", "Awareness;Funding", "Education Funding", None, "Policies"],
+                       index=[10, 11, 12, 13, 14])
+    options = explode_options(series)
+
+    assert options.index.tolist() == [10, 10, 11, 11, 12, 12, 14]
+    assert options.tolist() == ["Education", "Policies", "Awareness", "Funding", "Education", "Funding", "Policies"]
+
+
+def test_explode_options_drops_empty_options():
+    options = explode_options(pd.Series(["Education,, Policies,", " ", ""]))
+
+    assert options.index.tolist() == [0, 0]
+    assert options.tolist() == ["Education", "Policies"]
+
+
+def test_parse_timestamps_mixed_formats_and_invalid_values():
+    series = pd.Series(["2025-03-01T08:15:00", "2025-03-01 08:15:00", "01/03/2025 08:15", "not a date", None, float("nan")],
+                       index=list("abcdef"))
+    parsed = parse_timestamps(series)
+
+    assert parsed.index.tolist() == list("abcdef")
+    assert parsed["a"] == pd.Timestamp("2025-03-01 08:15:00")
+    assert parsed["b"] == pd.Timestamp("2025-03-01 08:15:00")
+    assert parsed["c"] is not None
+    assert parsed[["d", "e", "f"]].tolist() == [None, None, None]
+
+
+def test_parse_timestamps_keeps_each_utc_offset():
+    parsed = parse_timestamps(pd.Series(["2025-03-01T08:00:00+01:00", "2025-03-01T08:00:00+02:00"]))
+
+    assert parsed[0].utcoffset().total_seconds() == 3600
+    assert parsed[1].utcoffset().total_seconds() == 7200
+    assert parsed[0] - parsed[1] == pd.Timedelta(hours=1)
+
+
+def test_map_series_returns_ids_and_unmatched_counts():
+    normalizer = CategoryNormalizer("gender", gender_mapping)
+    ids, unmatched = normalizer.map_series(pd.Series(["Female", " male ", "Unknown", None, "Unknown", "MALE"]))
+
+    assert ids.fillna(0).tolist() == [1, 2, 0, 0, 0, 2]
+    assert unmatched == {"Unknown": 2}
+    # Counts belong to the call, not to the normalizer
+    assert normalizer.map_series(pd.Series(["Female"]))[1] == {}
@@ -0,0 +1,93 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from pipeline import MalformedLineFilter, iter_export_chunks
+from transform import ID_MAPPINGS, apply_id_mappings, build_record_frame
+from validation import count_issues, find_issues, reject_mask
+
+ID_COLUMNS = [(source, id_col) for source, id_col, _ in ID_MAPPINGS]
+
+
+def issues_of(df):
+    apply_id_mappings(df, verbose=False)
+    return find_issues(df, build_record_frame(df), ID_COLUMNS)
+
+
+def test_find_issues_flags_each_reason():
+    df = pd.DataFrame({
+        "submission_uuid": ["a", None, "a", "b"],
+        "submission_time": ["2025-03-01T08:00:00", "2025-03-01T08:00:00", None, "not a date"],
+        "start": ["2025-03-01T07:50:00", "never", None, "2025-03-01T07:50:00"],
+        "gender": ["Female", "Alien", None, "Male"],
+        "country": ["Nigeria", "Rwanda", "Ghana", "Other"],
+    })
+    issues = issues_of(df)
+
+    assert issues.index.equals(df.index)
+    assert issues["missing_uuid"].tolist() == [False, True, False, False]
+    assert issues["missing_submission_time"].tolist() == [False, False, True, False]
+    assert issues["duplicate_uuid"].tolist() == [False, False, True, False]
+    assert issues["invalid_submission_time"].tolist() == [False, False, False, True]
+    assert issues["invalid_start"].tolist() == [False, True, False, False]
+    # A missing answer isn't unmapped
+    assert issues["unmapped_gender"].tolist() == [False, True, False, False]
+    assert issues["unmapped_country"].tolist() == [False, False, True, False]
+    # Columns the chunk doesn't have aren't checked
+    assert "invalid_end" not in issues.columns
+    assert "unmapped_education" not in issues.columns
+
+
+def test_counts_and_rejected_rows():
+    df = pd.DataFrame({
+        "submission_uuid": ["a", "a", None],
+        "submission_time": ["2025-03-01T08:00:00"] * 3,
+        "gender": ["Female", "Alien", "Male"],
+    })
+    issues = issues_of(df)
+
+    assert count_issues(issues) == {"duplicate_uuid": 1, "unmapped_gender": 1, "missing_uuid": 1}
+    assert reject_mask(issues, ["missing_uuid", "duplicate_uuid"]).tolist() == [False, True, True]
+
+
+EXPORT = (b'a;b;c\n1;2;3\n"x\ny";2;3\n1;2;3;4\n\n1;2;3;4\n"q;";"5;6";7\n"q;";"5;6";7;8\n'
+          b'1;2\n"a""b;";2;3\n"m\n;x";1;2;3\n1;2;3;4')
+
+
+def test_export_chunks_leave_out_and_list_lines_with_too_many_fields():
+    chunks = list(iter_export_chunks(io.BytesIO(EXPORT), chunksize=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1, 0]
+    assert [value for chunk in chunks for value in chunk["a"].astype(str)] == ["1", "x\ny", "q;", "1", 'a"b;']
+    # Lines are numbered like pandas does: a quoted line break doesn't start a line
+    assert [chunk.attrs.get("malformed_lines", []) for chunk in chunks] == [
+        [],
+        [(4, "expected 3 fields, saw 4"), (6, "expected 3 fields, saw 4"), (8, "expected 3 fields, saw 4")],
+        [],
+        [(11, "expected 3 fields, saw 4"), (12, "expected 3 fields, saw 4")],
+    ]
+
+
+def test_lines_split_across_reads_are_counted_once():
+    for read_size in (1, 3, 7, len(EXPORT)):
+        lines = MalformedLineFilter(io.BytesIO(EXPORT), read_size=read_size)
+        kept = io.BufferedReader(lines, buffer_size=4).read()
+
+        assert kept == (b'a;b;c\n1;2;3\n"x\ny";2;3\n\n"q;";"5;6";7\n1;2\n"a""b;";2;3\n')
+        assert [number for number, _ in lines.take()] == [4, 6, 8, 11, 12]
+
+
+def test_exports_parsed_at_the_same_time_keep_their_own_lines():
+    def malformed(data):
+        return [line for chunk in iter_export_chunks(io.BytesIO(data), chunksize=50)
+                for line, _ in chunk.attrs.get("malformed_lines", [])]
+
+    header = b";".join(b"c%d" % i for i in range(30))
+    exports = [header + b"\n" + b"".join(b";".join([b"v"] * (31 if row % (form + 2) == 0 else 30)) + b"\n"
+                                         for row in range(1, 1001))
+               for form in range(4)]
+    with ThreadPoolExecutor(4) as pool:
+        found = list(pool.map(malformed, exports))
+
+    assert found == [[row + 1 for row in range(1, 1001) if row % (form + 2) == 0] for form in range(4)]
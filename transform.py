@@ -0,0 +1,569 @@
+import threading
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from metrics import measure
+from validation import count_issues, find_issues, reject_mask, rejected_frame
+
+# ------------------------------
+# Column name mappings (KoboToolbox to database)
+# ------------------------------
+column_mappings = {
+    'How_do_you_describe_your_gender?': 'gender',
+    'What_is_your_age_group?': 'age_group',
+    'What_is_your_highest_level_of_education?': 'education',
+    'Which_country_do_you_currently_live_in?': 'country',
+    "Have_you_heard_the_term_'gender_and_inclusion'_before?": 'heard_gender_inclusion',
+    'How_confident_are_you_in_your_understanding_of_gender_and_inclusion?': 'confidence_understanding',
+    'Gender_and_inclusion_refers_to_equal_rights,_opportunities,_and_respect_for_all_genders.': 'definition_equal_rights',
+    'Gender_and_inclusion_is_only_about_women.': 'definition_only_women',
+    'Do_you_think_gender_and_inclusion_is_practiced_in_your_country?': 'practiced_in_country',
+    'How_important_is_gender_and_inclusion_in_society?': 'importance_in_society',
+    'Have_you_personally_felt_excluded_or_treated_unfairly_because_of_your_gender?': 'personal_exclusion',
+    'Have_you_witnessed_someone_excluded_because_of_gender?': 'witnessed_exclusion',
+    'Are_there_barriers_to_gender_and_inclusion_in_your_country?': 'barriers_exist',
+    'Who_should_be_responsible_for_promoting_gender_and_inclusion?': 'responsibility_responses',
+    'Which_actions_should_be_prioritized?': 'prioritized_actions',
+    'The_government_should_create_and_enforce_policies_promoting_gender_and_inclusion.': 'govt_create_policies',
+    'The_government_should_provide_education_and_awareness_programs.': 'govt_provide_education',
+    'The_government_should_support_marginalized_groups_economically.': 'govt_support_groups',
+    'The_government_should_ensure_equal_gender_representation_in_leadership.': 'govt_equal_representation',
+    '_submission_time': 'submission_time',  # Add date column mapping
+    '_uuid': 'submission_uuid',  # Stable key of a Kobo submission
+}
+
+# Value mappings for categorical columns
+gender_mapping = {
+    'Female': 1,
+    'Male': 2,
+    'Prefer not to say': 3,
+    'Other': 3,
+}
+
+age_group_mapping = {
+    'Under 18': 1,
+    '18-24': 2,
+    '18–24': 2,  # en-dash variant
+    '25-34': 3,
+    '25–34': 3,  # en-dash variant
+    '35-44': 4,
+    '35–44': 4,  # en-dash variant
+    '45-54': 5,
+    '45–54': 5,  # en-dash variant
+    '55+': 6,
+    '55 +': 6,
+}
+
+education_mapping = {
+    'No formal education': 1,
+    'Primary': 2,
+    'Secondary': 3,
+    'Vocational/Technical': 4,
+    'Vocational': 4,
+    'University/College': 5,
+    'Tertiary education': 5,
+    'University': 5,
+    'College': 5,
+    'Postgraduate': 6,
+    'Graduate': 6,
+}
+
+country_mapping = {
+    'Nigeria': 1,
+    'Rwanda': 2,
+    'Other': 3,
+}
+
+# Rows of the lookup tables the IDs above point to
+LOOKUP_ROWS = {
+    "gender_lookup": [(1, 'Female'), (2, 'Male'), (3, 'Prefer not to say')],
+    "age_group_lookup": [(1, 'Under 18'), (2, '18-24'), (3, '25-34'), (4, '35-44'), (5, '45-54'), (6, '55+')],
+    "education_lookup": [(1, 'No formal education'), (2, 'Primary'), (3, 'Secondary'), (4, 'Vocational/Technical'),
+                         (5, 'University/College'), (6, 'Postgraduate')],
+    "country_lookup": [(1, 'Nigeria'), (2, 'Rwanda'), (3, 'Other')]
+}
+
+# ------------------------------
+# Dynamic multi-select splitter
+# ------------------------------
+def split_option_cells(values):
+    """
+    Split multi-select cells into lists of options, choosing the separator
+    per cell: comma, then semicolon, otherwise whitespace.
+    """
+    comma = values.str.contains(",", regex=False)
+    semicolon = values.str.contains(";", regex=False) & ~comma
+    parts = values.str.split()
+    parts = values.str.split(";").where(semicolon, parts)
+    return values.str.split(",").where(comma, parts)
+
+
+def explode_options(series):
+    """
+    Split a multi-select column into one row per selected option, keeping
+    the index of the submission each option came from.
+
+    Only the distinct cell values are split (a column holds a few hundred
+    combinations at most); rows are then expanded with numpy.
+    """
+    values = series.dropna().astype(str)
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+
+    options = split_option_cells(uniques).explode().str.strip()
+    options = options[options.notna() & (options != "")]
+
+    # Options of distinct value k are options[starts[k]:starts[k] + lengths[k]]
+    lengths = np.bincount(options.index.to_numpy(dtype=np.int64), minlength=len(uniques))
+    starts = np.cumsum(lengths) - lengths
+    row_lengths = lengths[codes]
+    rows = np.repeat(np.arange(len(codes)), row_lengths)
+    within = np.arange(len(rows)) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+    positions = np.repeat(starts[codes], row_lengths) + within
+    return pd.Series(options.to_numpy(dtype=object)[positions], index=values.index[rows], dtype=object)
+
+
+# ------------------------------
+# Map survey responses to lookup IDs
+# ------------------------------
+def normalize_category(value):
+    """Canonical spelling used for lookups: unified dashes, single spaces, case-folded"""
+    return ' '.join(str(value).replace('–', '-').replace('—', '-').split()).casefold()
+
+
+def education_keyword_fallback(normalized):
+    """Partial match for education levels that aren't spelled like any mapping key"""
+    if 'tertiary' in normalized or 'university' in normalized or 'college' in normalized:
+        return education_mapping.get('Tertiary education', education_mapping.get('University/College'))
+    if 'vocational' in normalized or 'technical' in normalized:
+        return education_mapping.get('Vocational/Technical')
+    if 'secondary' in normalized:
+        return education_mapping.get('Secondary')
+    if 'primary' in normalized:
+        return education_mapping.get('Primary')
+    if 'postgraduate' in normalized or 'graduate' in normalized:
+        return education_mapping.get('Postgraduate')
+    if 'no formal' in normalized or 'none' in normalized:
+        return education_mapping.get('No formal education')
+    return None
+
+
+class CategoryNormalizer:
+    """
+    Resolves raw survey answers to lookup IDs.
+
+    The value mapping is compiled once into an index keyed by normalize_category,
+    columns are resolved once per distinct value (pd.factorize) rather than once
+    per row, and resolved spellings are kept in an LRU cache that outlives a
+    single chunk. The cache is the only state kept between calls, so one
+    normalizer can serve chunks of several forms at once.
+    """
+
+    def __init__(self, name, mapping, fallback=None, cache_size=4096):
+        self.name = name
+        self.mapping = mapping
+        self.fallback = fallback
+        self.index = {}
+        for key, id_val in mapping.items():
+            self.index.setdefault(normalize_category(key), id_val)
+        self._resolve_cached = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, value):
+        val_str = str(value).strip()
+        if val_str in self.mapping:
+            return self.mapping[val_str]
+        normalized = normalize_category(val_str)
+        if normalized in self.index:
+            return self.index[normalized]
+        if self.fallback is not None:
+            return self.fallback(normalized)
+        return None
+
+    def resolve(self, value):
+        """Lookup ID for a single raw value, or None"""
+        if pd.isna(value):
+            return None
+        return self._resolve_cached(value)
+
+    def map_series(self, series):
+        """
+        Map a whole column to a nullable Int64 Series of lookup IDs. Returns
+        (ids, unmatched), unmatched counting the rows of each raw value
+        without an ID.
+        """
+        codes, uniques = pd.factorize(series)
+        resolved = [self.resolve(value) for value in uniques]
+
+        # Raw spellings that had no ID, weighted by how often they occur
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        unmatched = Counter({value: int(count) for value, id_val, count in zip(uniques, resolved, counts)
+                             if id_val is None})
+
+        # Missing cells have code -1, which picks the trailing None
+        ids = pd.array(resolved + [None], dtype='Int64')
+        return pd.Series(ids[codes], index=series.index), unmatched
+
+    def cache_info(self):
+        return self._resolve_cached.cache_info()
+
+
+gender_normalizer = CategoryNormalizer('gender', gender_mapping)
+age_group_normalizer = CategoryNormalizer('age_group', age_group_mapping)
+education_normalizer = CategoryNormalizer('education', education_mapping, fallback=education_keyword_fallback)
+country_normalizer = CategoryNormalizer('country', country_mapping)
+
+# Source column, ID column and normalizer for each lookup table
+ID_MAPPINGS = [
+    ('gender', 'gender_id', gender_normalizer),
+    ('age_group', 'age_group_id', age_group_normalizer),
+    ('education', 'education_id', education_normalizer),
+    ('country', 'country_id', country_normalizer),
+]
+
+
+def map_gender_id(value):
+    return gender_normalizer.resolve(value)
+
+def map_age_group_id(value):
+    return age_group_normalizer.resolve(value)
+
+def map_education_id(value):
+    return education_normalizer.resolve(value)
+
+def map_country_id(value):
+    return country_normalizer.resolve(value)
+
+
+# Run totals of the unmatched counts transform_chunk returns per chunk, per
+# source column. The form threads of a run merge into them under the lock
+merged_unmatched = {normalizer.name: Counter() for _, _, normalizer in ID_MAPPINGS}
+_merge_lock = threading.Lock()
+
+
+def unmatched_report():
+    """Raw values that didn't resolve to a lookup ID, per source column"""
+    with _merge_lock:
+        return {name: dict(counts.most_common()) for name, counts in merged_unmatched.items() if counts}
+
+
+def reset_unmatched():
+    """Forget the unmatched values of a previous run in this process"""
+    with _merge_lock:
+        for counts in merged_unmatched.values():
+            counts.clear()
+
+
+def merge_unmatched(counts):
+    """Add the unmatched counts of a transform_chunk result to the run's totals"""
+    with _merge_lock:
+        for name, values in counts.items():
+            merged_unmatched[name].update(values)
+
+
+# ------------------------------
+# Chunk transform stages
+# ------------------------------
+def clean_column_names(df):
+    """Clean column names (replace spaces, special characters)"""
+    df.columns = [col.strip().replace(" ", "_").replace("&", "and").replace("-", "_") for col in df.columns]
+    return df
+
+
+def apply_id_mappings(df, verbose=True):
+    """
+    Add gender_id, age_group_id, education_id and country_id columns to df.
+    Returns the values left without an ID and their row counts, per source column.
+    """
+    unmatched = {}
+    if verbose:
+        print("Mapping survey responses to lookup IDs...")
+        print(f"Columns before ID mapping: {df.columns.tolist()[:10]}...")
+    for source_col, id_col, normalizer in ID_MAPPINGS:
+        if source_col in df.columns:
+            if verbose:
+                print(f"  Mapping {source_col}...")
+            df[id_col], counts = normalizer.map_series(df[source_col])
+            unmatched[normalizer.name] = dict(counts)
+        elif verbose:
+            print(f"  WARNING: {source_col} column not found")
+
+    if verbose and 'age_group' in df.columns:
+        print(f"    Sample age groups: {df['age_group'].unique()[:3]}")
+
+    return unmatched
+
+
+def categorize_answers(df):
+    """
+    Store the answer columns as category dtype; each holds a handful of Likert
+    labels. build_record_frame(keep_categories=True) passes them on to
+    AnswerEncoder, which maps each category rather than each row.
+    """
+    for col in ANSWER_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+# ------------------------------
+# Vectorized record builder
+# ------------------------------
+# Columns of the blossom_academy insert payload, in insert order
+RECORD_COLUMNS = [
+    "start", "end", "date", "gender_id", "age_group_id", "education_id", "country_id",
+    "heard_gender_inclusion", "confidence_understanding", "definition_equal_rights", "definition_only_women",
+    "practiced_in_country", "importance_in_society", "personal_exclusion", "witnessed_exclusion", "barriers_exist",
+    "govt_create_policies", "govt_provide_education", "govt_support_groups", "govt_equal_representation",
+    "submission_uuid",
+]
+
+ID_COLUMNS = ["gender_id", "age_group_id", "education_id", "country_id"]
+
+# Survey answer columns stored as-is on blossom_academy
+ANSWER_COLUMNS = RECORD_COLUMNS[7:20]
+
+# Columns sent to blossom_academy: the payload plus its content fingerprint
+LOAD_COLUMNS = RECORD_COLUMNS + ["row_fingerprint"]
+
+
+def _none_column(index):
+    return pd.Series([None] * len(index), index=index, dtype=object)
+
+
+def _parse_timestamp(value):
+    """Parse a single value with pd.to_datetime, returning None if it can't be parsed"""
+    try:
+        return pd.to_datetime(value)
+    except Exception:
+        return None
+
+
+# UTC offset at the end of an ISO 8601 timestamp
+UTC_OFFSET = r"(Z|[+-]\d\d:?\d\d)$"
+
+
+def _parse_offset_group(values):
+    """
+    Timestamps of values sharing one UTC offset: one ISO 8601 call, then one
+    call inferring the format of the distinct values it rejected
+    """
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', format='ISO8601')
+    failed = parsed.isna().to_numpy()
+    parsed = parsed.to_numpy(dtype=object).copy()
+    if failed.any():
+        distinct = pd.unique(values[failed])
+        try:
+            retried = pd.to_datetime(pd.Series(distinct), errors='coerce', format='mixed').astype(object)
+            resolved = dict(zip(distinct, retried))
+        except (ValueError, TypeError):
+            # Time zone names (e.g. "EST") can still mix zones within the group
+            resolved = {value: _parse_timestamp(value) for value in distinct}
+        parsed[failed] = [resolved[value] for value in values[failed]]
+    return parsed
+
+
+def parse_timestamps(series):
+    """
+    Parse a whole column of timestamps with vectorized pd.to_datetime calls.
+    Returns an object Series of Timestamps, with None for missing or invalid values.
+
+    A datetime64 column holds a single UTC offset, so a column mixing offsets
+    (e.g. +01:00 and +02:00 from devices in Nigeria and Rwanda) is parsed in
+    one call per offset.
+    """
+    values = series.to_numpy(dtype=object)
+    present = np.flatnonzero(pd.notna(values))
+    parsed = np.full(len(values), None, dtype=object)
+    if len(present):
+        text = pd.Series(values[present], dtype=object).astype(str)
+        try:
+            parsed[present] = _parse_offset_group(text.to_numpy(dtype=object))
+        except (ValueError, TypeError):
+            offsets = text.str.extract(UTC_OFFSET, expand=False).fillna("").to_numpy(dtype=object)
+            for offset in pd.unique(offsets):
+                group = np.flatnonzero(offsets == offset)
+                parsed[present[group]] = _parse_offset_group(text.to_numpy(dtype=object)[group])
+    parsed = pd.Series(parsed, index=series.index, dtype=object)
+    return parsed.where(parsed.notna(), None)
+
+
+def build_record_frame(df, keep_categories=False):
+    """
+    Prepare the blossom_academy insert payload as a DataFrame with RECORD_COLUMNS.
+
+    Every column is converted with whole-column operations: timestamps are
+    parsed once per column, and NaN and invalid timestamps become None. With
+    keep_categories, category columns stay categories (AnswerEncoder maps
+    them before the insert) instead of becoming object columns.
+    """
+    columns = {}
+
+    for col in ("start", "end"):
+        columns[col] = parse_timestamps(df[col]) if col in df.columns else _none_column(df.index)
+
+    # Extract date from submission_time
+    if "submission_time" in df.columns:
+        submitted = parse_timestamps(df["submission_time"])
+        columns["date"] = pd.Series([ts.date() if ts is not None else None for ts in submitted],
+                                    index=df.index, dtype=object)
+    else:
+        columns["date"] = _none_column(df.index)
+
+    for col in RECORD_COLUMNS[3:]:
+        if col not in df.columns:
+            columns[col] = _none_column(df.index)
+            continue
+        values = df[col]
+        if col in ID_COLUMNS:
+            values = pd.to_numeric(values, errors='coerce').astype('Int64')
+        elif keep_categories and isinstance(values.dtype, pd.CategoricalDtype):
+            columns[col] = values
+            continue
+        values = values.astype(object)
+        columns[col] = values.where(values.notna(), None)
+
+    return pd.DataFrame(columns, columns=RECORD_COLUMNS)
+
+
+def add_row_fingerprints(records):
+    """
+    Add a row_fingerprint column to a build_record_frame result: a 64-bit hash
+    of the normalized payload row, stable across runs and processes.
+    """
+    normalized = records[RECORD_COLUMNS].astype(str)
+    hashed = pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+    # Stored as a signed BIGINT
+    records["row_fingerprint"] = hashed.view("int64")
+    return records
+
+
+def build_records(df):
+    """Prepare blossom_academy records for insertion as tuples, returning (records, skipped)"""
+    frame = build_record_frame(df)
+    records = list(zip(*(frame[col].tolist() for col in RECORD_COLUMNS)))
+    return records, 0
+
+
+def child_options(df, source_col):
+    """Explode a multi-select column into (submission_uuid, option) rows, option being the selected label"""
+    if source_col not in df.columns or "submission_uuid" not in df.columns:
+        return pd.DataFrame(columns=["submission_uuid", "option"])
+
+    options = explode_options(df[source_col])
+    return pd.DataFrame({
+        "submission_uuid": df["submission_uuid"].reindex(options.index),
+        "option": options,
+    })
+
+
+def build_child_frame(options, respondent_ids):
+    """
+    Turn child_options rows into (respondent_id, option) rows.
+
+    respondent_ids maps submission_uuid to the blossom_academy id returned by
+    the insert; submissions without an id in it are left out.
+    """
+    child = pd.DataFrame({
+        "respondent_id": options["submission_uuid"].map(respondent_ids),
+        "option": options["option"],
+    })
+    child = child[child["respondent_id"].notna()].drop_duplicates()
+    child["respondent_id"] = child["respondent_id"].astype("int64")
+    return child
+
+
+# ------------------------------
+# Incremental sync filters
+# ------------------------------
+def submission_times(df):
+    """
+    submission_time parsed like build_record_frame does, as a datetime64
+    Series comparable with the stored watermark: offsets are converted to
+    UTC (Kobo's own _submission_time is UTC without one), NaT when missing
+    or invalid.
+    """
+    parsed = pd.to_datetime(parse_timestamps(df["submission_time"]), utc=True, errors='coerce')
+    return parsed.dt.tz_localize(None)
+
+
+def filter_new_submissions(df, last_submission_time, last_kobo_id):
+    """
+    Keep only rows newer than the watermark. Rows sharing the watermark's
+    second are kept when their Kobo _id is higher than the stored one. Rows
+    without a valid submission_time can't be placed and are kept, so that
+    validation reports and rejects them instead of them disappearing here.
+    """
+    if last_submission_time is None or "submission_time" not in df.columns:
+        return df
+
+    submitted = submission_times(df)
+    newer = submitted.isna() | (submitted > last_submission_time)
+    if last_kobo_id is not None and "_id" in df.columns:
+        kobo_ids = pd.to_numeric(df["_id"], errors='coerce')
+        newer |= (submitted == last_submission_time) & (kobo_ids > last_kobo_id)
+    return df[newer].copy()
+
+
+def chunk_watermark(df):
+    """Highest (submission_time, _id) found in a chunk"""
+    last_submission_time = None
+    last_kobo_id = None
+    if "submission_time" in df.columns:
+        submitted = submission_times(df).max()
+        if pd.notna(submitted):
+            last_submission_time = submitted.to_pydatetime()
+    if "_id" in df.columns:
+        kobo_id = pd.to_numeric(df["_id"], errors='coerce').max()
+        if pd.notna(kobo_id):
+            last_kobo_id = int(kobo_id)
+    return last_submission_time, last_kobo_id
+
+
+# ------------------------------
+# Whole-chunk transform
+# ------------------------------
+def transform_chunk(df, option_columns, last_submission_time=None, last_kobo_id=None,
+                    encode_answers=False, verbose=False, reject=()):
+    """
+    Everything between a renamed export chunk and the database: watermark
+    filter, lookup IDs, record frame with fingerprints, validation and
+    multi-select options. Rows flagged with one of the `reject` reason codes
+    are returned in "rejected" rather than in "records". Module-level and
+    free of database access so it can run in a worker process; the result
+    only holds picklable frames and dicts, including the metrics.measure
+    records of its stages.
+    """
+    stages = []
+    with measure("transform.filter", stages, rows_in=len(df)) as stage:
+        df = filter_new_submissions(df, last_submission_time, last_kobo_id)
+        stage["rows_out"] = len(df)
+    # Rejected rows still move the watermark: they are kept in rejected_submissions
+    result = {"rows": len(df), "watermark": chunk_watermark(df), "records": None, "options": {},
+              "rejected": None, "issues": {}, "unmatched": {}}
+    if len(df):
+        exported = list(df.columns)
+        with measure("transform.id_mapping", stages, rows_in=len(df)) as stage:
+            result["unmatched"] = apply_id_mappings(df, verbose=verbose)
+            if encode_answers:
+                categorize_answers(df)
+            stage["rows_out"] = len(df)
+        with measure("transform.records", stages, rows_in=len(df)) as stage:
+            records = add_row_fingerprints(build_record_frame(df, keep_categories=encode_answers))
+            stage["rows_out"] = len(records)
+        with measure("transform.validate", stages, rows_in=len(df)) as stage:
+            issues = find_issues(df, records, [(source_col, id_col) for source_col, id_col, _ in ID_MAPPINGS])
+            result["issues"] = count_issues(issues)
+            rejected = reject_mask(issues, reject)
+            if rejected.any():
+                result["rejected"] = rejected_frame(df.loc[rejected, exported], issues[rejected])
+                df, records = df[~rejected], records[~rejected]
+            result["records"] = records
+            stage["rows_out"] = len(records)
+        with measure("transform.options", stages, rows_in=len(df)) as stage:
+            result["options"] = {col: child_options(df, col) for col in option_columns}
+            stage["rows_out"] = sum(len(options) for options in result["options"].values())
+    result["stages"] = stages
+    return result
@@ -0,0 +1,164 @@
+import json
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import Json, execute_values
+
+from config import schema_name, table17_name
+
+# ------------------------------
+# Chunk validation
+# ------------------------------
+# Every check runs on a whole chunk at once and yields one boolean column per
+# reason code. Rows flagged with a reason listed in KOBO_REJECT_REASONS are
+# kept out of the fact table and stored in rejected_submissions with all of
+# their reasons; the other reasons are only counted in the run report.
+#
+# Reason codes:
+#   malformed_line           CSV line with the wrong number of fields (always rejected)
+#   missing_uuid             empty _uuid
+#   missing_submission_time  empty _submission_time
+#   duplicate_uuid           _uuid already seen earlier in the chunk (the first copy is kept)
+#   invalid_<column>         start, end or submission_time that isn't a timestamp
+#   unmapped_<column>        gender, age_group, education or country without a lookup ID
+
+MALFORMED_LINE = "malformed_line"
+
+# Required columns and the reason code of a row leaving one empty. Exports
+# without the column at all are reported once by _check_first_chunk instead.
+REQUIRED_COLUMNS = {
+    "submission_uuid": "missing_uuid",
+    "submission_time": "missing_submission_time",
+}
+
+# Timestamp columns of the export and the record column they are parsed into
+TIMESTAMP_COLUMNS = {
+    "submission_time": "date",
+    "start": "start",
+    "end": "end",
+}
+
+REJECTED_COLUMNS = ["submission_uuid", "kobo_id", "line_number", "reasons", "row", "row_hash"]
+
+
+def find_issues(df, records, id_columns):
+    """
+    Boolean DataFrame with one column per reason code checked, for a mapped
+    chunk with its lookup IDs (id_columns lists the (source, id) column pairs)
+    and its build_record_frame result.
+    """
+    issues = {}
+    for col, reason in REQUIRED_COLUMNS.items():
+        if col in df.columns:
+            issues[reason] = df[col].isna().to_numpy()
+    if "submission_uuid" in df.columns:
+        uuids = df["submission_uuid"]
+        issues["duplicate_uuid"] = (uuids.notna() & uuids.duplicated()).to_numpy()
+    # build_record_frame turns values it can't parse into None
+    for col, record_col in TIMESTAMP_COLUMNS.items():
+        if col in df.columns:
+            issues[f"invalid_{col}"] = (df[col].notna() & records[record_col].isna()).to_numpy()
+    for source_col, id_col in id_columns:
+        if source_col in df.columns and id_col in df.columns:
+            issues[f"unmapped_{source_col}"] = (df[source_col].notna() & df[id_col].isna()).to_numpy()
+    return pd.DataFrame(issues, index=df.index, dtype=bool)
+
+
+def count_issues(issues):
+    """Rows flagged per reason code, leaving out reasons no row has"""
+    counts = issues.sum()
+    return {reason: int(count) for reason, count in counts.items() if count}
+
+
+def reject_mask(issues, reject):
+    """Rows flagged with at least one of the `reject` reason codes"""
+    columns = [reason for reason in issues.columns if reason in reject]
+    if not columns:
+        return np.zeros(len(issues), dtype=bool)
+    return issues[columns].to_numpy().any(axis=1)
+
+
+def _row_hashes(reasons, line_numbers, rows):
+    """64-bit hash of each rejected row and its reasons, so a rerun doesn't store it twice"""
+    texts = [json.dumps([row_reasons, line_number, row], sort_keys=True, default=str)
+             for row_reasons, line_number, row in zip(reasons, line_numbers, rows)]
+    # Stored as a signed BIGINT
+    return pd.util.hash_array(np.array(texts, dtype=object)).view("int64")
+
+
+def _rejected(submission_uuids, kobo_ids, line_numbers, reasons, rows):
+    return pd.DataFrame({
+        "submission_uuid": submission_uuids,
+        "kobo_id": pd.array(kobo_ids, dtype="Int64"),
+        "line_number": pd.array(line_numbers, dtype="Int64"),
+        "reasons": reasons,
+        "row": rows,
+        "row_hash": _row_hashes(reasons, line_numbers, rows),
+    }, columns=REJECTED_COLUMNS)
+
+
+def _nullable(values):
+    values = values.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def rejected_frame(df, issues):
+    """rejected_submissions rows for the rows of a mapped chunk, with the reasons flagged in issues"""
+    names = np.array(issues.columns, dtype=object)
+    reasons = [names[flags].tolist() for flags in issues.to_numpy()]
+    rows = df.astype(object).where(df.notna(), None).to_dict("records")
+    none = [None] * len(df)
+    submission_uuids = _nullable(df["submission_uuid"]) if "submission_uuid" in df.columns else none
+    kobo_ids = _nullable(pd.to_numeric(df["_id"], errors="coerce").astype("Int64")) if "_id" in df.columns else none
+    return _rejected(submission_uuids, kobo_ids, none, reasons, rows)
+
+
+def malformed_frame(lines):
+    """rejected_submissions rows for the (line number, parser message) of CSV lines that were skipped"""
+    return _rejected([None] * len(lines), [None] * len(lines), [number for number, _ in lines],
+                     [[MALFORMED_LINE] for _ in lines], [{"error": message} for _, message in lines])
+
+
+# ------------------------------
+# rejected_submissions table
+# ------------------------------
+def ensure_rejected_table(cur):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema_name}.{table17_name} (
+        id BIGSERIAL PRIMARY KEY,
+        source_url TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        submission_uuid TEXT,
+        kobo_id BIGINT,
+        line_number INT,
+        reasons TEXT[] NOT NULL,
+        row JSONB NOT NULL,
+        row_hash BIGINT NOT NULL,
+        rejected_at TIMESTAMP NOT NULL DEFAULT now(),
+        UNIQUE (table_name, row_hash)
+    );
+    """)
+
+
+def save_rejected(cur, source_url, table, rejected):
+    """
+    Insert rejected rows in the current transaction, skipping rows a previous
+    run already stored. Returns the number of rows inserted.
+    """
+    if rejected is None or not len(rejected):
+        return 0
+    rows = [(source_url, table, submission_uuid, kobo_id, line_number, reasons, Json(row, dumps=_dumps), row_hash)
+            for submission_uuid, kobo_id, line_number, reasons, row, row_hash
+            in zip(*(_nullable(rejected[col]) for col in REJECTED_COLUMNS))]
+    inserted = execute_values(cur, f"""
+    INSERT INTO {schema_name}.{table17_name}
+        (source_url, table_name, submission_uuid, kobo_id, line_number, reasons, row, row_hash)
+    VALUES %s
+    ON CONFLICT (table_name, row_hash) DO NOTHING
+    RETURNING id;
+    """, rows, fetch=True)
+    return len(inserted)
+
+
+def _dumps(value):
+    return json.dumps(value, default=str)